@@ -1,3 +1,3 @@
-from cda_api.application_utilities import get_logger
-from cda_api.classes.exceptions import MappingError, ColumnNotFound, TableNotFound, RelationshipError, RelationshipNotFound, SystemNotFound, ParsingError, EmptyQueryError
+from cda_api.application_utilities import get_logger, get_http_exception
+from cda_api.classes.exceptions import MappingError, ColumnNotFound, TableNotFound, RelationshipError, RelationshipNotFound, SystemNotFound, ParsingError, EmptyQueryError, CohortNotFound
 from cda_api.main import app
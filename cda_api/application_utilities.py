@@ -1,13 +1,34 @@
 import logging
 import logging.config
 import yaml
+from os import getenv
+from fastapi import HTTPException
+from sqlalchemy import exc
 
 # Function to generate logger from config file
 def get_logger(id = '') -> logging.Logger:
     with open('cda_api/config/logger.yml') as log_config_file:
         log_config = yaml.safe_load(log_config_file)
+    # LOG_LEVEL (ex. INFO) overrides the configured level so DEBUG only work (like rendering SQL) can be skipped
+    log_level = getenv('LOG_LEVEL')
+    if log_level:
+        log_config['loggers']['simple']['level'] = log_level.upper()
     logging.config.dictConfig(log_config)
     logger = logging.getLogger("simple")
     extra = {'id': id}
     logger = logging.LoggerAdapter(logger, extra)
     return logger
+
+
+# Function to convert an exception raised while handling a request into an HTTPException
+# Statement timeouts return 504, an exhausted connection pool or lost connection returns 503, and everything else 404
+def get_http_exception(error) -> HTTPException:
+    if isinstance(error, exc.TimeoutError):
+        return HTTPException(status_code=503, detail=f'Database connection pool exhausted, try again later: {error}')
+    if isinstance(error, exc.DBAPIError):
+        sqlstate = getattr(error.orig, 'sqlstate', None) or getattr(error.orig, 'pgcode', None)
+        if sqlstate == '57014':
+            return HTTPException(status_code=504, detail=f'Query exceeded the statement timeout: {error.orig}')
+        if error.connection_invalidated:
+            return HTTPException(status_code=503, detail=f'Database connection lost, try again later: {error.orig}')
+    return HTTPException(status_code=404, detail=str(error))
@@ -1,9 +1,10 @@
 from cda_api import ColumnNotFound, RelationshipNotFound, TableNotFound, get_logger
 from .ColumnInfo import ColumnInfo
 from .EntityRelationship import EntityRelationship
-from sqlalchemy import inspect, Column, func
-from cda_api.db.schema import Base
-from cda_api.db.connection import session
+from sqlalchemy import inspect, Column
+from collections import Counter
+from bisect import bisect_left
+from cda_api.db.schema import SCHEMA_SNAPSHOT
 
 setup_log = get_logger('Setup: DatabaseMap.py')
 log = get_logger('Util: DatabaseMap.py')
@@ -11,11 +12,7 @@ log = get_logger('Util: DatabaseMap.py')
 # Build Column Metadata Map
 setup_log.info('Building column_metadata map')
 
-column_metadata = Base.metadata.tables['column_metadata']
-subquery = session().query(column_metadata).subquery('json_result')
-query = session().query(func.row_to_json(subquery.table_valued()))
-result = query.all()
-result = [row for row, in result]
+result = SCHEMA_SNAPSHOT['column_metadata']
 
 COLUMN_METADATA_MAP = {}
 for row in result:
@@ -55,26 +52,57 @@ class DatabaseMap():
     def _build_column_map(self):
         setup_log.info('Building column map')
         self.column_map = {}
+        # Indexes so per-request lookups don't need to scan the column map
+        self.table_column_info_map = {}
+        self.column_uniquename_map = {}
 
-        duplicate_column_names = list(set([columnname for columnname in self.metadata_column_names
-                                            if self.metadata_column_names.count(columnname) > 1]))
+        column_name_counts = Counter(self.metadata_column_names)
+        duplicate_column_names = {columnname for columnname, count in column_name_counts.items() if count > 1}
         
         for metadata_tablename, metadata_table in self.metadata_tables.items():
             if metadata_tablename in self.entity_tablenames:
                 entity_table = self.entity_tables[metadata_tablename]
             else:
                 entity_table = None
+            self.table_column_info_map[metadata_tablename] = []
             for metadata_column in metadata_table.columns:
                 if metadata_column.name in duplicate_column_names:
                     uniquename = f'{metadata_tablename}_{metadata_column.name}'
                 else:
                     uniquename = metadata_column.name
                 
-                self.column_map[uniquename] = ColumnInfo(uniquename=uniquename,
-                                                         entity_table=entity_table, 
-                                                         metadata_table=metadata_table, 
-                                                         metadata_column=metadata_column,
-                                                         column_metadata_map=COLUMN_METADATA_MAP)
+                column_info = ColumnInfo(uniquename=uniquename,
+                                         entity_table=entity_table, 
+                                         metadata_table=metadata_table, 
+                                         metadata_column=metadata_column,
+                                         column_metadata_map=COLUMN_METADATA_MAP)
+                self.column_map[uniquename] = column_info
+                self.table_column_info_map[metadata_tablename].append(column_info)
+                self.column_uniquename_map[(metadata_tablename, metadata_column.name)] = uniquename
+
+        self._build_column_suggestion_index()
+
+    def _build_column_suggestion_index(self):
+        # Sorted uniquenames (and reversed uniquenames) let prefix and suffix matches be found with a binary search
+        self.column_order = {uniquename: i for i, uniquename in enumerate(self.column_map.keys())}
+        self.column_prefix_index = sorted(self.column_map.keys())
+        self.column_suffix_index = sorted(uniquename[::-1] for uniquename in self.column_map.keys())
+
+    def _get_prefix_matches(self, index, prefix):
+        matches = []
+        i = bisect_left(index, prefix)
+        while (i < len(index)) and index[i].startswith(prefix):
+            matches.append(index[i])
+            i += 1
+        return matches
+
+    def get_possible_columns(self, columnname):
+        ends_with = [reversed_name[::-1] for reversed_name in self._get_prefix_matches(self.column_suffix_index, columnname[::-1])]
+        starts_with = self._get_prefix_matches(self.column_prefix_index, columnname)
+        # Keep the suggestions in column map order
+        possible_cols = sorted(ends_with, key=self.column_order.get)
+        possible_cols.extend(sorted(starts_with, key=self.column_order.get))
+        return possible_cols
                 
     def _build_relationship_map(self):
         setup_log.info('Building relationship map')
@@ -92,8 +120,7 @@ class DatabaseMap():
         try: 
             return self.column_map[columnname]
         except Exception as e:
-            possible_cols = [k for k in self.column_map.keys() if k.endswith(columnname)]
-            possible_cols.extend([k for k in self.column_map.keys() if k.startswith(columnname)])
+            possible_cols = self.get_possible_columns(columnname)
             if possible_cols:
                 error_message = f'Column Not Found: {columnname}, did you mean: {possible_cols}\n{e}'
             else:
@@ -104,8 +131,7 @@ class DatabaseMap():
         try: 
             return self.column_map[columnname].metadata_column
         except Exception as e:
-            possible_cols = [k for k in self.column_map.keys() if k.endswith(columnname)]
-            possible_cols.extend([k for k in self.column_map.keys() if k.startswith(columnname)])
+            possible_cols = self.get_possible_columns(columnname)
             if possible_cols:
                 error_message = f'Column Not Found: {columnname}, did you mean: {possible_cols}\n{e}'
             else:
@@ -141,13 +167,7 @@ class DatabaseMap():
             raise TableNotFound(error_message)
 
     def get_table_column_infos(self, tablename):
-        try:
-            return [column_info for column_info in self.column_map.values() if column_info.tablename == tablename]
-        except ColumnNotFound as cnf:
-            raise cnf
-        except Exception as e:
-            error_message = f'Unable to find entity table {tablename}\n{e}'
-            raise TableNotFound(error_message)
+        return list(self.table_column_info_map.get(tablename, []))
         
     def get_uniquename_metadata_table_columns(self, tablename):
         try:
@@ -158,16 +178,10 @@ class DatabaseMap():
             raise TableNotFound(error_message)
 
     def get_column_uniquename(self, columnname, tablename):
+        if tablename not in self.table_column_info_map.keys():
+            raise TableNotFound(f'Unable to find entity table {tablename}')
         try:
-            column_infos = self.get_table_column_infos(tablename)
-            uniquename = [column_info.uniquename for column_info in column_infos if column_info.columnname == columnname][0]
-            if not uniquename:
-                error_message = f'Unable to get unique name for "{columnname}" in {tablename}'
-                raise ColumnNotFound(error_message)
-            return uniquename
-        except ColumnNotFound as cnf:
-            raise cnf
-        except TableNotFound as tnf:
-            raise tnf
-        except Exception as e:
-            raise TableNotFound(e)
\ No newline at end of file
+            return self.column_uniquename_map[(tablename, columnname)]
+        except KeyError:
+            error_message = f'Unable to get unique name for "{columnname}" in {tablename}'
+            raise ColumnNotFound(error_message)
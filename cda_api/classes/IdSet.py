@@ -0,0 +1,42 @@
+from array import array
+from bisect import bisect_left
+
+
+class IdSet():
+    def __init__(self, ids=(), is_sorted=False):
+        # Sorted unique 64 bit integers (8 bytes per id instead of a python int object per id)
+        if is_sorted:
+            self.ids = array('q', ids)
+        else:
+            self.ids = array('q', sorted(set(ids)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __contains__(self, id_alias):
+        position = bisect_left(self.ids, id_alias)
+        return (position < len(self.ids)) and (self.ids[position] == id_alias)
+
+    def __eq__(self, other):
+        return isinstance(other, IdSet) and (self.ids == other.ids)
+
+    def union(self, *others):
+        ids = set(self.ids)
+        for other in others:
+            ids.update(other.ids)
+        return IdSet(ids)
+
+    def intersection(self, *others):
+        # Filter the smallest set (already sorted) by membership in the others
+        id_sets = sorted([self, *others], key=len)
+        smallest, others = id_sets[0], [set(other.ids) for other in id_sets[1:]]
+        return IdSet((id_alias for id_alias in smallest.ids if all(id_alias in other for other in others)), is_sorted=True)
+
+    def difference(self, *others):
+        excluded = set()
+        for other in others:
+            excluded.update(other.ids)
+        return IdSet((id_alias for id_alias in self.ids if id_alias not in excluded), is_sorted=True)
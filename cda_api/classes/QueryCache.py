@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from threading import Lock
+import json
+import time
+
+
+class QueryCache():
+    def __init__(self, max_entries=1024, ttl=3600, max_bytes=None, backend=None, get_size=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # Function estimating a value's size in bytes for max_bytes (defaults to the length of its json)
+        self.get_size = get_size
+        self.backend = backend
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, size = entry
+                # Drop entries that have outlived the time to live
+                if expires_at < time.monotonic():
+                    self._remove(key)
+                else:
+                    # Mark as most recently used
+                    self._entries.move_to_end(key)
+                    return value
+
+        # Fall back to the shared backend and keep a local copy of any hit
+        if self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self._set_local(key, value)
+                return value
+        return default
+
+    def set(self, key, value):
+        self._set_local(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value, self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+        if self.backend is not None:
+            self.backend.clear()
+
+    def _set_local(self, key, value):
+        size = self._get_size(value)
+        # Values larger than the whole cache are never stored
+        if (self.max_bytes is not None) and (size > self.max_bytes):
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, size)
+            self.total_bytes += size
+            # Evict the least recently used entries
+            while (len(self._entries) > self.max_entries) or self._over_max_bytes():
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def _remove(self, key):
+        value, expires_at, size = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def _over_max_bytes(self):
+        return (self.max_bytes is not None) and (self.total_bytes > self.max_bytes)
+
+    def _get_size(self, value):
+        if self.max_bytes is None:
+            return 0
+        if self.get_size is not None:
+            return self.get_size(value)
+        return len(json.dumps(value, default=str))
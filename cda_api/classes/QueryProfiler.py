@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+from os import getenv
+import logging
+import json
+import time
+
+# Requests taking longer than this many seconds are written to the slow query log (negative turns it off)
+SLOW_QUERY_THRESHOLD = float(getenv('SLOW_QUERY_THRESHOLD', 5))
+
+
+class QueryProfiler():
+    def __init__(self, endpoint_tablename, explain=False):
+        self.endpoint_tablename = endpoint_tablename
+        self.explain = explain
+        # Normalized QNode (see get_qnode_filter_key) recorded with slow queries
+        self.qnode_key = None
+        self.stages = {}
+        self.plans = {}
+        self._start_time = time.perf_counter()
+        self._end_time = None
+
+    # Times the body of the with statement as a stage (repeated stages add up)
+    @contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start_time)
+
+    # Stops the total time so work done afterwards (ex. EXPLAIN ANALYZE re-running the statements) isn't counted
+    def finish(self):
+        if self._end_time is None:
+            self._end_time = time.perf_counter()
+
+    def total_time(self):
+        end_time = self._end_time if self._end_time is not None else time.perf_counter()
+        return end_time - self._start_time
+
+    def as_dict(self):
+        return {'total_time': self.total_time(), 'stages': dict(self.stages), 'plans': dict(self.plans)}
+
+    # Writes the normalized QNode and stage timings to the slow query log when the request was slower than the threshold
+    def log_if_slow(self, threshold=None):
+        if threshold is None:
+            threshold = SLOW_QUERY_THRESHOLD
+        total_time = self.total_time()
+        if (threshold < 0) or (total_time < threshold):
+            return False
+        slow_query = {'endpoint': self.endpoint_tablename,
+                      'qnode': json.loads(self.qnode_key) if self.qnode_key else None,
+                      'total_time': total_time,
+                      'stages': self.stages}
+        logging.getLogger('slow_query').warning(json.dumps(slow_query))
+        return True
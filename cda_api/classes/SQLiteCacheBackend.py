@@ -0,0 +1,53 @@
+from cda_api import get_logger
+import sqlite3
+import json
+import time
+
+log = get_logger('Util: SQLiteCacheBackend.py')
+
+
+# Shared QueryCache backend that lets multiple API workers on a host reuse each other's cached results
+class SQLiteCacheBackend():
+    def __init__(self, path):
+        self.path = path
+        self._execute('CREATE TABLE IF NOT EXISTS query_cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)')
+
+    def _execute(self, *statements):
+        connection = sqlite3.connect(self.path, timeout=5)
+        try:
+            with connection:
+                for statement in statements:
+                    if isinstance(statement, str):
+                        row = connection.execute(statement).fetchone()
+                    else:
+                        row = connection.execute(*statement).fetchone()
+            return row
+        finally:
+            connection.close()
+
+    def get(self, key):
+        try:
+            row = self._execute(('SELECT value, expires_at FROM query_cache WHERE key = ?', (key,)))
+        except sqlite3.Error as e:
+            log.warning(f'Unable to read from cache backend {self.path}: {e}')
+            return None
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at < time.time():
+            return None
+        return json.loads(value)
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        try:
+            self._execute(('INSERT OR REPLACE INTO query_cache (key, value, expires_at) VALUES (?, ?, ?)', (key, json.dumps(value, default=str), now + ttl)),
+                          ('DELETE FROM query_cache WHERE expires_at < ?', (now,)))
+        except sqlite3.Error as e:
+            log.warning(f'Unable to write to cache backend {self.path}: {e}')
+
+    def clear(self):
+        try:
+            self._execute('DELETE FROM query_cache')
+        except sqlite3.Error as e:
+            log.warning(f'Unable to clear cache backend {self.path}: {e}')
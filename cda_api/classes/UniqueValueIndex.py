@@ -0,0 +1,45 @@
+from bisect import bisect_left
+import json
+
+
+class UniqueValueIndex():
+    def __init__(self, columnname, rows, query_sql=None):
+        # rows are the row_to_json results of the unique values query ({columnname: value, 'value_count': count}) in value order
+        self.columnname = columnname
+        self.rows = rows
+        self.query_sql = query_sql
+        # Case insensitive search keys sorted for prefix search (each pointing back to its row's position)
+        self._search_keys = [(str(row[columnname]).lower(), position) for position, row in enumerate(rows) if row[columnname] is not None]
+        self._sorted_search_keys = sorted(self._search_keys)
+        # Approximate size in bytes (the json of the rows plus the search keys) used to bound UNIQUE_VALUES_CACHE
+        self.size = len(json.dumps(rows, default=str)) + sum(len(key) for key, position in self._search_keys)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def search(self, prefix=None, contains=None):
+        """Gets the rows whose value starts with prefix and/or contains the contains string (case insensitive)
+
+        Args:
+            prefix (str, optional): Start of the values to match. Defaults to None.
+            contains (str, optional): Substring of the values to match. Defaults to None.
+
+        Returns:
+            list[dict]: Matching rows in value order (every row when neither prefix nor contains is given)
+        """
+        if not prefix and not contains:
+            return self.rows
+
+        if prefix:
+            prefix = prefix.lower()
+            # Every key starting with the prefix sorts between the prefix and the prefix followed by the highest character
+            start = bisect_left(self._sorted_search_keys, (prefix, -1))
+            end = bisect_left(self._sorted_search_keys, (prefix + '\U0010ffff', -1), lo=start)
+            search_keys = self._sorted_search_keys[start:end]
+        else:
+            search_keys = self._search_keys
+
+        if contains:
+            contains = contains.lower()
+            search_keys = [(key, position) for key, position in search_keys if contains in key]
+        return [self.rows[position] for position in sorted(position for key, position in search_keys)]
@@ -28,4 +28,8 @@ class ParsingError(Exception):
 
 class EmptyQueryError(Exception):
     """Custom exception for when the QNode is empty"""
-    pass
\ No newline at end of file
+    pass
+
+class CohortNotFound(Exception):
+    """Custom exception for when a cohort handle is unknown or has expired"""
+    pass
@@ -1,7 +1,8 @@
-from .connection import session
+from .connection import session, async_session, get_statement_timeout
 from .schema import Base
+from sqlalchemy import text
 from cda_api.classes.DatabaseMap import DatabaseMap
-from cda_api import get_logger
+from cda_api import get_logger, get_http_exception
 
 DB_MAP = DatabaseMap(Base)
 log = get_logger('Utility: db/__init__.py')
@@ -16,3 +17,32 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    db = async_session()
+    try:
+        log.debug('Creating async database session')
+        yield db
+    finally:
+        log.debug('Closing async database session')
+        await db.close()
+
+
+# Sets the endpoint's statement_timeout for the rest of the session's transaction
+async def set_statement_timeout(db, endpoint):
+    statement_timeout = get_statement_timeout(endpoint)
+    if statement_timeout > 0:
+        log.debug(f'Setting statement_timeout to {statement_timeout}ms for {endpoint}')
+        await db.execute(text(f'SET LOCAL statement_timeout = {statement_timeout}'))
+
+
+# Builds a get_async_db dependency that applies the endpoint's configured statement_timeout
+def get_async_db_with_timeout(endpoint):
+    async def get_async_db_for_endpoint():
+        async for db in get_async_db():
+            try:
+                await set_statement_timeout(db, endpoint)
+            except Exception as e:
+                log.exception(e)
+                raise get_http_exception(e)
+            yield db
+    return get_async_db_for_endpoint
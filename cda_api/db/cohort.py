@@ -0,0 +1,102 @@
+from sqlalchemy import bindparam, any_
+from sqlalchemy.dialects import postgresql
+from os import getenv
+import hashlib
+from cda_api import CohortNotFound
+from cda_api.classes.IdSet import IdSet
+from cda_api.classes.QueryCache import QueryCache
+from cda_api.db import DB_MAP
+from cda_api.db.release import register_release_cache
+
+# Materialized cohorts (IdSets of id_alias values) keyed on their handle, cleared on a new release
+COHORT_CACHE = register_release_cache(QueryCache(max_entries=int(getenv('COHORT_CACHE_SIZE', 64)),
+                                                 ttl=int(getenv('COHORT_CACHE_TTL', 3600))))
+
+# Name of the bind parameter holding the cohort's id_alias array
+COHORT_IDS_BIND_NAME = 'cohort_ids'
+
+
+# Cohort handles are derived from the release and normalized filters so the same cohort always gets the same handle
+def get_cohort_handle(release, qnode_key):
+    return hashlib.sha256(f'{release}:{qnode_key}'.encode()).hexdigest()[:24]
+
+
+# Stores the id_alias values of a cohort as an IdSet
+def store_cohort(handle, endpoint_tablename, id_aliases):
+    if not isinstance(id_aliases, IdSet):
+        id_aliases = IdSet(id_aliases)
+    cohort = {'endpoint': endpoint_tablename, 'ids': id_aliases}
+    COHORT_CACHE.set(handle, cohort)
+    return cohort
+
+
+def get_cohort(cohort):
+    cohort_entry = COHORT_CACHE.get(cohort)
+    if cohort_entry is None:
+        raise CohortNotFound(f'Cohort not found or expired: {cohort}')
+    return cohort_entry
+
+
+# Gets a cohort, making sure it was built for the endpoint table
+def get_endpoint_cohort(cohort, endpoint_tablename):
+    cohort_entry = get_cohort(cohort)
+    if cohort_entry['endpoint'] != endpoint_tablename:
+        raise CohortNotFound(f'Cohort {cohort} is a {cohort_entry["endpoint"]} cohort, not {endpoint_tablename}')
+    return cohort_entry
+
+
+def combine_cohorts(operation, cohorts, log):
+    """Combines saved cohorts of the same endpoint table in memory (without querying the database)
+
+    Args:
+        operation (str): 'union', 'intersection', or 'difference' (the first cohort minus the others)
+        cohorts (list[str]): Handles of the cohorts to combine
+
+    Returns:
+        CohortResponseObj:
+        {
+            'cohort': 'cohort handle',
+            'endpoint': 'endpoint table name',
+            'size': 'number of id_alias values in the cohort'
+        }
+    """
+    cohort_entries = [get_cohort(cohort) for cohort in cohorts]
+    endpoint_tablename = cohort_entries[0]['endpoint']
+    for cohort, cohort_entry in zip(cohorts, cohort_entries):
+        if cohort_entry['endpoint'] != endpoint_tablename:
+            raise CohortNotFound(f'Cohort {cohort} is a {cohort_entry["endpoint"]} cohort, not {endpoint_tablename}')
+
+    first_ids, other_ids = cohort_entries[0]['ids'], [cohort_entry['ids'] for cohort_entry in cohort_entries[1:]]
+    match operation:
+        case 'union':
+            id_aliases = first_ids.union(*other_ids)
+        case 'intersection':
+            id_aliases = first_ids.intersection(*other_ids)
+        case 'difference':
+            id_aliases = first_ids.difference(*other_ids)
+        case _:
+            raise ValueError(f'Unexpected cohort operation: {operation}')
+
+    # Union and intersection don't depend on the order of the cohorts
+    if operation != 'difference':
+        cohorts = sorted(set(cohorts))
+    handle = hashlib.sha256(f'{operation}:{",".join(cohorts)}'.encode()).hexdigest()[:24]
+    store_cohort(handle, endpoint_tablename, id_aliases)
+    log.info(f'Combined {len(cohorts)} cohorts with {operation} into {len(id_aliases)} id_alias values')
+    return {'cohort': handle, 'endpoint': endpoint_tablename, 'size': len(id_aliases)}
+
+
+# Filter conditional restricting the endpoint table to the cohort's id_alias values (bound as a single array parameter)
+def get_cohort_condition(endpoint_tablename):
+    endpoint_id_alias = DB_MAP.get_meta_column(f'{endpoint_tablename}_id_alias')
+    cohort_ids = bindparam(COHORT_IDS_BIND_NAME, type_=postgresql.ARRAY(endpoint_id_alias.type))
+    return endpoint_id_alias == any_(cohort_ids)
+
+
+# Bind parameter values for get_cohort_condition
+# The list bound to the array parameter is built once and kept with the cohort's IdSet instead of on every request
+def get_cohort_params(endpoint_tablename, cohort):
+    cohort_entry = get_endpoint_cohort(cohort, endpoint_tablename)
+    if 'bound_ids' not in cohort_entry:
+        cohort_entry['bound_ids'] = cohort_entry['ids'].ids.tolist()
+    return {COHORT_IDS_BIND_NAME: cohort_entry['bound_ids']}
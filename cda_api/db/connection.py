@@ -2,6 +2,7 @@ from dotenv import load_dotenv, find_dotenv
 from os import getenv
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from cda_api import get_logger
 
 log = get_logger('Setup: connection.py')
@@ -27,9 +28,38 @@ DB_HOSTNAME = getenv('DB_HOSTNAME')
 DB_PORT = getenv('DB_PORT')
 DB_DATABASE = getenv('DB_DATABASE')
 SQLALCHEMY_DATABASE_URL = f'postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOSTNAME}:{DB_PORT}/{DB_DATABASE}'
+SQLALCHEMY_ASYNC_DATABASE_URL = f'postgresql+psycopg://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOSTNAME}:{DB_PORT}/{DB_DATABASE}'
+
+# Connection pool settings of the async engine used by the API endpoints
+# Each process opens at most DB_POOL_SIZE + DB_MAX_OVERFLOW connections for requests, plus the sync engine's pool below
+POOL_SETTINGS = {
+    'pool_size': int(getenv('DB_POOL_SIZE', 5)),
+    'max_overflow': int(getenv('DB_MAX_OVERFLOW', 10)),
+    'pool_timeout': float(getenv('DB_POOL_TIMEOUT', 30)),
+    'pool_recycle': int(getenv('DB_POOL_RECYCLE', 1800)),
+    'pool_pre_ping': getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+}
+
+# The sync engine is only used on startup (schema reflection and table statistics) and by the command line tools,
+# so it gets its own small pool instead of another copy of the request pool
+SYNC_POOL_SETTINGS = dict(POOL_SETTINGS,
+                          pool_size=int(getenv('DB_SYNC_POOL_SIZE', 1)),
+                          max_overflow=int(getenv('DB_SYNC_MAX_OVERFLOW', 2)))
+
+# Statement timeouts in milliseconds (0 disables the timeout). 
+# STATEMENT_TIMEOUT sets the default and STATEMENT_TIMEOUT_<ENDPOINT> (ex. STATEMENT_TIMEOUT_SUMMARY) overrides it per endpoint
+STATEMENT_TIMEOUT = int(getenv('STATEMENT_TIMEOUT', 0))
+
+def get_statement_timeout(endpoint) -> int:
+    return int(getenv(f'STATEMENT_TIMEOUT_{endpoint.upper()}', STATEMENT_TIMEOUT))
 
 # Create sqlalchemy database engine object and Session
 log.info('Creating database engine and session objects')
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **SYNC_POOL_SETTINGS)
 # TODO determine if there is a better (more secure) way to set up sessions
 session = sessionmaker(bind=engine)
+
+# Create asyncio database engine and AsyncSession used by the API endpoints
+log.info('Creating async database engine and session objects')
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, **POOL_SETTINGS)
+async_session = async_sessionmaker(bind=async_engine, expire_on_commit=False)
@@ -1,60 +1,83 @@
-from .query_operators import apply_filter_operator
+from .query_operators import apply_filter_operator, matches_null
+from .query_utilities import FILTER_TEMPLATE_CACHE, get_table_row_estimates
+from .cohort import get_cohort_condition, get_cohort_params
 from cda_api import get_logger, ParsingError
 from cda_api.db import DB_MAP
+from sqlalchemy import bindparam, select, func, and_, or_, table, column, text
+from sqlalchemy.dialects import postgresql
 
 
+from functools import lru_cache
+from os import getenv
+import logging
 import re
 import ast
+import json
 
-# Parse out the key components from the filter string
-def parse_filter_string(filter_string, log):
-    # Clean up the filter
-    filter_string = filter_string.strip()
+# Filter grammar: <column> <operator> <value> (Note: Order matters, longer operators need to come before their prefixes)
+FILTER_OPERATORS = [r'not\s+between', r'not\s+like', r'not\s+in', r'is\s+not', 'between', 'like', 
+                    '!=', '<>', '<=', '>=', 'in', 'is', 'not', '=', '<', '>']
+FILTER_OPERATOR_PATTERN = '|'.join(FILTER_OPERATORS)
+FILTER_REXP = re.compile(rf'(?P<column>\S+)\s+(?P<operator>{FILTER_OPERATOR_PATTERN})(?:\s+(?P<value>\S.*))?', re.IGNORECASE | re.DOTALL)
+# Only used to explain why a filter didn't match FILTER_REXP
+FILTER_OPERATOR_REXP = re.compile(rf'\s(?:{FILTER_OPERATOR_PATTERN})(?:\s|$)', re.IGNORECASE)
 
-    # Parse out the operator (Note: Order matters, you can't put = before <=)
-    operator_pattern = r"(?:\snot\s|\s)(?:!=|<>|<=|>=|=|<|>|is|in|like|between|not)+(?:\snot\s|\s)"
-    operator_rexp = re.compile(operator_pattern)
-    parsed_operators = [op.strip() for op in operator_rexp.findall(filter_string.lower())]
-    if len(parsed_operators) != 1:
-        raise ParsingError(f'Unable to parse out operator in filter: "{filter_string}"')
+# Values that ast.literal_eval() would parse to the same int, float, or string
+INT_REXP = re.compile(r'[-+]?(?:0|[1-9]\d*)', re.ASCII)
+FLOAT_REXP = re.compile(r'[-+]?(?:\d+\.\d*|\.\d+)(?:[eE][-+]?\d+)?|[-+]?\d+[eE][-+]?\d+', re.ASCII)
+LITERAL_NAMES = ('True', 'False', 'None')
 
-    # Get the operator from the list of matches 
-    operator = parsed_operators[0]
+# Number of parsed filter strings kept in memory
+FILTER_PARSE_CACHE_SIZE = int(getenv('FILTER_PARSE_CACHE_SIZE', 65536))
 
-    # Verify the matched operator is valid
-    valid_operators = ['!=','<>','<=','>=','=','<','>','is','in','like','between',
-                    'not','is not','not in','not like','not between']
-    if operator not in valid_operators:
-        raise ParsingError(f'Parsed operator: "{operator}" not valid')
-    
-    # Ensure the operator isn't at the beginning or the end of the filter string
-    operator_location = re.search(operator, filter_string.lower())
-    if operator_location.start() == 0:
-        raise ParsingError(f'Missing column in filter before operator "{filter_string}"')
+# "in"/"not in" lists with more values than this are staged into a temp table and joined instead of bound as an array
+IN_LIST_STAGING_THRESHOLD = int(getenv('IN_LIST_STAGING_THRESHOLD', 10000))
 
-    if operator_location.end() == len(filter_string):
-        raise ParsingError(f'Missing value after operator "{filter_string}"')
 
-    # Set columnname value to the stripped string before the operator
-    columnname = filter_string[:operator_location.start()].strip()
+# Parse the value string like ast.literal_eval() (falling back to the string itself) skipping it for common values
+def parse_filter_value(value_string):
+    first_character = value_string[0]
+    # Only True/False/None and prefixed string literals (ex. r'...') start with a letter
+    if (first_character.isalpha() or first_character == '_') and not value_string.startswith(LITERAL_NAMES) \
+            and ("'" not in value_string) and ('"' not in value_string):
+        return value_string
+    if INT_REXP.fullmatch(value_string):
+        return int(value_string)
+    if FLOAT_REXP.fullmatch(value_string):
+        return float(value_string)
+    if (first_character in '\'"') and (len(value_string) > 1) and (value_string[-1] == first_character) \
+            and (first_character not in value_string[1:-1]) and ('\\' not in value_string):
+        return value_string[1:-1]
+    try:
+        return ast.literal_eval(value_string)
+    except Exception:
+        # If there is an error, just handle as a string
+        return value_string
 
-    # Check if the string before the operator wasn't just whitespace
-    if len(columnname) < 1:
-        raise ParsingError(f'Missing column in filter before operator "{filter_string}"')
 
-    # Ensure there is no whitespace in the parsed columnname
-    if re.search('\s', columnname):
-        raise ParsingError(f'Invalid column "{columnname}" in filter: "{filter_string}"')
+# Parses a filter string into (columnname, operator, value), memoized since the same filters are sent over and over
+# (list values are shared between calls, so they must not be modified)
+@lru_cache(maxsize=FILTER_PARSE_CACHE_SIZE)
+def parse_filter_components(filter_string):
+    # Clean up the filter
+    filter_string = filter_string.strip()
 
-    # Set columnname value to the stripped string after the operator
-    value_string = filter_string[operator_location.end():].strip()
+    filter_match = FILTER_REXP.fullmatch(filter_string)
+    if filter_match is None:
+        operator_location = FILTER_OPERATOR_REXP.search(filter_string)
+        # Ensure there is no whitespace in the columnname before the operator
+        if (operator_location is not None) and (operator_location.start() > 0):
+            columnname = filter_string[:operator_location.start()].strip()
+            raise ParsingError(f'Invalid column "{columnname}" in filter: "{filter_string}"')
+        raise ParsingError(f'Unable to parse out operator in filter: "{filter_string}"')
 
-    # Use ast.literal_eval() to safely evaluate the value
-    try:
-        value = ast.literal_eval(value_string)
-    except Exception:
-        # If there is an error, just handle as a string
-        value = value_string
+    columnname = filter_match['column']
+    operator = ' '.join(filter_match['operator'].lower().split())
+    value_string = filter_match['value']
+    if value_string is None:
+        raise ParsingError(f'Missing value after operator "{filter_string}"')
+    value_string = value_string.strip()
+    value = parse_filter_value(value_string)
 
     # Check if value is null
     if isinstance(value, str):
@@ -67,14 +90,70 @@ def parse_filter_string(filter_string, log):
 
     elif (not isinstance(value, list)) and (operator in ['in', 'not in']):
         raise ParsingError(f'Value: {value_string} must be a list (ex. [1,2,3] or ["a","b","c"]) when using "in" or "not in" operators -> filter: "{filter_string}"')
-    
-    log.debug(f'columnname: {columnname}, operator: {operator}, value: {value}, value type: {type(value)}')
-    
+
+    return columnname, operator, value
+
+
+# Parse out the key components from the filter string
+def parse_filter_string(filter_string, log):
+    columnname, operator, value = parse_filter_components(filter_string)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f'columnname: {columnname}, operator: {operator}, value: {value}, value type: {type(value)}')
     return columnname, operator, value
 
 
-# Generate preselect filter conditional
-def get_preselect_filter(endpoint_tablename, filter_string, log):
+# Values that are sent as bind parameters (None/booleans stay in the SQL since they change how the filter is built)
+def is_bindable_value(filter_operator, filter_value):
+    if filter_operator in ['is', 'is not']:
+        return False
+    return isinstance(filter_value, (str, int, float, list)) and not isinstance(filter_value, bool)
+
+
+def is_staged_value(filter_operator, filter_value):
+    return (filter_operator in ['in', 'not in']) and isinstance(filter_value, list) and (len(filter_value) > IN_LIST_STAGING_THRESHOLD)
+
+
+# Temp table holding the staged values of a filter's "in"/"not in" list
+def get_staged_table(bind_name):
+    return table(f'staged_{bind_name}', column('value'))
+
+
+# Gets the shape of a filter (column, operator, and value type) and the value to bind for it
+def get_filter_shape(filter_string, log):
+    columnname, operator, value = parse_filter_string(filter_string, log)
+    if not is_bindable_value(operator, value):
+        return (columnname, operator, repr(value)), None
+    if isinstance(value, list):
+        value_type = f'list[{",".join(sorted(set(type(v).__name__ for v in value)))}]'
+        # Staged lists are joined from a temp table instead of being bound
+        if is_staged_value(operator, value):
+            value_type += ' staged'
+    else:
+        value_type = type(value).__name__
+        # Filters that also match NULL values build a different statement
+        if matches_null(operator, value):
+            value_type += ' or null'
+    return (columnname, operator, value_type), value
+
+
+# Gets the shape of the QNode filters and the bind parameter values for them
+# Filters with the same shape build the same statement, only the bind parameter values differ
+def get_qnode_filter_template(qnode, log):
+    filter_shapes = []
+    filter_params = {}
+    for match_type in ['MATCH_ALL', 'MATCH_SOME']:
+        match_shapes = []
+        for i, filter_string in enumerate(getattr(qnode, match_type) or []):
+            filter_shape, filter_value = get_filter_shape(filter_string, log)
+            match_shapes.append(filter_shape)
+            if filter_value is not None:
+                filter_params[f'{match_type.lower()}_{i}'] = filter_value
+        filter_shapes.append(tuple(match_shapes))
+    return tuple(filter_shapes), filter_params
+
+
+# Generate the filter conditional on the filter column's own table
+def get_filter_clause(filter_string, log, bind_name=None):
     log.debug(f'Constructing filter "{filter_string}"')
     # get the components of the filter string
     filter_columnname, filter_operator, filter_value = parse_filter_string(filter_string, log)
@@ -82,28 +161,159 @@ def get_preselect_filter(endpoint_tablename, filter_string, log):
     # ensure the unique column name exists in mapping and assign variables
     filter_column_info = DB_MAP.get_column_info(filter_columnname)
 
+    # send the value as a named bind parameter so the filter can be reused as a template
+    # (lists are sent as a single array parameter, or joined from a temp table when they are large)
+    if bind_name and is_staged_value(filter_operator, filter_value):
+        filter_value = select(get_staged_table(bind_name).c.value)
+    elif bind_name and isinstance(filter_value, list):
+        filter_value = bindparam(bind_name, filter_value, type_=postgresql.ARRAY(filter_column_info.metadata_column.type))
+    elif bind_name and is_bindable_value(filter_operator, filter_value):
+        filter_value = bindparam(bind_name, filter_value)
+
     # build the sqlalachemy orm filter with the components
     filter_clause = apply_filter_operator(filter_column_info.metadata_column, filter_value, filter_operator, log)
     
-    # if the filter applies to a foreign table, preselect on the mapping column
-    if filter_column_info.tablename.lower() != endpoint_tablename.lower():
-        relationship = DB_MAP.get_relationship(entity_tablename=endpoint_tablename, foreign_tablename=filter_column_info.tablename)
-        mapping_column = relationship.entity_collection
-        filter_clause = mapping_column.any(filter_clause)
-    
-    return filter_clause
+    return filter_clause, filter_column_info.tablename
+
+
+# Generate a single semi-join filter conditional for the filters on a foreign table:
+# endpoint.id_alias IN (SELECT mapping column FROM foreign table [JOIN mapping table] WHERE filter OR filter ...)
+# When every filter has to match (MATCH_ALL), the ids are grouped and each filter has to match at least one of their rows
+def build_semi_join_filter(endpoint_tablename, foreign_tablename, filter_clauses, match_all):
+    relationship = DB_MAP.get_relationship(entity_tablename=endpoint_tablename, foreign_tablename=foreign_tablename)
+    if relationship.has_mapping_table:
+        mapping_column = relationship.entity_mapping_column
+        semi_join = select(mapping_column).join_from(relationship.mapping_table, 
+                                                     relationship.foreign_column.table, 
+                                                     relationship.foreign_mapping_column == relationship.foreign_column)
+    else:
+        mapping_column = relationship.foreign_column
+        semi_join = select(mapping_column)
+
+    if len(filter_clauses) == 1:
+        semi_join = semi_join.where(filter_clauses[0])
+    else:
+        semi_join = semi_join.where(or_(*filter_clauses))
+        if match_all:
+            semi_join = semi_join.group_by(mapping_column).having(and_(*[func.bool_or(filter_clause) for filter_clause in filter_clauses]))
+    return relationship.entity_column.in_(semi_join)
+
+
+# Generate the filter conditionals of a MATCH_ALL or MATCH_SOME list
+# Filters on the endpoint table are kept as they are while the filters on each foreign table are merged into one 
+# semi-join (instead of a correlated EXISTS per filter), ordered by the foreign table's row estimate (smallest first)
+def plan_match_conditions(endpoint_tablename, filter_strings, match_type, log):
+    conditions = []
+    foreign_filter_clauses = {}
+    for i, filter_string in enumerate(filter_strings):
+        filter_clause, filter_tablename = get_filter_clause(filter_string, log, bind_name=f'{match_type.lower()}_{i}')
+        if filter_tablename.lower() == endpoint_tablename.lower():
+            conditions.append(filter_clause)
+        else:
+            foreign_filter_clauses.setdefault(filter_tablename, []).append(filter_clause)
+
+    foreign_tablenames = list(foreign_filter_clauses)
+    if len(foreign_tablenames) > 1:
+        row_estimates = get_table_row_estimates()
+        # sorted() keeps the QNode order for tables without an estimate
+        foreign_tablenames = sorted(foreign_tablenames, key=lambda tablename: row_estimates.get(tablename, float('inf')))
+    for foreign_tablename in foreign_tablenames:
+        conditions.append(build_semi_join_filter(endpoint_tablename, 
+                                                 foreign_tablename, 
+                                                 foreign_filter_clauses[foreign_tablename], 
+                                                 match_all=(match_type == 'MATCH_ALL')))
+    return conditions
+
+
+def has_staged_filters(filter_template):
+    filter_shapes, filter_params = filter_template
+    return any(value_type.endswith(' staged') for match_shapes in filter_shapes for columnname, operator, value_type in match_shapes)
+
+
+def stage_filter_values(db, filter_template, log):
+    """Stages the values of the large "in"/"not in" lists into temp tables (dropped at the end of db's transaction)
+    with a single array bound INSERT each, and analyzes them so the planner knows their size
+
+    Returns:
+        dict: The filter bind parameter values without the staged lists
+    """
+    filter_shapes, filter_params = filter_template
+    filter_params = dict(filter_params)
+    for match_type, match_shapes in zip(['MATCH_ALL', 'MATCH_SOME'], filter_shapes):
+        for i, (columnname, operator, value_type) in enumerate(match_shapes):
+            if not value_type.endswith(' staged'):
+                continue
+            bind_name = f'{match_type.lower()}_{i}'
+            filter_values = filter_params.pop(bind_name)
+            column_type = DB_MAP.get_meta_column(columnname).type
+            staged_tablename = get_staged_table(bind_name).name
+            log.info(f'Staging {len(filter_values)} values of {columnname} {operator} into {staged_tablename}')
+            db.execute(text(f'DROP TABLE IF EXISTS {staged_tablename}'))
+            db.execute(text(f'CREATE TEMP TABLE {staged_tablename} (value {column_type.compile(dialect=postgresql.dialect())}) ON COMMIT DROP'))
+            db.execute(text(f'INSERT INTO {staged_tablename} (value) SELECT unnest(:staged_values)').bindparams(
+                           bindparam('staged_values', type_=postgresql.ARRAY(column_type))), 
+                       {'staged_values': filter_values})
+            db.execute(text(f'ANALYZE {staged_tablename}'))
+    return filter_params
+
 
 # Build match_all and match_some filter conditional lists
-def build_match_conditons(endpoint_tablename, qnode, log):
+# The conditionals use named bind parameters and are cached by the shape of the filters, 
+# so the returned filter_params need to be applied (ex. query.params(filter_params)) to any query using them
+def build_match_conditons(endpoint_tablename, qnode, log, filter_template=None, cohort=None, db=None):
     log.info('Building MATCH conditions')
-    match_all_conditions = []
-    match_some_conditions = []
-    # match_all_conditions will be all AND'd together
+    if filter_template is None:
+        filter_template = get_qnode_filter_template(qnode, log)
+    filter_shapes, filter_params = filter_template
+    template_key = ('match_conditions', endpoint_tablename.lower(), filter_shapes)
+    match_conditions = FILTER_TEMPLATE_CACHE.get(template_key)
+    if match_conditions is not None:
+        log.debug('Using cached MATCH conditions')
+        match_all_conditions, match_some_conditions = match_conditions
+    else:
+        match_all_conditions = []
+        match_some_conditions = []
+        # match_all_conditions will be all AND'd together
+        if qnode.MATCH_ALL:
+            match_all_conditions = plan_match_conditions(endpoint_tablename, qnode.MATCH_ALL, 'MATCH_ALL', log)
+        # match_some_conditions will be all OR'd together 
+        if qnode.MATCH_SOME:
+            match_some_conditions = plan_match_conditions(endpoint_tablename, qnode.MATCH_SOME, 'MATCH_SOME', log)
+        FILTER_TEMPLATE_CACHE.set(template_key, (match_all_conditions, match_some_conditions))
+
+    if has_staged_filters(filter_template):
+        filter_params = stage_filter_values(db, filter_template, log)
+
+    # Restrict to a materialized cohort's id_alias values instead of re-evaluating the cohort's filters
+    if cohort is not None:
+        match_all_conditions = match_all_conditions + [get_cohort_condition(endpoint_tablename)]
+        filter_params = dict(filter_params, **get_cohort_params(endpoint_tablename, cohort))
+    return match_all_conditions, match_some_conditions, filter_params
+
+
+# Normalize a single filter string so equivalent filters (whitespace, case-insensitive values, list order) compare equal
+def normalize_filter_string(filter_string, log):
+    columnname, operator, value = parse_filter_string(filter_string, log)
+    # String comparisons with these operators are case insensitive
+    if isinstance(value, str) and (operator in ['=', '!=', 'like', 'not like']):
+        value = value.upper()
+    # "in" and "not in" lists are treated as sets
+    if isinstance(value, list):
+        value = sorted(set(json.dumps(v, default=str) for v in value))
+    return json.dumps([columnname, operator, value], default=str)
+
+
+# Build a canonical key from the QNode filters that is independent of filter order, whitespace, and value case
+def get_qnode_filter_key(endpoint_tablename, qnode, log, cohort=None):
+    match_all_filters = []
+    match_some_filters = []
     if qnode.MATCH_ALL:
-        match_all_conditions = [get_preselect_filter(endpoint_tablename, filter_string, log)
-                                    for filter_string in qnode.MATCH_ALL]
-    # match_some_conditions will be all OR'd together 
+        match_all_filters = sorted(set(normalize_filter_string(filter_string, log) for filter_string in qnode.MATCH_ALL))
     if qnode.MATCH_SOME:
-        match_some_conditions = [get_preselect_filter(endpoint_tablename, filter_string, log)
-                                    for filter_string in qnode.MATCH_SOME]
-    return match_all_conditions, match_some_conditions
+        match_some_filters = sorted(set(normalize_filter_string(filter_string, log) for filter_string in qnode.MATCH_SOME))
+    filter_key = {'endpoint': endpoint_tablename.lower(),
+                  'MATCH_ALL': match_all_filters,
+                  'MATCH_SOME': match_some_filters}
+    if cohort is not None:
+        filter_key['cohort'] = cohort
+    return json.dumps(filter_key)
@@ -0,0 +1,269 @@
+from cda_api.db import DB_MAP
+from cda_api.db.connection import session, engine
+from cda_api.db.filter_builder import parse_filter_string
+from cda_api.db.query_operators import case_insensitive_value
+from cda_api import get_logger, ParsingError, ColumnNotFound, RelationshipNotFound
+from sqlalchemy import column, text
+from sqlalchemy.dialects import postgresql
+from datetime import datetime, timedelta
+import argparse
+import hashlib
+import json
+import re
+
+# Logs read by default (the request log, info.log, can be added to count every query instead of only the slow ones)
+INDEX_ADVISOR_LOGS = ['slow_query.log']
+
+# Only queries logged within this many days are counted
+INDEX_ADVISOR_DAYS = 7
+
+# Log lines of the slow query log and the request log (see config/logger.yml)
+SLOW_QUERY_LOG_LINE = re.compile(r'^(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d+) (?P<message>\{.*\})$')
+REQUEST_LOG_LINE = re.compile(r'^(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d+) - (?P<id>\S*) - INFO: (?P<message>.*)$')
+ENDPOINT_HIT_MESSAGE = re.compile(r'^(?:data|summary|cohort)/(?P<endpoint_tablename>subject|file)(?:/export)? endpoint hit')
+
+# Postgres truncates identifiers longer than this
+MAX_INDEX_NAME_LENGTH = 63
+
+IDENTIFIER_PREPARER = postgresql.dialect().identifier_preparer
+
+# pg_indexes renders expressions on non text columns with a cast (ex. upper((column)::text))
+TEXT_CAST = re.compile(r'\((\w+)\)::text')
+
+
+def parse_log_time(log_time):
+    return datetime.strptime(log_time, '%Y-%m-%d %H:%M:%S,%f')
+
+
+# Gets the (columnname, operator, value) filters of a QNode's MATCH_ALL and MATCH_SOME lists
+# Slow query log QNodes hold normalized filters (json lists) while request log QNodes hold the filter strings
+def get_logged_filters(qnode, log):
+    filters = []
+    for filter_string in (qnode.get('MATCH_ALL') or []) + (qnode.get('MATCH_SOME') or []):
+        try:
+            if filter_string.startswith('['):
+                columnname, operator, value = json.loads(filter_string)
+            else:
+                columnname, operator, value = parse_filter_string(filter_string, log)
+        except (ParsingError, ValueError):
+            log.debug(f'Skipping unparsable filter: {filter_string}')
+            continue
+        filters.append((columnname, operator, value))
+    return filters
+
+
+def read_logged_queries(log_paths, log, since=None):
+    """Reads the filters of the data, summary, and cohort queries in the slow query and request logs
+
+    Args:
+        log_paths (list[str]): Paths to slow query logs and request logs (missing files are skipped)
+        since (datetime, optional): Only read queries logged after this time. Defaults to None (every query).
+
+    Returns:
+        list[tuple]: [(endpoint_tablename, [(columnname, operator, value)])] with one entry per logged query
+    """
+    logged_queries = []
+    for log_path in log_paths:
+        try:
+            log_file = open(log_path, encoding='utf8')
+        except FileNotFoundError:
+            log.info(f'Skipping missing log: {log_path}')
+            continue
+        # The request log writes the endpoint and QNode of a request on separate lines with the same id
+        request_endpoints = {}
+        with log_file:
+            for line in log_file:
+                line = line.rstrip('\n')
+                slow_query_match = SLOW_QUERY_LOG_LINE.match(line)
+                request_match = REQUEST_LOG_LINE.match(line) if slow_query_match is None else None
+                log_match = slow_query_match or request_match
+                if (log_match is None) or ((since is not None) and (parse_log_time(log_match['time']) < since)):
+                    continue
+                if slow_query_match is not None:
+                    slow_query = json.loads(slow_query_match['message'])
+                    if slow_query.get('qnode'):
+                        logged_queries.append((slow_query['endpoint'], get_logged_filters(slow_query['qnode'], log)))
+                    continue
+                message = request_match['message']
+                endpoint_hit = ENDPOINT_HIT_MESSAGE.match(message)
+                if endpoint_hit is not None:
+                    request_endpoints[request_match['id']] = endpoint_hit['endpoint_tablename']
+                elif message.startswith('QNode: ') and (request_match['id'] in request_endpoints):
+                    try:
+                        qnode = json.loads(message[len('QNode: '):])
+                    except ValueError:
+                        log.debug(f'Skipping unparsable QNode: {message}')
+                        continue
+                    logged_queries.append((request_endpoints.pop(request_match['id']), get_logged_filters(qnode, log)))
+    return logged_queries
+
+
+def get_index_name(tablename, columnnames, suffix=''):
+    index_name = f'ix_{tablename}_{"_".join(columnnames)}{suffix}'
+    if len(index_name) > MAX_INDEX_NAME_LENGTH:
+        name_hash = hashlib.sha256(index_name.encode()).hexdigest()[:8]
+        index_name = f'{index_name[:MAX_INDEX_NAME_LENGTH - 9]}_{name_hash}'
+    return index_name
+
+
+# Builds an index proposal: 'plain' btree indexes on the columns, 'upper' btree indexes on the case insensitive
+# expression used by string equality filters (see case_insensitive_value), and 'trigram' GIN indexes on the same expression for like filters
+def build_index_proposal(tablename, columnnames, kind='plain'):
+    quoted_tablename = IDENTIFIER_PREPARER.quote(tablename)
+    value_expression = None
+    match kind:
+        case 'plain':
+            index_name = get_index_name(tablename, columnnames)
+            index_method = 'btree'
+            index_columns = ', '.join(IDENTIFIER_PREPARER.quote(columnname) for columnname in columnnames)
+        case 'upper' | 'trigram':
+            value_expression = case_insensitive_value(column(columnnames[0])).compile(dialect=postgresql.dialect(),
+                                                                                      compile_kwargs={'literal_binds': True})
+            if kind == 'upper':
+                index_name = get_index_name(tablename, columnnames, '_upper')
+                index_method = 'btree'
+                index_columns = f'({value_expression})'
+            else:
+                index_name = get_index_name(tablename, columnnames, '_trgm')
+                index_method = 'gin'
+                index_columns = f'({value_expression}) gin_trgm_ops'
+        case _:
+            raise ValueError(f'Unexpected index kind: {kind}')
+    return {'name': index_name,
+            'tablename': tablename,
+            'columnnames': list(columnnames),
+            'kind': kind,
+            'definition': f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {IDENTIFIER_PREPARER.quote(index_name)} '
+                          f'ON {quoted_tablename} USING {index_method} ({index_columns})',
+            'expression': value_expression,
+            'extension': 'pg_trgm' if kind == 'trigram' else None,
+            'queries': 0,
+            'exists': False}
+
+
+# Gets the indexes that would serve a filter on the endpoint table (see plan_match_conditions and apply_filter_operator)
+def get_filter_index_proposals(endpoint_tablename, columnname, operator, value):
+    column_info = DB_MAP.get_column_info(columnname)
+    operator = operator.lower()
+    proposals = []
+    # Negated string filters (!=, not like) compare coalesce(upper(column), '') and can't be served by an index
+    if operator == 'like':
+        proposals.append(build_index_proposal(column_info.tablename, [column_info.columnname], 'trigram'))
+    elif (operator == '=') and isinstance(value, str):
+        proposals.append(build_index_proposal(column_info.tablename, [column_info.columnname], 'upper'))
+    elif not ((operator in ['!=', 'not like']) and isinstance(value, str)):
+        proposals.append(build_index_proposal(column_info.tablename, [column_info.columnname]))
+
+    # Filters on foreign tables are semi-joined from the matching foreign rows to the endpoint ids through the mapping columns
+    if column_info.tablename.lower() != endpoint_tablename.lower():
+        relationship = DB_MAP.get_relationship(entity_tablename=endpoint_tablename, foreign_tablename=column_info.tablename)
+        if relationship.has_mapping_table:
+            mapping_columns = [relationship.foreign_mapping_column, relationship.entity_mapping_column]
+        else:
+            mapping_columns = [relationship.foreign_column]
+        proposals.append(build_index_proposal(mapping_columns[0].table.name, [mapping_column.name for mapping_column in mapping_columns]))
+    return proposals
+
+
+# Gets the definitions of the existing indexes of each table
+def get_existing_indexes(db):
+    existing_indexes = {}
+    for tablename, index_name, index_definition in db.execute(text("SELECT tablename, indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema()")):
+        existing_indexes.setdefault(tablename, {})[index_name] = index_definition
+    return existing_indexes
+
+
+def index_exists(proposal, existing_indexes):
+    table_indexes = existing_indexes.get(proposal['tablename'], {})
+    if proposal['name'] in table_indexes:
+        return True
+    # An index under another name (ex. the primary key) on the same leading columns or expression already serves the filters
+    match proposal['kind']:
+        case 'plain':
+            leading_columns = f'USING btree ({", ".join(proposal["columnnames"])}'
+        case 'upper':
+            leading_columns = f'USING btree ({proposal["expression"]}'
+        case 'trigram':
+            leading_columns = f'USING gin ({proposal["expression"]} gin_trgm_ops'
+    # The column list has to end or continue after the leading columns so "id" doesn't match "id_alias"
+    for index_definition in table_indexes.values():
+        index_definition = TEXT_CAST.sub(r'\1', index_definition)
+        if (f'{leading_columns})' in index_definition) or (f'{leading_columns}, ' in index_definition):
+            return True
+    return False
+
+
+def advise_indexes(db, logged_queries, log):
+    """Proposes the indexes that would serve the filters of the logged queries
+
+    Args:
+        db (Session): Database session object
+        logged_queries (list[tuple]): [(endpoint_tablename, [(columnname, operator, value)])] from read_logged_queries
+
+    Returns:
+        list[dict]: Index proposals ordered by the number of logged queries they would speed up
+        [{'name', 'tablename', 'columnnames', 'kind', 'definition', 'expression', 'extension', 'queries', 'exists'}]
+    """
+    proposals = {}
+    for endpoint_tablename, filters in logged_queries:
+        query_index_names = set()
+        for columnname, operator, value in filters:
+            try:
+                filter_proposals = get_filter_index_proposals(endpoint_tablename, columnname, operator, value)
+            except (ColumnNotFound, RelationshipNotFound) as e:
+                log.debug(f'Skipping filter on {columnname}: {e}')
+                continue
+            for proposal in filter_proposals:
+                proposals.setdefault(proposal['name'], proposal)
+                query_index_names.add(proposal['name'])
+        # Each query is counted once per index even when several of its filters use it
+        for index_name in query_index_names:
+            proposals[index_name]['queries'] += 1
+
+    existing_indexes = get_existing_indexes(db)
+    for proposal in proposals.values():
+        proposal['exists'] = index_exists(proposal, existing_indexes)
+    log.info(f'Proposed {len(proposals)} indexes from {len(logged_queries)} logged queries')
+    return sorted(proposals.values(), key=lambda proposal: (-proposal['queries'], proposal['name']))
+
+
+# Creates the proposed indexes that don't exist yet (CREATE INDEX CONCURRENTLY needs to run outside of a transaction)
+def create_indexes(proposals, log, connectable=engine):
+    created = []
+    with connectable.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        for proposal in proposals:
+            if proposal['exists']:
+                continue
+            try:
+                if proposal['extension']:
+                    connection.execute(text(f'CREATE EXTENSION IF NOT EXISTS {proposal["extension"]}'))
+                log.info(f'Creating index: {proposal["definition"]}')
+                connection.execute(text(proposal['definition']))
+            except Exception as e:
+                log.exception(f'Unable to create index {proposal["name"]}: {e}')
+                continue
+            proposal['exists'] = True
+            created.append(proposal['name'])
+    return created
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Propose (or create) the indexes that serve the filters of logged queries')
+    parser.add_argument('--log', action='append', dest='log_paths', help=f'Slow query or request log to read (defaults to {INDEX_ADVISOR_LOGS})')
+    parser.add_argument('--days', type=float, default=INDEX_ADVISOR_DAYS, help='Only count queries logged within this many days')
+    parser.add_argument('--min-queries', type=int, default=1, help='Only propose indexes that would speed up at least this many queries')
+    parser.add_argument('--create', action='store_true', help='Create the proposed indexes that do not exist yet')
+    args = parser.parse_args()
+
+    log = get_logger('IndexAdvisor: index_advisor.py')
+    logged_queries = read_logged_queries(args.log_paths or INDEX_ADVISOR_LOGS, log, since=datetime.now() - timedelta(days=args.days))
+    db = session()
+    try:
+        proposals = [proposal for proposal in advise_indexes(db, logged_queries, log) if proposal['queries'] >= args.min_queries]
+    finally:
+        db.close()
+    for proposal in proposals:
+        status = 'exists' if proposal['exists'] else 'missing'
+        print(f'{proposal["queries"]:>8} queries | {status:<7} | {proposal["definition"]}')
+    if args.create:
+        create_indexes(proposals, log)
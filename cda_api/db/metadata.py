@@ -1,5 +1,5 @@
 from cda_api.db.schema import Base
-from cda_api.db.query_utilities import query_to_string
+from cda_api.db.query_utilities import log_query
 from sqlalchemy import func
 
 
@@ -7,7 +7,7 @@ def get_release_metadata(db, log):
     log.info('Building release_metadata query')
     subquery = db.query(Base.metadata.tables['release_metadata']).subquery('subquery')
     query = db.query(func.row_to_json(subquery.table_valued()))
-    log.debug(f'Query:\n{"-"*60}\n{query_to_string(query)}\n{"-"*60}')
+    log_query(log, query, width=60)
 
     result = query.all()
     result = [row for row, in result]
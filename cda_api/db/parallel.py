@@ -0,0 +1,52 @@
+from .connection import async_engine, get_statement_timeout
+from sqlalchemy import text
+from os import getenv
+import asyncio
+
+# Maximum number of extra connections a single parallel query uses at once
+PARALLEL_QUERY_CONNECTIONS = int(getenv('PARALLEL_QUERY_CONNECTIONS', 4))
+
+
+# Exports the snapshot of the session's transaction so other connections can read exactly the same data
+# (the snapshot can only be imported while this transaction stays open)
+async def export_snapshot(db):
+    result = await db.execute(text('SELECT pg_export_snapshot()'))
+    return result.scalar()
+
+
+# Executes a statement on its own pooled connection inside the exported snapshot and returns its first column
+async def execute_in_snapshot(statement, snapshot_id, endpoint):
+    async with async_engine.connect() as connection:
+        # Importing a snapshot requires REPEATABLE READ and has to be the first statement of the transaction
+        connection = await connection.execution_options(isolation_level='REPEATABLE READ')
+        await connection.execute(text(f"SET TRANSACTION SNAPSHOT '{snapshot_id}'"))
+        statement_timeout = get_statement_timeout(endpoint)
+        if statement_timeout > 0:
+            await connection.execute(text(f'SET LOCAL statement_timeout = {statement_timeout}'))
+        result = await connection.execute(statement)
+        rows = result.scalars().all()
+        await connection.rollback()
+    return rows
+
+
+async def execute_parallel(db, statements, endpoint, log):
+    """Executes independent statements at the same time on separate pooled connections that all read
+    the snapshot of the session's transaction
+
+    Args:
+        db (AsyncSession): Database session whose transaction snapshot is shared (kept open until every statement finishes)
+        statements (list[Executable]): Statements to execute
+        endpoint (str): Endpoint name used for the statement_timeout (ex. 'summary')
+
+    Returns:
+        list[list]: First column of every row returned by each statement (in the order of statements)
+    """
+    snapshot_id = await export_snapshot(db)
+    log.info(f'Executing {len(statements)} statements in parallel using snapshot {snapshot_id}')
+    semaphore = asyncio.Semaphore(PARALLEL_QUERY_CONNECTIONS)
+
+    async def execute_limited(statement):
+        async with semaphore:
+            return await execute_in_snapshot(statement, snapshot_id, endpoint)
+
+    return await asyncio.gather(*[execute_limited(statement) for statement in statements])
@@ -1,126 +1,326 @@
-from .filter_builder import build_match_conditons
+from .filter_builder import build_match_conditons, get_qnode_filter_key, get_qnode_filter_template, has_staged_filters, stage_filter_values
 from .select_builder import build_fetch_rows_select_clause
-from .query_utilities import query_to_string, build_match_query, build_filter_preselect, total_column_count_subquery
-from .query_utilities import entity_count, get_cte_column, numeric_summary, categorical_summary, data_source_counts
-from sqlalchemy import func, distinct
+from .query_utilities import query_to_string, log_query, build_match_query, build_filter_preselect
+from .query_utilities import entity_count, explain_query
+from .summary_builder import build_summary_select_clause, build_summary_component_queries, sample_preselect, scaled_count, SUMMARY_SAMPLE_PERCENT
+from .query_utilities import build_keyset_page_query, build_page_json_query, build_page_preselect, decode_cursor, encode_cursor, get_row_count, SUMMARY_CACHE, FILTER_TEMPLATE_CACHE
+from .query_utilities import UNIQUE_VALUES_CACHE, UNIQUE_VALUES_CACHE_MAX_VALUES
+from .release import get_release_fingerprint
+from .rollup import get_summary_rollup, is_rollup_candidate
+from .parallel import execute_parallel
+from .cohort import get_cohort_handle, get_cohort_params, store_cohort
+from sqlalchemy import func, distinct, cast, Text
 from cda_api import get_logger, SystemNotFound
 from cda_api.db import DB_MAP
 from cda_api.db.schema import Base
+from cda_api.classes.UniqueValueIndex import UniqueValueIndex
+from cda_api.classes.QueryProfiler import QueryProfiler
 import time
 
 
-def fetch_rows(db, endpoint_tablename, qnode, limit, offset, log):
-    """Generates json formatted row data based on input query
+# Queries with the same filter shape, columns, and paging only differ by their bind parameter values
+def get_fetch_rows_template_key(endpoint_tablename, qnode, filter_shapes, include_cursor_column=False, cohort=None, page=None):
+    return ('fetch_rows', 
+            endpoint_tablename.lower(), 
+            filter_shapes, 
+            tuple(qnode.ADD_COLUMNS or []), 
+            tuple(qnode.EXCLUDE_COLUMNS or []), 
+            include_cursor_column,
+            cohort is not None,
+            page)
+
+
+def build_fetch_rows_query(db, endpoint_tablename, qnode, log, include_cursor_column=False, cohort=None, page=None, filter_template=None):
+    """Builds the filtered fetch_rows query (before json conversion and paging)
 
     Args:
         db (Session): Database session object
         endpoint_tablename (str): Name of the endpoint table
         qnode (QNode): JSON input query
-        limit (int): Offset for paged results
-        offset (int): Offset for paged results.
+        include_cursor_column (bool, optional): Select the endpoint's id_alias as 'cursor_id_alias' first. Defaults to False.
+        cohort (str, optional): Handle of a materialized cohort to restrict the rows to. Defaults to None.
+        page (str, optional): Restrict the rows (and the foreign column arrays built for them) to a page of id_alias values 
+            before selecting columns: 'offset', 'keyset', or 'keyset_seek' (see build_page_preselect). Defaults to None (every row).
+        filter_template (tuple, optional): Already parsed get_qnode_filter_template of the QNode. Defaults to None.
 
     Returns:
-        PagedResponseObj: 
-        { 
-            'result': [{'column': 'data'}], 
-            'query_sql': 'SQL statement used to generate result',
-            'total_row_count': 'total rows of data for query generated (not paged)',
-            'next_url': 'URL to acquire next paged result'
-        }
+        tuple: (query, endpoint_id_alias column, filter preselect query (not paged), filter bind parameter values)
+        
+        The query is built from a template cached on the shape of the QNode, so the filter bind parameter values 
+        need to be applied (ex. query.params(filter_params)) to any other query built from it. Paged queries
+        also need the page_* bind parameter values.
     """
-    log.info('Building fetch_rows query')
+    if filter_template is None:
+        filter_template = get_qnode_filter_template(qnode, log)
+    filter_shapes, filter_params = filter_template
+    template_key = get_fetch_rows_template_key(endpoint_tablename, qnode, filter_shapes, include_cursor_column, cohort, page)
+    fetch_rows_template = FILTER_TEMPLATE_CACHE.get(template_key)
+    if fetch_rows_template is not None:
+        log.debug('Using cached fetch_rows query template')
+        query, endpoint_id_alias, filter_preselect_query = fetch_rows_template
+        if has_staged_filters(filter_template):
+            filter_params = stage_filter_values(db, filter_template, log)
+        if cohort is not None:
+            filter_params = dict(filter_params, **get_cohort_params(endpoint_tablename, cohort))
+        return query.with_session(db).params(filter_params), endpoint_id_alias, filter_preselect_query, filter_params
 
     # Build filter conditionals
-    match_all_conditions, match_some_conditions = build_match_conditons(endpoint_tablename, qnode, log)
+    match_all_conditions, match_some_conditions, filter_params = build_match_conditons(endpoint_tablename, qnode, log, filter_template, cohort, db)
 
     # Build the preselect query 
     filter_preselect_query, endpoint_id_alias = build_filter_preselect(db, endpoint_tablename, match_all_conditions, match_some_conditions)
 
+    # Page the id_alias values first so the foreign column arrays are only aggregated for the rows on the page
+    rows_preselect_query = filter_preselect_query
+    if page is not None:
+        rows_preselect_query = build_page_preselect(db, filter_preselect_query, keyset=page.startswith('keyset'), seek=(page == 'keyset_seek'))
+
     # Build the select columns and joins to foreign column array preselects
-    select_columns, foreign_array_preselects, foreign_joins = build_fetch_rows_select_clause(db, endpoint_tablename, qnode, filter_preselect_query, log)
+    select_columns, foreign_array_preselects, foreign_joins = build_fetch_rows_select_clause(db, endpoint_tablename, qnode, rows_preselect_query, log)
 
     # Add select columns
-    query = db.query(*select_columns)
+    if include_cursor_column:
+        query = db.query(endpoint_id_alias.label('cursor_id_alias'), *select_columns)
+    else:
+        query = db.query(*select_columns)
 
     # Apply filterpreselect
-    query = query.filter(endpoint_id_alias.in_(filter_preselect_query))
-
-    # Optimize Count query by only counting the id_alias column based on the preselect filter
-    count_subquery = db.query(endpoint_id_alias).filter(endpoint_id_alias.in_(filter_preselect_query)).subquery('rows_to_count')
-    count_query = db.query(func.count()).select_from(count_subquery)
+    query = query.filter(endpoint_id_alias.in_(rows_preselect_query))
 
     # Add joins to foreign table preselects
     if foreign_joins:
         for foreign_join in foreign_joins:
             query = query.join(**foreign_join, isouter=True)
+
+    # Cache the template without holding on to this request's session
+    FILTER_TEMPLATE_CACHE.set(template_key, (query.with_session(None), endpoint_id_alias, filter_preselect_query.with_session(None)))
+
+    return query.params(filter_params), endpoint_id_alias, filter_preselect_query, filter_params
+
+
+def fetch_rows(db, endpoint_tablename, qnode, limit, offset, log, cursor=None, row_count='exact', include_sql=True, cohort=None, explain=False):
+    """Generates json formatted row data based on input query
+
+    Args:
+        db (Session): Database session object
+        endpoint_tablename (str): Name of the endpoint table
+        qnode (QNode): JSON input query
+        limit (int): Offset for paged results
+        offset (int): Offset for paged results.
+        cursor (str, optional): Keyset pagination cursor. When not None, rows are ordered by the
+            endpoint's id_alias and seeked past the cursor instead of using offset ('' starts from the first row).
+        row_count (str, optional): How to get total_row_count: 'exact' (cached per normalized QNode), 
+            'estimate' (query planner estimate), or 'none'. Defaults to 'exact'.
+        include_sql (bool, optional): Render the SQL statement as query_sql (None otherwise). Defaults to True.
+        cohort (str, optional): Handle of a materialized cohort to restrict the rows to. Defaults to None.
+        explain (bool, optional): Return the parse, build, compile, execute, count, and serialize timings along with
+            the EXPLAIN ANALYZE plans of the page and count queries as profile. Defaults to False.
+
+    Returns:
+        PagedResponseObj: 
+        { 
+            'result': [{'column': 'data'}], 
+            'query_sql': 'SQL statement used to generate result',
+            'total_row_count': 'total rows of data for query generated (not paged)',
+            'next_url': 'URL to acquire next paged result',
+            'next_cursor': 'Cursor to acquire next keyset paged result',
+            'profile': 'stage timings and query plans (only when explain is True)'
+        }
+    """
+    log.info('Building fetch_rows query')
+    profiler = QueryProfiler(endpoint_tablename, explain)
+
+    with profiler.stage('parse'):
+        filter_template = get_qnode_filter_template(qnode, log)
+        profiler.qnode_key = get_qnode_filter_key(endpoint_tablename, qnode, log, cohort)
+
+    # Build the filtered row query for the page (selecting the id_alias column to order the page by and to seek on)
+    with profiler.stage('build'):
+        if cursor is not None:
+            last_id_alias = decode_cursor(cursor)
+            page = 'keyset' if last_id_alias is None else 'keyset_seek'
+            page_params = {'page_limit': limit + 1, 'page_last_id_alias': last_id_alias}
+        else:
+            page = 'offset'
+            page_params = {'page_limit': limit, 'page_offset': offset}
+        query, endpoint_id_alias, filter_preselect_query, filter_params = build_fetch_rows_query(db, endpoint_tablename, qnode, log, 
+                                                                                                 include_cursor_column=True,
+                                                                                                 cohort=cohort,
+                                                                                                 page=page,
+                                                                                                 filter_template=filter_template)
+        filter_params = dict(filter_params, **page_params)
+
+        # Optimize Count query by only counting the id_alias column based on the preselect filter
+        rows_to_count = db.query(endpoint_id_alias).filter(endpoint_id_alias.in_(filter_preselect_query)).params(filter_params)
+        count_query = db.query(func.count()).select_from(rows_to_count.subquery('rows_to_count')).params(filter_params)
+        count_key = f'{get_release_fingerprint(db)}:{profiler.qnode_key}'
+        
+        # Convert to json format (ordered by id_alias in the outer query since the order of a subquery isn't kept)
+        if cursor is not None:
+            query = build_keyset_page_query(db, query, endpoint_id_alias, last_id_alias, limit)
+        else:
+            query = build_page_json_query(db, query.subquery('page'))
+        query = query.params(filter_params)
+        sql_template_key = ('fetch_rows_sql',) + get_fetch_rows_template_key(endpoint_tablename, qnode, filter_template[0], 
+                                                                             True, cohort, page)
     
-    # Convert to json format
-    subquery = query.subquery('json_result')
-    query = db.query(func.row_to_json(subquery.table_valued()))
-    
-    log.debug(f'Query:\n{"-"*100}\n{query_to_string(query, indented = True)}\n{"-"*100}')
+    # Statements are otherwise compiled (and cached by SQLAlchemy) as part of executing them, so compiling them
+    # separately is only done when profiling (the compile time is part of the execute stage otherwise)
+    if explain:
+        with profiler.stage('compile'):
+            dialect = db.get_bind().dialect
+            query.statement.compile(dialect=dialect)
+            count_query.statement.compile(dialect=dialect)
 
-    log.debug(f'Count Query:\n{"-"*100}\n{query_to_string(count_query, indented = True)}\n{"-"*100}')
+    log_query(log, query)
+
+    log_query(log, count_query, title='Count Query')
 
     # Get results from the database 
     start_time = time.time()
-    result = query.offset(offset).limit(limit).all()
-    row_count = count_query.scalar()
+    next_cursor = None
+    with profiler.stage('execute'):
+        if cursor is not None:
+            # The page query fetches one extra row to know whether there is a next page
+            result = query.all()
+            if len(result) > limit:
+                result = result[:limit]
+                next_cursor = encode_cursor(result[-1][1])
+            result = [row for row, _ in result]
+        else:
+            result = query.all()
+            # [({column1: value},), ({column2: value},)] -> [{column1: value}, {column2: value}]
+            result = [row for row, in result]
+    with profiler.stage('count'):
+        total_row_count = get_row_count(db, rows_to_count, count_query, count_key, row_count, log)
 
-    # [({column1: value},), ({column2: value},)] -> [{column1: value}, {column2: value}]
-    result = [row for row, in result]
     query_time = time.time() - start_time
     log.info(f'Query execution time: {query_time}s')
-    log.info(f'Returning {len(result)} rows out of {row_count} results | limit={limit} & offset={offset}')
+    if cursor is not None:
+        log.info(f'Returning {len(result)} rows out of {total_row_count} results | limit={limit} & cursor={cursor}')
+    else:
+        log.info(f'Returning {len(result)} rows out of {total_row_count} results | limit={limit} & offset={offset}')
+
+    with profiler.stage('serialize'):
+        ret = {
+            'result': result,
+            'query_sql': query_to_string(query, template_key=sql_template_key, params=filter_params) if include_sql else None,
+            'total_row_count': total_row_count,
+            'next_url': '',
+            'next_cursor': next_cursor
+        }
 
-    ret = {
-        'result': result,
-        'query_sql': query_to_string(query),
-        'total_row_count': row_count,
-        'next_url': ''
-    }
+    profiler.finish()
+    profiler.log_if_slow()
+    if explain:
+        # EXPLAIN ANALYZE runs the statements again, so this is only done when profiling (and isn't part of the total time)
+        profiler.plans['page'] = explain_query(db, query)
+        profiler.plans['count'] = explain_query(db, count_query)
+        ret['profile'] = profiler.as_dict()
     return ret
 
 
-# TODO
-def summary_query(db, endpoint_tablename, qnode, log):
-    """Generates json formatted summary data based on input query
+def build_export_query(db, endpoint_tablename, qnode, log, cohort=None):
+    """Builds the json formatted query of every row for the input query (no paging)
 
     Args:
         db (Session): Database session object
         endpoint_tablename (str): Name of the endpoint table
         qnode (QNode): JSON input query
+        cohort (str, optional): Handle of a materialized cohort to restrict the rows to. Defaults to None.
 
     Returns:
-        SummaryResponseObj: 
-        {
-            'result': [{'summary': 'data'}],
-            'query_sql': 'SQL statement used to generate result'
-        }
+        Query: json formatted row query
     """
+    log.info('Building export query')
 
-    log.info('Building summary query')
-    
+    query, endpoint_id_alias, filter_preselect_query, filter_params = build_fetch_rows_query(db, endpoint_tablename, qnode, log, cohort=cohort)
+
+    # Convert to json format
+    subquery = query.subquery('json_result')
+    query = db.query(func.row_to_json(subquery.table_valued())).params(filter_params)
+
+    log_query(log, query)
+    return query
+
+
+async def export_rows(db, export_query, log, chunk_size=5000):
+    """Generates every json formatted row of the export query using a server-side cursor
+
+    Args:
+        db (AsyncSession): Async database session object (must stay open while the rows are consumed)
+        export_query (Query): Query built by build_export_query
+        chunk_size (int, optional): Number of rows fetched from the server-side cursor at a time. Defaults to 5000.
+
+    Returns:
+        AsyncIterator[dict]: json formatted rows
+    """
+    start_time = time.time()
+    row_count = 0
+    # stream() with yield_per uses a server-side cursor instead of loading every row
+    result = await db.stream(export_query.statement, execution_options={'yield_per': chunk_size})
+    async for row, in result:
+        row_count += 1
+        yield row
+    log.info(f'Exported {row_count} rows in {time.time() - start_time}s')
+
+
+def get_summary_key(release, qnode_key, approximate=False):
+    summary_key = f'{release}:{qnode_key}'
+    if approximate:
+        summary_key += ':approximate'
+    return summary_key
+
+
+def get_cached_summary(db, endpoint_tablename, qnode, log, include_sql=True, use_rollup=True, approximate=False, cohort=None):
+    """Looks up the summary of an equivalent query against the same release in SUMMARY_CACHE and the precomputed rollups
+
+    Returns:
+        tuple: (SUMMARY_CACHE key, cached summary or None)
+    """
+    release = get_release_fingerprint(db)
+    qnode_key = get_qnode_filter_key(endpoint_tablename, qnode, log, cohort)
+    summary_key = get_summary_key(release, qnode_key, approximate)
+    cached_result = SUMMARY_CACHE.get(summary_key)
+
+    # Fall back to the summaries precomputed for the release (unfiltered and single filter QNodes)
+    # Precomputed summaries are exact, so they also answer approximate requests
+    if (cached_result is None) and use_rollup and (cohort is None) and is_rollup_candidate(qnode):
+        cached_result = get_summary_rollup(db, release, qnode_key)
+        if cached_result is not None:
+            log.info('Using precomputed summary rollup')
+            SUMMARY_CACHE.set(summary_key, cached_result)
+    # Results cached without query_sql can't be reused when it is requested
+    if (cached_result is not None) and (cached_result['query_sql'] or not include_sql):
+        log.info('Returning cached summary result')
+        ret = dict(cached_result)
+        if not include_sql:
+            ret['query_sql'] = None
+        return summary_key, ret
+    return summary_key, None
+
+
+# Builds the filtered preselect CTE of the endpoint table used by the summary queries
+def build_summary_preselect(db, endpoint_tablename, qnode, log, approximate=False, cohort=None, filter_template=None):
     # Build filter conditionals
-    match_all_conditions, match_some_conditions = build_match_conditons(endpoint_tablename, qnode, log)
+    match_all_conditions, match_some_conditions, filter_params = build_match_conditons(endpoint_tablename, qnode, log, filter_template, cohort, db)
     
     # Build preselect query
     endpoint_columns = DB_MAP.get_uniquename_metadata_table_columns(endpoint_tablename)
-    endpoint_column_infos = DB_MAP.get_table_column_infos(endpoint_tablename)
     preselect_query = build_match_query(db=db,
                                         select_columns=endpoint_columns, 
                                         match_all_conditions=match_all_conditions,
                                         match_some_conditions=match_some_conditions)
-    preselect_query = preselect_query.cte('filter_preselect')
-
-    # Create list for select clause
-    summary_select_clause = []
+    sample_fraction = None
+    if approximate:
+        log.info(f'Approximating summary from a {SUMMARY_SAMPLE_PERCENT}% sample of {endpoint_tablename}')
+        sample_fraction = SUMMARY_SAMPLE_PERCENT / 100
+        preselect_query = sample_preselect(preselect_query, DB_MAP.get_metadata_table(endpoint_tablename), SUMMARY_SAMPLE_PERCENT)
+    return preselect_query.cte('filter_preselect'), sample_fraction, filter_params
 
-    # Get total count query
-    total_count = total_column_count_subquery(db, get_cte_column(preselect_query, f'{endpoint_tablename}_id_alias')).label('total_count')
-    summary_select_clause.append(total_count)
 
-    # Get file or subject count
+# Gets the count of the files related to subjects (or subjects related to files) in the preselect
+def build_summary_entity_count(db, endpoint_tablename, preselect_query, sample_fraction=None):
     if endpoint_tablename != 'subject':
         entity_to_count = 'subject'
     else:
@@ -129,64 +329,237 @@ def summary_query(db, endpoint_tablename, qnode, log):
                                   endpoint_tablename=endpoint_tablename, 
                                   preselect_query=preselect_query,
                                   entity_to_count=entity_to_count)
-    summary_select_clause.append(sub_file_count.label(f'{entity_to_count}_count'))
-
-    # Get categorical & numeric summaries
-    ## Step through each column in the endpoint table
-    for column_info in endpoint_column_infos:
-        column_summary = None
-        ## Get the preselect column
-        preselect_column = get_cte_column(preselect_query, column_info.uniquename)
-        ## If column is supposed to be displayed in summary but not a data_source column:
-        if column_info.summary_display and column_info.process_before_display != 'data_source':
-            match column_info.column_type:
-                case 'numeric':
-                    column_summary = numeric_summary(db, preselect_column)
-                    summary_select_clause.append(column_summary.label(f'{column_info.uniquename}_summary'))
-                case 'categorical':
-                    column_summary = categorical_summary(db, preselect_column)
-                    summary_select_clause.append(column_summary.label(f'{column_info.uniquename}_summary'))
-                case _:
-                    log.warning(f'Unexpectedly skipping {column_info.column_name} for summary - column_type: {column_info.column_type}')
-                    pass
-
-    # Get data_source counts
-    table_column_infos = DB_MAP.get_table_column_infos(endpoint_tablename)
-    ## Get unique names of columns that have process_before_display of 'data_source' in the column_metadata table
-    data_source_columnnames = [column_info.uniquename for column_info in table_column_infos if column_info.process_before_display == 'data_source']
-    ## Get preselect columns of the 'data_source' columns
-    data_source_columns = [column for column in preselect_query.c if column.name in data_source_columnnames]
-    ## Get the data source select query
-    data_source_count_select = data_source_counts(db, data_source_columns)
-    summary_select_clause.append(data_source_count_select.label('data_source'))
+    if sample_fraction:
+        # Entities related to several sampled rows are only counted once, so this overestimates when they're shared
+        sub_file_count = scaled_count(sub_file_count, sample_fraction)
+    return sub_file_count.label(f'{entity_to_count}_count')
+
+
+def summary_query(db, endpoint_tablename, qnode, log, include_sql=True, use_rollup=True, approximate=False, cohort=None, explain=False):
+    """Generates json formatted summary data based on input query
+
+    Args:
+        db (Session): Database session object
+        endpoint_tablename (str): Name of the endpoint table
+        qnode (QNode): JSON input query
+        include_sql (bool, optional): Render the SQL statement as query_sql (None otherwise). Defaults to True.
+        use_rollup (bool, optional): Use the summary precomputed for the release when there is one. Defaults to True.
+        approximate (bool, optional): Estimate the summary from a sample of the endpoint table (SUMMARY_SAMPLE_PERCENT) 
+                                      and return error bounds with the counts. Defaults to False.
+        cohort (str, optional): Handle of a materialized cohort to restrict the summary to. Defaults to None.
+        explain (bool, optional): Skip the cached summaries and return the parse, build, compile, execute, and serialize 
+            timings along with the EXPLAIN ANALYZE plan of the summary query as profile. Defaults to False.
+
+    Returns:
+        SummaryResponseObj: 
+        {
+            'result': [{'summary': 'data'}],
+            'query_sql': 'SQL statement used to generate result',
+            'profile': 'stage timings and query plan (only when explain is True)'
+        }
+    """
+    profiler = QueryProfiler(endpoint_tablename, explain)
+
+    with profiler.stage('parse'):
+        filter_template = get_qnode_filter_template(qnode, log)
+        profiler.qnode_key = get_qnode_filter_key(endpoint_tablename, qnode, log, cohort)
+
+    # Profiling skips the cached summaries so the summary query actually runs
+    if explain:
+        summary_key = get_summary_key(get_release_fingerprint(db), profiler.qnode_key, approximate)
+    else:
+        summary_key, cached_result = get_cached_summary(db, endpoint_tablename, qnode, log, include_sql, use_rollup, approximate, cohort)
+        if cached_result is not None:
+            return cached_result
+
+    log.info('Building summary query')
     
-    # Wrap everything in a subquery
-    subquery = db.query(*summary_select_clause).subquery('json_result')
-    query = db.query(func.row_to_json(subquery.table_valued()).label('results'))
+    with profiler.stage('build'):
+        preselect_query, sample_fraction, filter_params = build_summary_preselect(db, endpoint_tablename, qnode, log, approximate, cohort, filter_template)
+
+        # Get the total count, numeric summaries, data_source counts, and categorical summaries
+        summary_columns, trailing_columns, summary_from = build_summary_select_clause(db=db,
+                                                                                      endpoint_tablename=endpoint_tablename,
+                                                                                      preselect_query=preselect_query,
+                                                                                      column_infos=DB_MAP.get_table_column_infos(endpoint_tablename),
+                                                                                      log=log,
+                                                                                      sample_fraction=sample_fraction)
+
+        # Get file or subject count
+        sub_file_count = build_summary_entity_count(db, endpoint_tablename, preselect_query, sample_fraction)
+
+        # Create list for select clause (total_count, entity count, column summaries, data_source, approximate)
+        summary_select_clause = [summary_columns[0], sub_file_count]
+        summary_select_clause += summary_columns[1:]
+        summary_select_clause += trailing_columns
+        
+        # Wrap everything in a subquery
+        subquery = db.query(*summary_select_clause).select_from(summary_from).subquery('json_result')
+        query = db.query(func.row_to_json(subquery.table_valued()).label('results')).params(filter_params)
+        sql_template_key = ('summary_sql', endpoint_tablename.lower(), filter_template[0], approximate, cohort is not None)
     
+    if explain:
+        with profiler.stage('compile'):
+            query.statement.compile(dialect=db.get_bind().dialect)
 
-    log.debug(f'Query:\n{"-"*60}\n{query_to_string(query)}\n{"-"*60}')
+    log_query(log, query, width=60)
 
     start_time = time.time()
-    result = query.all()
-    result = [row for row, in result]
+    with profiler.stage('execute'):
+        result = query.all()
+        result = [row for row, in result]
     query_time = time.time() - start_time
     log.info(f'Query execution time: {query_time}s')
 
-    # Fake return for now
+    with profiler.stage('serialize'):
+        ret = {
+            'result': result,
+            'query_sql': query_to_string(query, template_key=sql_template_key, params=filter_params) if include_sql else None
+        }
+    SUMMARY_CACHE.set(summary_key, ret)
+    ret = dict(ret)
+
+    profiler.finish()
+    profiler.log_if_slow()
+    if explain:
+        profiler.plans['summary'] = explain_query(db, query)
+        ret['profile'] = profiler.as_dict()
+    return ret
+
+
+def build_parallel_summary_queries(db, endpoint_tablename, qnode, log, include_sql=True, approximate=False, cohort=None):
+    """Builds the summary as independent single row json statements for parallel_summary_query
+
+    Returns:
+        tuple: (statements, result keys in summary_query's order, SQL statements as query_sql (None if not include_sql))
+    """
+    filter_template = get_qnode_filter_template(qnode, log)
+    preselect_query, sample_fraction, filter_params = build_summary_preselect(db, endpoint_tablename, qnode, log, approximate, cohort, filter_template)
+    component_queries, summary_columnnames = build_summary_component_queries(db=db,
+                                                                             endpoint_tablename=endpoint_tablename,
+                                                                             preselect_query=preselect_query,
+                                                                             column_infos=DB_MAP.get_table_column_infos(endpoint_tablename),
+                                                                             log=log,
+                                                                             sample_fraction=sample_fraction)
+    sub_file_count = build_summary_entity_count(db, endpoint_tablename, preselect_query, sample_fraction)
+    component_queries.append(db.query(sub_file_count))
+
+    queries = []
+    for component_query in component_queries:
+        subquery = component_query.subquery('json_result')
+        query = db.query(func.row_to_json(subquery.table_valued()).label('results')).params(filter_params)
+        log_query(log, query, width=60)
+        queries.append(query)
+
+    result_keys = ['total_count', sub_file_count.name] + [f'{columnname}_summary' for columnname in summary_columnnames] + ['data_source']
+    if sample_fraction:
+        result_keys.append('approximate')
+    sql_template_key = ('parallel_summary_sql', endpoint_tablename.lower(), filter_template[0], approximate, cohort is not None)
+    query_sql = '; '.join(query_to_string(query, template_key=sql_template_key + (i,), params=filter_params) 
+                          for i, query in enumerate(queries)) if include_sql else None
+    return [query.statement for query in queries], result_keys, query_sql
+
+
+async def parallel_summary_query(db, endpoint_tablename, qnode, log, include_sql=True, use_rollup=True, approximate=False, cohort=None):
+    """Generates the same summary as summary_query, but executes its independent parts (total count and numeric 
+    summaries, each categorical summary, and the related entity count) at the same time on separate connections 
+    that share the snapshot of db's transaction
+
+    Args:
+        db (AsyncSession): Database session object
+        endpoint_tablename (str): Name of the endpoint table
+        qnode (QNode): JSON input query
+        include_sql (bool, optional): Render the SQL statements as query_sql (None otherwise). Defaults to True.
+        use_rollup (bool, optional): Use the summary precomputed for the release when there is one. Defaults to True.
+        approximate (bool, optional): Estimate the summary from a sample of the endpoint table. Defaults to False.
+        cohort (str, optional): Handle of a materialized cohort to restrict the summary to. Defaults to None.
+
+    Returns:
+        SummaryResponseObj: 
+        {
+            'result': [{'summary': 'data'}],
+            'query_sql': 'SQL statements used to generate result (separated by ;)'
+        }
+    """
+    summary_key, cached_result = await db.run_sync(get_cached_summary, 
+                                                   endpoint_tablename=endpoint_tablename, 
+                                                   qnode=qnode, 
+                                                   log=log, 
+                                                   include_sql=include_sql, 
+                                                   use_rollup=use_rollup, 
+                                                   approximate=approximate,
+                                                   cohort=cohort)
+    if cached_result is not None:
+        return cached_result
+
+    # Staged filter values are in temp tables that only db's connection can see
+    if has_staged_filters(get_qnode_filter_template(qnode, log)):
+        log.info('Running the summary as a single query since it has staged filter values')
+        return await db.run_sync(summary_query, endpoint_tablename=endpoint_tablename, qnode=qnode, log=log, 
+                                 include_sql=include_sql, use_rollup=False, approximate=approximate, cohort=cohort)
+
+    log.info('Building parallel summary queries')
+    statements, result_keys, query_sql = await db.run_sync(build_parallel_summary_queries, 
+                                                           endpoint_tablename=endpoint_tablename, 
+                                                           qnode=qnode, 
+                                                           log=log, 
+                                                           include_sql=include_sql, 
+                                                           approximate=approximate,
+                                                           cohort=cohort)
+
+    start_time = time.time()
+    component_results = await execute_parallel(db, statements, 'summary', log)
+    query_time = time.time() - start_time
+    log.info(f'Query execution time: {query_time}s')
+
+    # Every component returns a single json row, merged back into summary_query's key order
+    summary = {}
+    for component_result in component_results:
+        summary.update(component_result[0])
     ret = {
-        'result': result,
-        'query_sql': query_to_string(query)
+        'result': [{key: summary.get(key) for key in result_keys}],
+        'query_sql': query_sql
     }
-    return ret
+    SUMMARY_CACHE.set(summary_key, ret)
+    return dict(ret)
 
 
-def columns_query(db):
-    """Generates list of column info for entity tables.
+def create_cohort(db, endpoint_tablename, qnode, log, cohort=None):
+    """Materializes the id_alias values matching the input query in memory under a cohort handle, 
+    so later pages, summaries, and exports can use the handle instead of re-evaluating the filters
 
     Args:
         db (Session): Database session object
-        TODO
+        endpoint_tablename (str): Name of the endpoint table
+        qnode (QNode): JSON input query
+        cohort (str, optional): Handle of an existing cohort to refine with the input query. Defaults to None.
+
+    Returns:
+        CohortResponseObj:
+        {
+            'cohort': 'cohort handle',
+            'endpoint': 'endpoint table name',
+            'size': 'number of id_alias values in the cohort'
+        }
+    """
+    log.info('Building cohort')
+    release = get_release_fingerprint(db)
+    handle = get_cohort_handle(release, get_qnode_filter_key(endpoint_tablename, qnode, log, cohort))
+
+    match_all_conditions, match_some_conditions, filter_params = build_match_conditons(endpoint_tablename, qnode, log, cohort=cohort, db=db)
+    filter_preselect_query, endpoint_id_alias = build_filter_preselect(db, endpoint_tablename, match_all_conditions, match_some_conditions)
+    query = filter_preselect_query.params(filter_params)
+    log_query(log, query, title='Cohort Query')
+
+    start_time = time.time()
+    id_aliases = [id_alias for id_alias, in query.all()]
+    cohort_entry = store_cohort(handle, endpoint_tablename, id_aliases)
+    log.info(f'Materialized {len(cohort_entry["ids"])} id_alias values in {time.time() - start_time}s')
+    return {'cohort': handle, 'endpoint': endpoint_tablename, 'size': len(cohort_entry['ids'])}
+
+
+def columns_query():
+    """Generates list of column info for entity tables from DB_MAP (no database query).
 
     Returns:
         ColumnResponseObj: 
@@ -220,11 +593,58 @@ def columns_query(db):
     return ret
 
 
-def unique_value_query(db, columnname, system, countOpt, totalCount, limit, offset, log):
+# Builds the unique values query of a column (optionally with value counts, only for a system, and matching a search)
+def build_unique_values_query(db, column, data_system_column=None, countOpt=True, prefix=None, contains=None):
+    if countOpt:
+        unique_values_query = db.query(column, func.count().label('value_count')).group_by(column).order_by(column)
+    else:
+        unique_values_query = db.query(distinct(column).label(column.name)).order_by(column)
+
+    if data_system_column is not None:
+        unique_values_query = unique_values_query.filter(data_system_column.is_(True))
+    if prefix:
+        unique_values_query = unique_values_query.filter(cast(column, Text).istartswith(prefix, autoescape=True))
+    if contains:
+        unique_values_query = unique_values_query.filter(cast(column, Text).icontains(contains, autoescape=True))
+
+    return unique_values_query.subquery('column_json')
+
+
+# Gets the cached UniqueValueIndex of a column and system, building it on a miss 
+# (False when the column has too many unique values to be indexed in memory)
+def get_unique_value_index(db, column, system, data_system_column, log):
+    release = get_release_fingerprint(db)
+    cache_key = (release, column.table.name, column.name, system.lower())
+    value_index = UNIQUE_VALUES_CACHE.get(cache_key)
+    if value_index is not None:
+        log.info('Using cached unique values')
+        return value_index
+
+    unique_values_query = build_unique_values_query(db, column, data_system_column)
+    query = db.query(func.row_to_json(unique_values_query.table_valued()))
+    log_query(log, query, title='Unique Values Index Query', width=60)
+    start_time = time.time()
+    rows = [row for row, in query.limit(UNIQUE_VALUES_CACHE_MAX_VALUES + 1).all()]
+    log.info(f'Unique values index query execution time: {time.time() - start_time}s')
+    if len(rows) > UNIQUE_VALUES_CACHE_MAX_VALUES:
+        log.info(f'{column.name} has more than {UNIQUE_VALUES_CACHE_MAX_VALUES} unique values, not caching')
+        value_index = False
+    else:
+        value_index = UniqueValueIndex(column.name, rows, query_to_string(query))
+    UNIQUE_VALUES_CACHE.set(cache_key, value_index)
+    return value_index
+
+
+def unique_value_query(db, columnname, system, countOpt, totalCount, limit, offset, log, include_sql=True, prefix=None, contains=None):
     """Generates json formatted frequency results based on query for specific column
 
+    The unique values (with counts) of each column and system are cached per release and searched in memory
+    unless the column has more than UNIQUE_VALUES_CACHE_MAX_VALUES unique values
+
     Args:
         db (Session): Database session object
+        prefix (str, optional): Only return values starting with prefix (case insensitive). Defaults to None.
+        contains (str, optional): Only return values containing the string (case insensitive). Defaults to None.
         TODO
 
     Returns:
@@ -238,27 +658,43 @@ def unique_value_query(db, columnname, system, countOpt, totalCount, limit, offs
 
     column = DB_MAP.get_meta_column(columnname)
 
-    if countOpt:
-        unique_values_query = db.query(column, func.count().label('value_count')).group_by(column).order_by(column)
-    else:
-        unique_values_query = db.query(distinct(column).label(column.name)).order_by(column)
-
+    data_system_column = None
     if system:
         try:
             data_system_column = DB_MAP.get_meta_column(f"{column.table.name}_data_at_{system.lower()}")
-            unique_values_query = unique_values_query.filter(data_system_column.is_(True))
         except Exception as e:
             error = SystemNotFound(f'system: {system} - not found')
             log.exception(error)
             raise error
-    
-    unique_values_query = unique_values_query.subquery('column_json')
+
+    value_index = get_unique_value_index(db, column, system, data_system_column, log)
+    if value_index:
+        start_time = time.time()
+        matches = value_index.search(prefix=prefix, contains=contains)
+        total_count = len(matches)
+        matches = matches[offset or 0:]
+        if limit is not None:
+            matches = matches[:limit]
+        if countOpt:
+            result = list(matches)
+        else:
+            result = [{column.name: row[column.name]} for row in matches]
+        log.info(f'Searched cached unique values in {time.time() - start_time}s')
+        log.info(f'Returning {len(result)} rows out of {total_count} results | limit={limit} & offset={offset}')
+        return {
+            'result': result,
+            'query_sql': value_index.query_sql if include_sql else None,
+            'total_row_count': total_count,
+            'next_url': ''
+        }
+
+    unique_values_query = build_unique_values_query(db, column, data_system_column, countOpt, prefix, contains)
     
     query = db.query(func.row_to_json(unique_values_query.table_valued()))
     total_count_query = db.query(func.count()).select_from(unique_values_query)
     
-    log.debug(f'Query:\n{"-"*60}\n{query_to_string(query, indented = True)}\n{"-"*60}')
-    log.debug(f'Total Count Query:\n{"-"*100}\n{query_to_string(total_count_query, indented = True)}\n{"-"*100}')
+    log_query(log, query, width=60)
+    log_query(log, total_count_query, title='Total Count Query')
 
     # Execute query
     start_time = time.time()
@@ -275,7 +711,7 @@ def unique_value_query(db, columnname, system, countOpt, totalCount, limit, offs
     # Fake return for now
     ret = {
         'result': result,
-        'query_sql': query_to_string(query),
+        'query_sql': query_to_string(query) if include_sql else None,
         'total_row_count': total_count,
         'next_url': ''
     }
@@ -285,7 +721,7 @@ def unique_value_query(db, columnname, system, countOpt, totalCount, limit, offs
 
 def release_metadata_query(db, log):
     query = db.query(Base.metadata.tables['release_metadata'])
-    log.debug(f'Query:\n{"-"*60}\n{query_to_string(query)}\n{"-"*60}')
+    log_query(log, query, width=60)
     # Fake return for now
     ret = {
         'result': [{'release_metadata': 'success'}],
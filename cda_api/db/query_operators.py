@@ -1,4 +1,31 @@
-from sqlalchemy import func, Column
+from sqlalchemy import func, or_, any_, all_, Column, BindParameter
+from os import getenv
+
+# How case insensitive string filters compare values:
+# 'sargable' compares upper(column) for =/like so indexes on upper(column) can serve them (NULL handling is added only when the value needs it)
+# 'coalesce' compares coalesce(upper(column), '') for every filter
+CASE_INSENSITIVE_MODE = getenv('CASE_INSENSITIVE_MODE', 'sargable').lower()
+
+# Filter values can either be the value itself or a bind parameter holding the value
+def is_string_value(filter_value):
+    if isinstance(filter_value, BindParameter):
+        filter_value = filter_value.value
+    return isinstance(filter_value, str)
+
+# Case insensitive filters treat NULL as '', so "= ''" and like patterns made of only '%' also match NULL values
+def matches_null(filter_operator, filter_value):
+    if isinstance(filter_value, BindParameter):
+        filter_value = filter_value.value
+    if not isinstance(filter_value, str):
+        return False
+    match filter_operator.lower():
+        case '=':
+            return filter_value == ''
+        case 'like':
+            return filter_value.strip('%') == ''
+        case _:
+            return False
+
 
 def apply_filter_operator(filter_column, filter_value, filter_operator, log):
     log.debug(f'Applying filter {filter_column} {filter_operator} {filter_value}')
@@ -12,12 +39,12 @@ def apply_filter_operator(filter_column, filter_value, filter_operator, log):
         case 'not in':
             return not_in_array(filter_column, filter_value)
         case '=':
-            if isinstance(filter_value, str):
+            if is_string_value(filter_value):
                 return case_insensitive_equals(filter_column, filter_value)
             else:
                 return filter_column == filter_value
         case '!=':
-            if isinstance(filter_value, str):
+            if is_string_value(filter_value):
                 return case_insensitive_not_equals(filter_column, filter_value)
             else:
                 return filter_column != filter_value
@@ -40,28 +67,49 @@ def apply_filter_operator(filter_column, filter_value, filter_operator, log):
         case _:
             raise ValueError(f'Unexpected operator: {filter_operator}')
 
+# Returns the column value with NULL as '' for the negated filters (NULL values don't equal or match the value)
+def coalesced_upper(column):
+    return func.coalesce(func.upper(column), '')
+
+# Returns the expression = and like filters compare against (index_advisor.py builds expression indexes on it)
+def case_insensitive_value(column):
+    if CASE_INSENSITIVE_MODE == 'coalesce':
+        return coalesced_upper(column)
+    return func.upper(column)
+
+# Adds the NULL values to a sargable filter when the value also matches ''
+def or_null(condition, column, filter_operator, value):
+    if (CASE_INSENSITIVE_MODE != 'coalesce') and matches_null(filter_operator, value):
+        return or_(condition, column.is_(None))
+    return condition
+
 # Returns a case insensitive like filter conditional object
 def case_insensitive_like(column, value):
-    return func.coalesce(func.upper(column), '').like(func.upper(value))
+    return or_null(case_insensitive_value(column).like(func.upper(value)), column, 'like', value)
 
 # Returns a case insensitive equals filter conditional object
 def case_insensitive_equals(column, value):
-    return func.coalesce(func.upper(column), '') == func.upper(value)
+    return or_null(case_insensitive_value(column) == func.upper(value), column, '=', value)
 
-# Returns a case insensitive like filter conditional object
+# Returns a case insensitive not like filter conditional object
 def case_insensitive_not_like(column, value):
-    return func.coalesce(func.upper(column), '').not_like(func.upper(value))
+    return coalesced_upper(column).not_like(func.upper(value))
 
-# Returns a case insensitive equals filter conditional object
+# Returns a case insensitive not equals filter conditional object
 def case_insensitive_not_equals(column, value):
-    return func.coalesce(func.upper(column), '') == func.upper(value)
+    return coalesced_upper(column) != func.upper(value)
 
 # Returns a case insensitive 'is not' filter conditional object
 def case_insensitive_is_not(column, value):
-    return func.coalesce(func.upper(column), '').is_not(func.upper(value))
+    return coalesced_upper(column).is_not(func.upper(value))
 
+# Lists bound as a single array parameter compare with = ANY()/!= ALL() instead of expanding to a parameter per value
 def in_array(column, value):
+    if isinstance(value, BindParameter):
+        return column == any_(value)
     return column.in_(value)
 
 def not_in_array(column, value):
+    if isinstance(value, BindParameter):
+        return column != all_(value)
     return column.notin_(value)
@@ -1,18 +1,116 @@
-from sqlalchemy import func, Integer, distinct, and_, or_
+from sqlalchemy import func, Integer, distinct, and_, or_, select, true, text, bindparam
 from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql.base import PGDialect
+from os import getenv
 import sqlparse
-from cda_api import get_logger, MappingError, ColumnNotFound, TableNotFound, SystemNotFound
+import logging
+import base64
+import json
+import re
+from cda_api import get_logger, MappingError, ColumnNotFound, TableNotFound, SystemNotFound, ParsingError
+from cda_api.classes.QueryCache import QueryCache
+from cda_api.classes.SQLiteCacheBackend import SQLiteCacheBackend
 from cda_api.db import DB_MAP
+from cda_api.db.connection import engine
+from cda_api.db.release import register_release_cache, register_release_loader
 
 log = get_logger()
 
+# Cache of exact total row counts keyed on the release and normalized QNode filters
+ROW_COUNT_CACHE = register_release_cache(QueryCache(max_entries=int(getenv('ROW_COUNT_CACHE_SIZE', 4096)),
+                                                    ttl=int(getenv('ROW_COUNT_CACHE_TTL', 3600))))
+
+# Cache of summary results keyed on the release and normalized QNode filters (optionally shared through SQLite)
+SUMMARY_CACHE_SQLITE_PATH = getenv('SUMMARY_CACHE_SQLITE_PATH')
+SUMMARY_CACHE = register_release_cache(QueryCache(max_entries=int(getenv('SUMMARY_CACHE_SIZE', 256)),
+                                                  ttl=int(getenv('SUMMARY_CACHE_TTL', 86400)),
+                                                  max_bytes=int(getenv('SUMMARY_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+                                                  backend=SQLiteCacheBackend(SUMMARY_CACHE_SQLITE_PATH) if SUMMARY_CACHE_SQLITE_PATH else None))
+
+# Cache of the unique values (with counts) of each column and system keyed on the release
+# (UniqueValueIndex objects, or False for columns with too many unique values to index)
+UNIQUE_VALUES_CACHE = register_release_cache(QueryCache(max_entries=int(getenv('UNIQUE_VALUES_CACHE_SIZE', 256)),
+                                                        ttl=int(getenv('UNIQUE_VALUES_CACHE_TTL', 86400)),
+                                                        max_bytes=int(getenv('UNIQUE_VALUES_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+                                                        get_size=lambda value_index: value_index.size if value_index else 0))
+
+# Columns with more unique values than this are always queried instead of indexed in memory
+UNIQUE_VALUES_CACHE_MAX_VALUES = int(getenv('UNIQUE_VALUES_CACHE_MAX_VALUES', 100000))
+
+# Cache of filter conditionals and fetch_rows queries built with named bind parameters, keyed on the shape of the QNode
+# (the schema only changes between deployments, so these are not cleared on a new release)
+FILTER_TEMPLATE_CACHE = QueryCache(max_entries=int(getenv('FILTER_TEMPLATE_CACHE_SIZE', 1024)),
+                                   ttl=int(getenv('FILTER_TEMPLATE_CACHE_TTL', 86400)))
+
+# Cache of the planner row estimates of the tables (used to order foreign table filters)
+# Loaded on startup and on every new release (see load_table_row_estimates), so it never expires
+TABLE_STATISTICS_CACHE = register_release_cache(QueryCache(max_entries=1, ttl=float('inf')))
+
+# Cache of compiled SQL templates (with bind parameter placeholders) keyed on the shape of the query (see query_to_string)
+QUERY_STRING_CACHE = QueryCache(max_entries=int(getenv('QUERY_STRING_CACHE_SIZE', 1024)),
+                                ttl=int(getenv('QUERY_STRING_CACHE_TTL', 86400)))
+
+# SQL strings are compiled with pyformat placeholders and without the bind casts the psycopg dialect adds
+QUERY_STRING_DIALECT = PGDialect(paramstyle='pyformat')
+BIND_PLACEHOLDER = re.compile(r'%\((?P<name>\w+)\)s|__\[POSTCOMPILE_(?P<expanding_name>\w+)\]')
+
+# Array and list values with more items than this are rendered as a placeholder with their length (ex. ":match_all_0 /* 8500 values */")
+QUERY_STRING_MAX_VALUES = int(getenv('QUERY_STRING_MAX_VALUES', 100))
+
+
+# Renders a bind parameter value as a SQL literal (the items of expanding "IN" parameters are rendered as a list)
+def render_bind_value(compiled, name, value, expanding=False, elide_values=True):
+    bind_type = compiled.binds[name].type
+    if elide_values and isinstance(value, (list, tuple)) and (len(value) > QUERY_STRING_MAX_VALUES):
+        return f':{name} /* {len(value)} values */'
+    if expanding:
+        return ', '.join(render_bind_value(compiled, name, item) for item in value)
+    if value is None:
+        return 'NULL'
+    return compiled.render_literal_value(value, bind_type)
+
+
 # Generates compiled SQL string from query object
-def query_to_string(q, indented=False) -> str:
-    sql_string = str(q.statement.compile(compile_kwargs={"literal_binds": True}, dialect=postgresql.dialect()))
+def query_to_string(q, indented=False, template_key=None, params=None, elide_values=True) -> str:
+    """Renders the SQL statement of a query with its bind parameter values as literals
+
+    Args:
+        q (Query): Query to render
+        indented (bool, optional): Reindent the SQL with sqlparse. Defaults to False.
+        template_key (tuple, optional): Key of the query's shape. Queries with the same shape only differ by the values of 
+            their named bind parameters, so their compiled template is cached and only the values are rendered. Defaults to None (always compile).
+        params (dict, optional): Values of the named bind parameters (ex. filter_params) when using template_key. Defaults to None.
+        elide_values (bool, optional): Render lists longer than QUERY_STRING_MAX_VALUES as a placeholder with their length, 
+            which keeps the SQL readable but not runnable. Defaults to True.
+
+    Returns:
+        str: SQL string
+    """
+    compiled = QUERY_STRING_CACHE.get(template_key) if template_key is not None else None
+    if compiled is None:
+        compiled = q.statement.compile(dialect=QUERY_STRING_DIALECT)
+        if template_key is not None:
+            QUERY_STRING_CACHE.set(template_key, compiled)
+    bind_values = compiled.params
+    if params:
+        bind_values.update(params)
+
+    def render_placeholder(match):
+        if match['name'] is not None:
+            return render_bind_value(compiled, match['name'], bind_values[match['name']], elide_values=elide_values)
+        return render_bind_value(compiled, match['expanding_name'], bind_values[match['expanding_name']], expanding=True, elide_values=elide_values)
+    sql_string = BIND_PLACEHOLDER.sub(render_placeholder, compiled.string)
     if indented:
-        return sqlparse.format(sql_string, reindent=True, keyword_case='upper')
+        sql_string = sqlparse.format(sql_string, reindent=True, keyword_case='upper')
     else:
-        return sql_string.replace('\n', '')
+        sql_string = sql_string.replace('\n', '')
+    return sql_string
+
+
+# Logs the indented SQL string of a query (only rendered when the logger is enabled for DEBUG)
+def log_query(log, q, title='Query', width=100) -> None:
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f'{title}:\n{"-"*width}\n{query_to_string(q, indented=True)}\n{"-"*width}')
 
 
 # Prints compiled SQL string from query object
@@ -20,6 +118,26 @@ def print_query(q) -> None:
     print(query_to_string(q, indented=True))
 
 
+# Encodes the last id_alias of a page into an opaque keyset pagination cursor
+def encode_cursor(last_id_alias) -> str:
+    cursor_json = json.dumps({'id_alias': last_id_alias}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(cursor_json.encode()).decode().rstrip('=')
+
+
+# Decodes a keyset pagination cursor back into the last id_alias seen (None when starting from the first row)
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        padded_cursor = cursor + '=' * (-len(cursor) % 4)
+        last_id_alias = json.loads(base64.urlsafe_b64decode(padded_cursor.encode()))['id_alias']
+    except Exception:
+        raise ParsingError(f'Invalid cursor: "{cursor}"')
+    if not isinstance(last_id_alias, int):
+        raise ParsingError(f'Invalid cursor: "{cursor}"')
+    return last_id_alias
+
+
 # Returns the column object from a cte (Common Table Expression) object
 def get_cte_column(cte, columnname):
     return getattr(cte.c, columnname)
@@ -34,35 +152,6 @@ def total_column_count_subquery(db, column):
     return db.query(distinct_count(column).label('count_result')).scalar_subquery()
 
 
-# Gets statistics of a row for numeric columns
-def numeric_summary(db, column):
-    column_subquery = db.query(func.min(column).label('min'),
-                 func.max(column).label('max'),
-                 func.avg(column).label('mean'),
-                 func.percentile_disc(0.5).within_group(column).label('median'),
-                 func.percentile_disc(0.25).within_group(column).label('lower_quartile'),
-                 func.percentile_disc(0.75).within_group(column).label('upper_quartile')).subquery('subquery')
-    column_json = db.query(func.row_to_json(column_subquery.table_valued()).label(f'{column.name}_stats')).cte(f"json_{column.name}")
-    return db.query(func.array_agg(get_cte_column(column_json, f"{column.name}_stats"))).scalar_subquery()
-
-
-# Gets the categorical(grouped) json counts of a row
-def categorical_summary(db, column):
-    column_preselect = db.query(column, func.count().label('count_result')).group_by(column).subquery('subquery')
-    column_json = db.query(func.row_to_json(column_preselect.table_valued()).label(f'{column.name}_categories')).cte(f"json_{column.name}")
-    return db.query(func.array_agg(get_cte_column(column_json, f'{column.name}_categories'))).scalar_subquery()
-
-
-
-# Combines the counts of data source columns into a single json for use in summary endpoint
-def data_source_counts(db, data_source_columns):
-    data_source_counts = [func.sum(func.cast(column, Integer)).label(column.name.split('_')[-1]) 
-                          for column in data_source_columns]
-    data_source_preselect = db.query(*data_source_counts).subquery('subquery')
-    data_source_json = db.query(func.row_to_json(data_source_preselect.table_valued()))
-    return data_source_json
-
-
 # Gets the total count of an entity's related files and subjects by only counting from the mapping table (ie. observation_of_subject)
 def entity_count(db, endpoint_tablename, preselect_query, entity_to_count):
     entity_relationship = DB_MAP.get_relationship(endpoint_tablename, entity_to_count)
@@ -117,6 +206,108 @@ def build_foreign_array_preselect(db, entity_tablename, foreign_tablename, colum
         foreign_join = {'target': target, 'onclause': onclause}
     return foreign_array_preselect, foreign_join, preselect_columns
 
+# Pages the matching id_alias values (ordered by id_alias) so the select columns and foreign column arrays are only built 
+# for the rows on the page. The page is bound as parameters: page_limit, and page_offset or page_last_id_alias (seek)
+def build_page_preselect(db, filter_preselect_query, keyset=False, seek=False):
+    preselect_id_alias = filter_preselect_query.column_descriptions[0]['expr']
+    page_query = filter_preselect_query
+    if seek:
+        page_query = page_query.filter(preselect_id_alias > bindparam('page_last_id_alias', type_=Integer))
+    page_query = page_query.order_by(preselect_id_alias)
+    if not keyset:
+        page_query = page_query.offset(bindparam('page_offset', type_=Integer))
+    page_query = page_query.limit(bindparam('page_limit', type_=Integer)).cte('page_preselect')
+    return db.query(page_query.c.id_alias)
+
+
+# Wraps a fetch_rows select (whose first column is the id_alias labeled 'cursor_id_alias') into a keyset paged json query
+def build_keyset_page_query(db, query, endpoint_id_alias, last_id_alias, limit):
+    # Seek past the last id_alias of the previous page instead of discarding offset rows
+    if last_id_alias is not None:
+        query = query.filter(endpoint_id_alias > last_id_alias)
+    page = query.order_by(endpoint_id_alias).limit(limit + 1).subquery('page')
+    return build_page_json_query(db, page, include_cursor_column=True)
+
+
+# Builds the json of every column of a page subquery (whose first column is the id_alias labeled 'cursor_id_alias') 
+# except the cursor column using a lateral subquery, ordered by the cursor column
+def build_page_json_query(db, page, include_cursor_column=False):
+    json_columns = [column for column in page.c if column.name != 'cursor_id_alias']
+    json_result = select(*json_columns).correlate(page).lateral('json_result')
+    select_columns = [func.row_to_json(json_result.table_valued())]
+    if include_cursor_column:
+        select_columns.append(page.c.cursor_id_alias)
+    page_query = db.query(*select_columns
+                    ).select_from(
+                        page
+                    ).join(
+                        json_result, true()
+                    ).order_by(
+                        page.c.cursor_id_alias
+                    )
+    return page_query
+
+# Uses the query planner's row estimate for the query instead of counting the rows
+def estimate_row_count(db, query):
+    explain_result = db.execute(text(f'EXPLAIN (FORMAT JSON) {query_to_string(query, elide_values=False)}')).scalar()
+    if isinstance(explain_result, str):
+        explain_result = json.loads(explain_result)
+    return int(explain_result[0]['Plan']['Plan Rows'])
+
+
+# Runs the query with EXPLAIN ANALYZE and returns its plan (with actual timings and buffer usage)
+def explain_query(db, query):
+    explain_result = db.execute(text(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query_to_string(query, elide_values=False)}')).scalar()
+    if isinstance(explain_result, str):
+        explain_result = json.loads(explain_result)
+    return explain_result[0]
+
+
+# Loads the planner row estimate (pg_class.reltuples) of each table into TABLE_STATISTICS_CACHE, leaving out tables that haven't been analyzed
+@register_release_loader
+def load_table_row_estimates(db):
+    rows = db.execute(text("SELECT relname, reltuples FROM pg_class "
+                           "WHERE relkind IN ('r', 'p', 'm') AND relnamespace = current_schema()::regnamespace AND reltuples >= 0")).all()
+    row_estimates = {relname: reltuples for relname, reltuples in rows}
+    TABLE_STATISTICS_CACHE.set('reltuples', row_estimates)
+    return row_estimates
+
+
+# Gets the cached table row estimates without querying the database (empty if they couldn't be loaded)
+def get_table_row_estimates():
+    return TABLE_STATISTICS_CACHE.get('reltuples', {})
+
+
+try:
+    with engine.connect() as connection:
+        load_table_row_estimates(connection)
+except Exception as e:
+    log.warning(f'Unable to load table row estimates: {e}')
+
+
+# Gets the total row count based on the row_count mode ('exact', 'estimate', or 'none') reusing cached exact counts
+def get_row_count(db, rows_to_count, count_query, count_key, row_count, log):
+    if row_count == 'none':
+        log.info('Skipping total row count')
+        return None
+
+    cached_row_count = ROW_COUNT_CACHE.get(count_key)
+    if cached_row_count is not None:
+        log.info('Using cached total row count')
+        return cached_row_count
+
+    match row_count:
+        case 'estimate':
+            log.info('Estimating total row count from the query plan')
+            return estimate_row_count(db, rows_to_count)
+        case 'exact':
+            exact_row_count = count_query.scalar()
+            ROW_COUNT_CACHE.set(count_key, exact_row_count)
+            return exact_row_count
+        case _:
+            raise ValueError(f'Unexpected row_count option: {row_count}')
+
+
 def build_filter_preselect(db, endpoint_tablename, match_all_conditions, match_some_conditions):
     # Get the id_alias column
     endpoint_id_alias = DB_MAP.get_meta_column(f"{endpoint_tablename}_id_alias")
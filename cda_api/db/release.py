@@ -0,0 +1,63 @@
+from sqlalchemy import text
+from os import getenv
+from threading import Lock
+import hashlib
+import json
+import time
+from cda_api import get_logger
+
+log = get_logger('Utility: db/release.py')
+
+# How often (in seconds) release_metadata is checked for a new release
+RELEASE_CHECK_INTERVAL = float(getenv('RELEASE_CHECK_INTERVAL', 60))
+
+# Caches holding release specific results that need to be cleared when release_metadata changes
+RELEASE_CACHES = []
+
+# Functions that reload release specific data with the database session once a new release is detected
+RELEASE_LOADERS = []
+
+_release_lock = Lock()
+_current_release = {'fingerprint': None, 'checked_at': 0.0}
+
+
+# Register a cache to be cleared whenever a new release is detected
+def register_release_cache(cache):
+    RELEASE_CACHES.append(cache)
+    return cache
+
+
+# Register a function to be called with the database session whenever a new release is detected
+def register_release_loader(loader):
+    RELEASE_LOADERS.append(loader)
+    return loader
+
+
+# Hashes the contents of release_metadata into a short fingerprint
+def query_release_fingerprint(connection):
+    rows = connection.execute(text('SELECT row_to_json(release_metadata) FROM release_metadata')).scalars().all()
+    rows = sorted(json.dumps(row, sort_keys=True, default=str) for row in rows)
+    return hashlib.sha256(json.dumps(rows).encode()).hexdigest()[:16]
+
+
+# Gets the current release fingerprint, re-checking the database at most every RELEASE_CHECK_INTERVAL seconds
+def get_release_fingerprint(db):
+    now = time.monotonic()
+    with _release_lock:
+        if (_current_release['fingerprint'] is not None) and (now - _current_release['checked_at'] < RELEASE_CHECK_INTERVAL):
+            return _current_release['fingerprint']
+
+    fingerprint = query_release_fingerprint(db)
+
+    with _release_lock:
+        previous_fingerprint = _current_release['fingerprint']
+        _current_release['fingerprint'] = fingerprint
+        _current_release['checked_at'] = now
+
+    if (previous_fingerprint is not None) and (previous_fingerprint != fingerprint):
+        log.info(f'release_metadata changed ({previous_fingerprint} -> {fingerprint}), clearing release caches')
+        for cache in RELEASE_CACHES:
+            cache.clear()
+        for loader in RELEASE_LOADERS:
+            loader(db)
+    return fingerprint
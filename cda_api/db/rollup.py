@@ -0,0 +1,69 @@
+from sqlalchemy import MetaData, Table, Column, Text, select, func, text
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from os import getenv
+from cda_api.classes.QueryCache import QueryCache
+from cda_api.db.release import register_release_cache
+
+# Rollups are kept in their own schema so they aren't picked up by the automapped schema
+SUMMARY_ROLLUP_SCHEMA = getenv('SUMMARY_ROLLUP_SCHEMA', 'cda_rollup')
+
+rollup_metadata = MetaData(schema=SUMMARY_ROLLUP_SCHEMA)
+
+# Precomputed summary_query results keyed on the release fingerprint and normalized QNode filter key
+summary_rollup = Table('summary_rollup', rollup_metadata,
+                       Column('release', Text, primary_key=True),
+                       Column('qnode_key', Text, primary_key=True),
+                       Column('summary', JSONB, nullable=False))
+
+# Whether the rollup table exists, so summary requests don't check for it every time
+# (rechecked after the time to live in case the rollups are built by another process)
+SUMMARY_ROLLUP_EXISTS_CACHE = register_release_cache(QueryCache(max_entries=1, 
+                                                                ttl=int(getenv('SUMMARY_ROLLUP_EXISTS_CACHE_TTL', 300))))
+
+
+# Creates the rollup schema and table if they don't exist
+def create_summary_rollup_table(connection):
+    connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{SUMMARY_ROLLUP_SCHEMA}"'))
+    rollup_metadata.create_all(connection)
+    SUMMARY_ROLLUP_EXISTS_CACHE.set('summary_rollup', True)
+
+
+def summary_rollup_exists(db):
+    table_exists = SUMMARY_ROLLUP_EXISTS_CACHE.get('summary_rollup')
+    if table_exists is None:
+        table_exists = db.execute(select(func.to_regclass(f'{SUMMARY_ROLLUP_SCHEMA}.summary_rollup').is_not(None))).scalar()
+        SUMMARY_ROLLUP_EXISTS_CACHE.set('summary_rollup', table_exists)
+    return table_exists
+
+
+# Only QNodes with no filters or a single filter can have a precomputed rollup
+def is_rollup_candidate(qnode):
+    filter_count = len(qnode.MATCH_ALL or []) + len(qnode.MATCH_SOME or [])
+    return filter_count <= 1
+
+
+# Gets the precomputed summary for the release and QNode filter key (None when there isn't one)
+def get_summary_rollup(db, release, qnode_key):
+    if not summary_rollup_exists(db):
+        return None
+    query = select(summary_rollup.c.summary).where(summary_rollup.c.release == release, summary_rollup.c.qnode_key == qnode_key)
+    return db.execute(query).scalar()
+
+
+# Stores precomputed summaries ({qnode_key: summary}) for a release, replacing any rollups from previous releases
+def replace_summary_rollups(db, release, summaries):
+    db.execute(summary_rollup.delete().where(summary_rollup.c.release != release))
+    if summaries:
+        rows = [{'release': release, 'qnode_key': qnode_key, 'summary': summary} for qnode_key, summary in summaries.items()]
+        query = insert(summary_rollup).values(rows)
+        query = query.on_conflict_do_update(index_elements=[summary_rollup.c.release, summary_rollup.c.qnode_key],
+                                            set_={'summary': query.excluded.summary})
+        db.execute(query)
+
+
+# Checks whether the rollups for a release have already been built
+def has_summary_rollups(db, release):
+    if not summary_rollup_exists(db):
+        return False
+    query = select(func.count()).select_from(summary_rollup).where(summary_rollup.c.release == release)
+    return db.execute(query).scalar() > 0
@@ -0,0 +1,97 @@
+from cda_api.db import DB_MAP
+from cda_api.db.connection import session
+from cda_api.db.filter_builder import get_qnode_filter_key
+from cda_api.db.query_builders import summary_query
+from cda_api.db.release import get_release_fingerprint
+from cda_api.db.rollup import create_summary_rollup_table, has_summary_rollups, replace_summary_rollups
+from cda_api.models import QNode
+from cda_api import get_logger, ParsingError
+from sqlalchemy import distinct
+from os import getenv
+import argparse
+import time
+
+# Endpoint tables that get summary rollups
+SUMMARY_ROLLUP_ENDPOINTS = ['subject', 'file']
+
+# Categorical columns with more distinct values than this don't get a rollup per value
+SUMMARY_ROLLUP_MAX_VALUES = int(getenv('SUMMARY_ROLLUP_MAX_VALUES', 100))
+
+
+# Gets the categorical summary columns of the endpoint table and the tables related to it
+def get_rollup_column_infos(endpoint_tablename):
+    tablenames = [endpoint_tablename] + list(DB_MAP.relationship_map.get(endpoint_tablename, {}).keys())
+    column_infos = []
+    for tablename in tablenames:
+        for column_info in DB_MAP.get_table_column_infos(tablename):
+            if (column_info.summary_display
+                and (column_info.column_type == 'categorical')
+                and (column_info.process_before_display != 'data_source')):
+                column_infos.append(column_info)
+    return column_infos
+
+
+# Gets the QNodes to precompute for an endpoint: no filters, and each value of the low cardinality categorical columns
+def get_rollup_qnodes(db, endpoint_tablename, log):
+    qnodes = [QNode()]
+    for column_info in get_rollup_column_infos(endpoint_tablename):
+        column = column_info.metadata_column
+        values = db.query(distinct(column)).filter(column.is_not(None)).limit(SUMMARY_ROLLUP_MAX_VALUES + 1).all()
+        if len(values) > SUMMARY_ROLLUP_MAX_VALUES:
+            log.info(f'Skipping rollups for {column_info.uniquename}: more than {SUMMARY_ROLLUP_MAX_VALUES} values')
+            continue
+        for value, in values:
+            if isinstance(value, bool):
+                continue
+            qnodes.append(QNode(MATCH_ALL=[f'{column_info.uniquename} = {value!r}']))
+    return qnodes
+
+
+def build_summary_rollups(db, log, force=False):
+    """Precomputes summary_query results for the current release (once per release unless forced)
+
+    Args:
+        db (Session): Database session object
+        force (bool, optional): Rebuild the rollups even if they exist for the current release. Defaults to False.
+
+    Returns:
+        int: Number of summaries precomputed (0 if the rollups already existed)
+    """
+    release = get_release_fingerprint(db)
+    create_summary_rollup_table(db.connection())
+    if has_summary_rollups(db, release) and not force:
+        log.info(f'Summary rollups already built for release {release}')
+        db.commit()
+        return 0
+
+    start_time = time.time()
+    summaries = {}
+    for endpoint_tablename in SUMMARY_ROLLUP_ENDPOINTS:
+        for qnode in get_rollup_qnodes(db, endpoint_tablename, log):
+            try:
+                qnode_key = get_qnode_filter_key(endpoint_tablename, qnode, log)
+            except ParsingError as e:
+                # Values that can't be written as a filter (ex. containing an operator) can't be requested either
+                log.warning(f'Skipping summary rollup: {e}')
+                continue
+            if qnode_key in summaries:
+                continue
+            summaries[qnode_key] = summary_query(db, endpoint_tablename, qnode, log, use_rollup=False)
+
+    replace_summary_rollups(db, release, summaries)
+    db.commit()
+    log.info(f'Built {len(summaries)} summary rollups for release {release} in {time.time() - start_time}s')
+    return len(summaries)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute summary rollups for the current release')
+    parser.add_argument('--force', action='store_true', help='Rebuild the rollups even if they exist for the current release')
+    args = parser.parse_args()
+
+    log = get_logger('Rollup: rollup_stage.py')
+    db = session()
+    try:
+        build_summary_rollups(db, log, force=args.force)
+    finally:
+        db.close()
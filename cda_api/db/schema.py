@@ -1,6 +1,8 @@
 from sqlalchemy.ext.automap import automap_base
 from cda_api.db.connection import engine
-from sqlalchemy import inspect
+from cda_api.db.release import query_release_fingerprint
+from cda_api.db.snapshot import load_schema_snapshot, save_schema_snapshot
+from sqlalchemy import inspect, select, func, MetaData
 from sqlalchemy.orm import relationship
 from cda_api import get_logger
 
@@ -13,11 +15,37 @@ log = get_logger('Setup: schema.py')
 def name_for_collection_relationship(base, local_cls, referred_cls, constraint):
     disc = '_'.join(col.name for col in constraint.columns)
     return referred_cls.__name__.lower() + '_' + disc + "_collection"
+
+# Reflects the database schema and column_metadata rows into a snapshot that can be saved for other workers
+def build_schema_snapshot(connection, release):
+    log.info('Reflecting database schema')
+    metadata = MetaData()
+    metadata.reflect(bind=connection)
+    column_metadata = metadata.tables['column_metadata']
+    subquery = select(column_metadata).subquery('json_result')
+    result = connection.execute(select(func.row_to_json(subquery.table_valued()))).all()
+    return {
+        'release': release,
+        'metadata': metadata,
+        'column_metadata': [row for row, in result]
+    }
+
+try:
+    with engine.connect() as connection:
+        RELEASE = query_release_fingerprint(connection)
+        SCHEMA_SNAPSHOT = load_schema_snapshot(RELEASE)
+        if SCHEMA_SNAPSHOT is None:
+            SCHEMA_SNAPSHOT = build_schema_snapshot(connection, RELEASE)
+            save_schema_snapshot(SCHEMA_SNAPSHOT)
+except Exception as e:
+    log.exception(e)
+    raise e
+
 try:
     log.info('Building SQLAlchemy automap')
-    Base = automap_base()
-    Base.prepare(autoload_with=engine,
-                name_for_collection_relationship=name_for_collection_relationship)
+    # The snapshot metadata is already populated, so prepare only needs to map it without reflecting
+    Base = automap_base(metadata=SCHEMA_SNAPSHOT['metadata'])
+    Base.prepare(name_for_collection_relationship=name_for_collection_relationship)
     TABLE_LIST = Base.classes.values()
     log.info('Successfully built SQLAlchemy automap')
 except Exception as e:
@@ -0,0 +1,51 @@
+from os import getenv
+import os
+import pickle
+import sqlalchemy
+from cda_api import get_logger
+
+log = get_logger('Setup: snapshot.py')
+
+# Path of the pickled schema snapshot shared by API workers (leave unset to always reflect the database on startup)
+SCHEMA_SNAPSHOT_PATH = getenv('SCHEMA_SNAPSHOT_PATH')
+
+
+# Loads the schema snapshot if it was built for the current release, otherwise returns None
+def load_schema_snapshot(release, path=None):
+    path = path or SCHEMA_SNAPSHOT_PATH
+    if not path:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        log.info(f'No schema snapshot found at {path}')
+        return None
+    except Exception as e:
+        log.warning(f'Unable to load schema snapshot {path}: {e}')
+        return None
+
+    # Pickled MetaData is only valid for the release and SQLAlchemy version it was built with
+    if (snapshot.get('release') != release) or (snapshot.get('sqlalchemy_version') != sqlalchemy.__version__):
+        log.info(f'Schema snapshot {path} is stale (release {snapshot.get("release")}), rebuilding from the database')
+        return None
+    log.info(f'Loaded schema snapshot for release {release} from {path}')
+    return snapshot
+
+
+# Writes the schema snapshot, replacing any existing file in one step so other workers never read a partial file
+def save_schema_snapshot(snapshot, path=None):
+    path = path or SCHEMA_SNAPSHOT_PATH
+    if not path:
+        return
+    snapshot = dict(snapshot, sqlalchemy_version=sqlalchemy.__version__)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        log.info(f'Saved schema snapshot for release {snapshot["release"]} to {path}')
+    except Exception as e:
+        log.warning(f'Unable to save schema snapshot {path}: {e}')
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,218 @@
+from .query_utilities import distinct_count, get_cte_column
+from sqlalchemy import func, Integer, BigInteger, case, cast, literal, literal_column, type_coerce, true, tablesample
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.util import ClauseAdapter
+from os import getenv
+
+# Percent of the endpoint table's pages read by approximate summaries
+SUMMARY_SAMPLE_PERCENT = float(getenv('SUMMARY_SAMPLE_PERCENT', 10))
+
+# Seed of the approximate summary sample (fixed so repeated and cached approximate summaries agree)
+SUMMARY_SAMPLE_SEED = int(getenv('SUMMARY_SAMPLE_SEED', 0))
+
+# z score of the 95% confidence bounds returned with approximate summaries
+APPROXIMATE_Z_SCORE = 1.96
+
+
+# Returns a SQL string literal for a json key (keys come from the database schema, not user input)
+def json_key(key):
+    return literal_column("'{}'".format(key.replace("'", "''")))
+
+
+# Reads the endpoint table of a preselect query from a block sample of its pages instead of scanning all of it
+def sample_preselect(preselect_query, endpoint_table, sample_percent=None):
+    sample_percent = sample_percent or SUMMARY_SAMPLE_PERCENT
+    sampled_table = tablesample(endpoint_table, func.system(sample_percent), name=f'{endpoint_table.name}_sample', seed=literal(SUMMARY_SAMPLE_SEED))
+    # Swaps every reference to the endpoint table (including correlated filter subqueries) for the sample
+    return ClauseAdapter(sampled_table).traverse(preselect_query.statement)
+
+
+# Scales a count over the sample up to an estimate of the count over the whole table
+def scaled_count(count, sample_fraction):
+    return cast(func.round(count / sample_fraction), BigInteger)
+
+
+# Half width of the confidence bounds of a scaled count (treats rows as sampled independently, but whole pages are 
+# sampled together, so the bounds are optimistic for values clustered on disk)
+def scaled_count_error(count, sample_fraction):
+    return cast(func.round(APPROXIMATE_Z_SCORE * func.sqrt(count * (1 - sample_fraction)) / sample_fraction), BigInteger)
+
+
+# Gets the numeric statistics of a column as aggregates so every numeric column is summarized in the same pass
+# The quartiles come from a single percentile_disc call with an array argument (one sort instead of three)
+def numeric_summary_aggregates(column, sample_fraction=None):
+    quartiles = func.percentile_disc(literal_column('ARRAY[0.25, 0.5, 0.75]')).within_group(column)
+    aggregates = [func.min(column).label(f'{column.name}_min'),
+                  func.max(column).label(f'{column.name}_max'),
+                  func.avg(column).label(f'{column.name}_mean'),
+                  type_coerce(quartiles, postgresql.ARRAY(column.type)).label(f'{column.name}_quartiles')]
+    if sample_fraction:
+        # Standard error of the sample mean
+        mean_error = APPROXIMATE_Z_SCORE * func.stddev_samp(column) / func.sqrt(func.nullif(func.count(column), 0))
+        aggregates.append(mean_error.label(f'{column.name}_mean_error'))
+    return aggregates
+
+
+# Builds the numeric summary json of a column from its aggregates in the summary stats subquery
+def numeric_summary_json(summary_stats, columnname, sample_fraction=None):
+    quartiles = get_cte_column(summary_stats, f'{columnname}_quartiles')
+    column_stats = [json_key('min'), get_cte_column(summary_stats, f'{columnname}_min'),
+                    json_key('max'), get_cte_column(summary_stats, f'{columnname}_max'),
+                    json_key('mean'), get_cte_column(summary_stats, f'{columnname}_mean'),
+                    json_key('median'), quartiles[2],
+                    json_key('lower_quartile'), quartiles[1],
+                    json_key('upper_quartile'), quartiles[3]]
+    if sample_fraction:
+        column_stats += [json_key('mean_error'), get_cte_column(summary_stats, f'{columnname}_mean_error')]
+    # Wrapped in an array to match the shape of the original per column summary subqueries
+    return func.json_build_array(func.json_build_object(*column_stats)).label(f'{columnname}_summary')
+
+
+# Combines the counts of data source columns into a single json aggregate for use in summary endpoint
+def data_source_aggregate(data_source_columns, sample_fraction=None):
+    data_source_counts = []
+    for column in data_source_columns:
+        data_source_count = func.sum(cast(column, Integer))
+        if sample_fraction:
+            data_source_count = scaled_count(data_source_count, sample_fraction)
+        data_source_counts.extend([json_key(column.name.split('_')[-1]), data_source_count])
+    return func.json_build_object(*data_source_counts).label('data_source')
+
+
+# Gets the total count, numeric statistics, and data source counts in a single aggregate pass over the preselect
+def build_summary_stats(db, preselect_query, id_alias_column, numeric_columns, data_source_columns, sample_fraction=None):
+    if sample_fraction:
+        sample_count = distinct_count(id_alias_column)
+        stats_columns = [scaled_count(sample_count, sample_fraction).label('total_count'),
+                         scaled_count_error(sample_count, sample_fraction).label('total_count_error'),
+                         sample_count.label('sample_count')]
+    else:
+        stats_columns = [distinct_count(id_alias_column).label('total_count')]
+    for column in numeric_columns:
+        stats_columns += numeric_summary_aggregates(column, sample_fraction)
+    stats_columns.append(data_source_aggregate(data_source_columns, sample_fraction))
+    return db.query(*stats_columns).select_from(preselect_query).subquery('summary_stats')
+
+
+# Describes how an approximate summary was estimated
+def approximate_summary_json(summary_stats, sample_fraction):
+    return func.json_build_object(json_key('sample_percent'), sample_fraction * 100,
+                                  json_key('sample_count'), summary_stats.c.sample_count,
+                                  json_key('total_count_error'), summary_stats.c.total_count_error,
+                                  json_key('confidence_level'), 0.95).label('approximate')
+
+
+# Gets every categorical summary from a single GROUPING SETS pass over the preselect
+# Each grouping set only groups one column, so GROUPING(column) = 0 marks which column a count row belongs to
+def build_categorical_summaries(db, preselect_query, categorical_columns, sample_fraction=None):
+    summary_column = case(*[(func.grouping(column) == 0, json_key(column.name)) for column in categorical_columns]).label('summary_column')
+    category_counts = db.query(summary_column,
+                               *categorical_columns,
+                               func.count().label('count_result')
+                        ).group_by(
+                            func.grouping_sets(*categorical_columns)
+                        ).cte('category_counts')
+
+    # Aggregate the counts for each column back into [{column: value, count_result: count}]
+    categorical_summaries = []
+    for column in categorical_columns:
+        category_column = get_cte_column(category_counts, column.name)
+        if sample_fraction:
+            category_json = func.json_build_object(json_key(column.name), category_column,
+                                                   json_key('count_result'), scaled_count(category_counts.c.count_result, sample_fraction),
+                                                   json_key('count_error'), scaled_count_error(category_counts.c.count_result, sample_fraction))
+        else:
+            category_json = func.json_build_object(json_key(column.name), category_column,
+                                                   json_key('count_result'), category_counts.c.count_result)
+        categorical_summary = func.json_agg(category_json).filter(category_counts.c.summary_column == json_key(column.name))
+        categorical_summaries.append(categorical_summary.label(f'{column.name}_summary'))
+    return db.query(*categorical_summaries).subquery('categorical_summary')
+
+
+# Sorts the endpoint table columns of the preselect into numeric, categorical, and data source summary columns
+def get_summary_columns(preselect_query, column_infos, log):
+    numeric_columns = []
+    categorical_columns = []
+    data_source_columns = []
+    summary_columnnames = []
+    for column_info in column_infos:
+        preselect_column = get_cte_column(preselect_query, column_info.uniquename)
+        if column_info.process_before_display == 'data_source':
+            data_source_columns.append(preselect_column)
+        elif column_info.summary_display:
+            match column_info.column_type:
+                case 'numeric':
+                    numeric_columns.append(preselect_column)
+                    summary_columnnames.append(column_info.uniquename)
+                case 'categorical':
+                    categorical_columns.append(preselect_column)
+                    summary_columnnames.append(column_info.uniquename)
+                case _:
+                    log.warning(f'Unexpectedly skipping {column_info.uniquename} for summary - column_type: {column_info.column_type}')
+    return numeric_columns, categorical_columns, data_source_columns, summary_columnnames
+
+
+def build_summary_select_clause(db, endpoint_tablename, preselect_query, column_infos, log, sample_fraction=None):
+    """Builds the summary select clause from two scans of the preselect (regardless of the number of summary columns)
+
+    Args:
+        db (Session): Database session object
+        endpoint_tablename (str): Name of the endpoint table
+        preselect_query (CTE): Filtered preselect of the endpoint table columns (labeled with their unique names)
+        column_infos (list[ColumnInfo]): ColumnInfos of the endpoint table columns
+        sample_fraction (float, optional): Fraction of the endpoint table sampled by the preselect; counts are scaled 
+                                           up by it and returned with error bounds. Defaults to None (exact).
+
+    Returns:
+        tuple: (total_count and column summary select columns in column order, 
+                trailing select columns (data_source and approximate), from clause)
+    """
+    numeric_columns, categorical_columns, data_source_columns, summary_columnnames = get_summary_columns(preselect_query, column_infos, log)
+
+    id_alias_column = get_cte_column(preselect_query, f'{endpoint_tablename}_id_alias')
+    summary_stats = build_summary_stats(db, preselect_query, id_alias_column, numeric_columns, data_source_columns, sample_fraction)
+    summary_columns = {f'{column.name}_summary': numeric_summary_json(summary_stats, column.name, sample_fraction) for column in numeric_columns}
+    summary_from = summary_stats
+    if categorical_columns:
+        categorical_summaries = build_categorical_summaries(db, preselect_query, categorical_columns, sample_fraction)
+        summary_columns.update({column.name: column for column in categorical_summaries.c})
+        # Both subqueries return a single row
+        summary_from = summary_stats.join(categorical_summaries, true())
+
+    select_columns = [summary_stats.c.total_count]
+    select_columns += [summary_columns[f'{columnname}_summary'] for columnname in summary_columnnames]
+    trailing_columns = [summary_stats.c.data_source]
+    if sample_fraction:
+        trailing_columns.append(approximate_summary_json(summary_stats, sample_fraction))
+    return select_columns, trailing_columns, summary_from
+
+
+def build_summary_component_queries(db, endpoint_tablename, preselect_query, column_infos, log, sample_fraction=None):
+    """Builds the summary as independent queries that can run at the same time on separate connections
+    (one for the total count, numeric summaries, and data source counts, and one per categorical column)
+
+    Args:
+        db (Session): Database session object
+        endpoint_tablename (str): Name of the endpoint table
+        preselect_query (CTE): Filtered preselect of the endpoint table columns (labeled with their unique names)
+        column_infos (list[ColumnInfo]): ColumnInfos of the endpoint table columns
+        sample_fraction (float, optional): Fraction of the endpoint table sampled by the preselect. Defaults to None (exact).
+
+    Returns:
+        tuple: (component queries each returning a single row, summary column names in column order)
+    """
+    numeric_columns, categorical_columns, data_source_columns, summary_columnnames = get_summary_columns(preselect_query, column_infos, log)
+
+    id_alias_column = get_cte_column(preselect_query, f'{endpoint_tablename}_id_alias')
+    summary_stats = build_summary_stats(db, preselect_query, id_alias_column, numeric_columns, data_source_columns, sample_fraction)
+    stats_columns = [summary_stats.c.total_count]
+    stats_columns += [numeric_summary_json(summary_stats, column.name, sample_fraction) for column in numeric_columns]
+    stats_columns.append(summary_stats.c.data_source)
+    if sample_fraction:
+        stats_columns.append(approximate_summary_json(summary_stats, sample_fraction))
+    component_queries = [db.query(*stats_columns).select_from(summary_stats)]
+
+    for column in categorical_columns:
+        categorical_summary = build_categorical_summaries(db, preselect_query, [column], sample_fraction)
+        component_queries.append(db.query(*categorical_summary.c))
+    return component_queries, summary_columnnames
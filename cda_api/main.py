@@ -1,5 +1,5 @@
 from fastapi import FastAPI, Request
-from cda_api.routers import data, summary, release_metadata, unique_values, columns
+from cda_api.routers import data, summary, release_metadata, unique_values, columns, batch, cohort
 from cda_api import get_logger
 
 # Establish FastAPI "app" used for decorators on api endpoint functions
@@ -15,5 +15,7 @@ app.include_router(router=summary.router)
 app.include_router(router=unique_values.router)
 app.include_router(router=release_metadata.router)
 app.include_router(router=columns.router)
+app.include_router(router=batch.router)
+app.include_router(router=cohort.router)
 
 log.debug('API startup complete')
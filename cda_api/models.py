@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Any
+from typing import Optional, Any, Literal
 
 
 class QNode(BaseModel):
@@ -30,10 +30,13 @@ class PagedResponseObj(BaseModel):
     query_sql: str | None = Field(description="SQL Query generated to yield the results")
     total_row_count: int | None = Field(default=None, description="Count of total number of results from the query")
     next_url: Optional[str] = Field(default=None, description="URL to get to next page of results", )
+    next_cursor: Optional[str] = Field(default=None, description="Cursor to get to next page of results when using keyset pagination")
+    profile: dict[str, Any] | None = Field(default=None, description="Stage timings and query plans when explain is requested")
 
 class SummaryResponseObj(BaseModel):
     result: list[dict[str, Any] | None] = Field(description="List of query result json objects")
     query_sql: str | None = Field(description="SQL Query generated to yield the results")
+    profile: dict[str, Any] | None = Field(default=None, description="Stage timings and query plan when explain is requested")
 
 class ColumnResponseObj(BaseModel):
     result: list[dict[str, Any] | None] = Field(description="List of query result json objects")
@@ -47,4 +50,29 @@ class UniqueValueResponseObj(BaseModel):
 
 # TODO: change to represent actual release metadata result
 class ReleaseMetadataObj(BaseModel):
-    result: list[dict[str, Any] | None]
\ No newline at end of file
+    result: list[dict[str, Any] | None]
+
+class CohortResponseObj(BaseModel):
+    cohort: str = Field(description="Handle of the materialized cohort")
+    endpoint: str = Field(description="Endpoint table the cohort's id_alias values belong to")
+    size: int = Field(description="Number of rows in the cohort")
+
+class CohortOperation(BaseModel):
+    operation: Literal['union', 'intersection', 'difference'] = Field(description="Set operation to combine the cohorts with (difference removes the other cohorts from the first)")
+    cohorts: list[str] = Field(min_length=2, description="Handles of the cohorts to combine")
+
+class BatchItem(BaseModel):
+    endpoint: Literal['data/subject', 'data/file', 'summary/subject', 'summary/file'] = Field(description="Endpoint to run the QNode against")
+    qnode: QNode = Field(description="JSON input query")
+    limit: int = Field(default=100, description="Limit for paged data results")
+    offset: int = Field(default=0, description="Offset for paged data results")
+    cohort: str | None = Field(default=None, description="Handle of a materialized cohort to restrict the results to")
+
+class BatchItemResponseObj(BaseModel):
+    endpoint: str = Field(description="Endpoint the QNode was run against")
+    status_code: int = Field(description="HTTP status code the endpoint would have returned")
+    response: dict[str, Any] | None = Field(default=None, description="Endpoint response (PagedResponseObj or SummaryResponseObj)")
+    detail: str | None = Field(default=None, description="Error detail when the item failed")
+
+class BatchResponseObj(BaseModel):
+    result: list[BatchItemResponseObj] = Field(description="Responses of the batch items in request order")
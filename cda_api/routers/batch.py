@@ -0,0 +1,162 @@
+from fastapi import APIRouter, HTTPException, Request
+from cda_api.db import async_session, set_statement_timeout
+from cda_api.db.query_builders import fetch_rows, summary_query, create_cohort
+from cda_api.db.filter_builder import get_qnode_filter_key, normalize_filter_string
+from cda_api.models import BatchItem, BatchResponseObj, QNode
+from cda_api import get_logger, get_http_exception, EmptyQueryError
+from os import getenv
+import asyncio
+import uuid
+
+
+# Maximum number of items in a single batch request
+BATCH_MAX_ITEMS = int(getenv('BATCH_MAX_ITEMS', 100))
+
+# Maximum number of pooled connections a single batch request uses at once
+BATCH_MAX_CONNECTIONS = int(getenv('BATCH_MAX_CONNECTIONS', 4))
+
+
+router = APIRouter(
+    prefix="/batch",
+    tags=["batch"]
+)
+
+
+# Groups item indexes by their endpoint table and cohort so items sharing filters run together
+# Returns [(indexes, shared filters)] where the shared filters ({normalized filter: filter string}) are the MATCH_ALL
+# filters of every item in a group whose items have different filters (None when there is nothing to share)
+def group_batch_items(items, log):
+    groups = {}
+    item_filters = {}
+    for index, item in enumerate(items):
+        endpoint_tablename = item.endpoint.split('/')[-1]
+        try:
+            filter_key = get_qnode_filter_key(endpoint_tablename, item.qnode, log, item.cohort)
+            match_all_filters = {normalize_filter_string(filter_string, log): filter_string for filter_string in item.qnode.MATCH_ALL or []}
+        except Exception:
+            # Invalid filters fail when the item runs, so the item is left in its own group
+            groups[index] = [index]
+            continue
+        item_filters[index] = (filter_key, match_all_filters)
+        groups.setdefault((endpoint_tablename, item.cohort), []).append(index)
+
+    grouped_items = []
+    for indexes in groups.values():
+        shared_filters = None
+        if len(set(item_filters[index][0] for index in indexes if index in item_filters)) > 1:
+            shared_keys = set.intersection(*[set(item_filters[index][1]) for index in indexes])
+            if shared_keys:
+                first_item_filters = item_filters[indexes[0]][1]
+                shared_filters = {shared_key: first_item_filters[shared_key] for shared_key in sorted(shared_keys)}
+        grouped_items.append((indexes, shared_filters))
+    return grouped_items
+
+
+# Materializes the filters shared by a group's items as a cohort once, so each item only applies its own filters on top of it
+# (returns None when the cohort can't be built, in which case the items run with all of their filters)
+async def create_shared_cohort(db, item, shared_filters, log):
+    endpoint_tablename = item.endpoint.split('/')[-1]
+    try:
+        await set_statement_timeout(db, 'cohort')
+        result = await db.run_sync(create_cohort, endpoint_tablename=endpoint_tablename, qnode=QNode(MATCH_ALL=list(shared_filters.values())), 
+                                   log=log, cohort=item.cohort)
+        await db.commit()
+        log.info(f'Sharing {len(shared_filters)} filters of {endpoint_tablename} items through cohort {result["cohort"]}')
+        return result['cohort']
+    except Exception as e:
+        log.exception(e)
+        await db.rollback()
+        return None
+
+
+# Replaces the shared filters of an item with the shared cohort
+def get_shared_cohort_item(item, shared_filters, cohort, log):
+    match_all = [filter_string for filter_string in item.qnode.MATCH_ALL if normalize_filter_string(filter_string, log) not in shared_filters]
+    qnode = item.qnode.model_copy(update={'MATCH_ALL': match_all or None})
+    return item.model_copy(update={'qnode': qnode, 'cohort': cohort})
+
+
+# Runs a single batch item on the group's session and returns its BatchItemResponseObj
+async def run_batch_item(db, item, include_sql, log):
+    endpoint_type, endpoint_tablename = item.endpoint.split('/')
+    try:
+        await set_statement_timeout(db, endpoint_type)
+        match endpoint_type:
+            case 'data':
+                if item.qnode.is_empty() and (item.cohort is None):
+                    raise EmptyQueryError("Must provide either/both of 'MATCH_ALL' or 'MATCH_SOME' within the request body")
+                response = await db.run_sync(fetch_rows, endpoint_tablename=endpoint_tablename, qnode=item.qnode, limit=item.limit, offset=item.offset, log=log, include_sql=include_sql, cohort=item.cohort)
+            case 'summary':
+                response = await db.run_sync(summary_query, endpoint_tablename=endpoint_tablename, qnode=item.qnode, log=log, include_sql=include_sql, cohort=item.cohort)
+        # End the transaction so SET LOCAL settings don't carry over to the next item
+        await db.commit()
+        return {'endpoint': item.endpoint, 'status_code': 200, 'response': response}
+    except Exception as e:
+        log.exception(e)
+        await db.rollback()
+        http_exception = get_http_exception(e)
+        return {'endpoint': item.endpoint, 'status_code': http_exception.status_code, 'detail': http_exception.detail}
+
+
+# Runs a group of items one after another on a single pooled connection
+# (later items reuse the shared cohort and the filter template, row count, and summary caches filled by the first)
+async def run_batch_group(items, indexes, shared_filters, include_sql, semaphore, log):
+    results = {}
+    async with semaphore:
+        async with async_session() as db:
+            shared_cohort = None
+            if shared_filters:
+                shared_cohort = await create_shared_cohort(db, items[indexes[0]], shared_filters, log)
+            for index in indexes:
+                item = items[index]
+                # Identical items in the group are only run once
+                duplicate_index = next((i for i in results if items[i] == item), None)
+                if duplicate_index is not None:
+                    results[index] = results[duplicate_index]
+                    continue
+                if shared_cohort is not None:
+                    item = get_shared_cohort_item(item, shared_filters, shared_cohort, log)
+                results[index] = await run_batch_item(db, item, include_sql, log)
+    return results
+
+
+@router.post('')
+async def batch_endpoint(request: Request,
+                         items: list[BatchItem],
+                         include_sql: bool = True) -> BatchResponseObj:
+    """Batch endpoint that runs a list of data and summary QNodes in one request. The MATCH_ALL filters shared by the 
+    items of an endpoint table are materialized once as a cohort that each item applies its other filters to
+
+    Args:
+        request (Request): HTTP request object
+        items (list[BatchItem]): Items of {endpoint, qnode, limit, offset} to run
+        include_sql (bool, optional): Return the generated SQL statements as query_sql. Defaults to True.
+
+    Returns:
+        BatchResponseObj:
+        {
+            'result': [{'endpoint': 'data/subject', 'status_code': 200, 'response': {...}, 'detail': None}]
+        }
+    """
+    qid = str(uuid.uuid4())
+    log = get_logger(qid)
+    log.info(f'batch endpoint hit: {request.client}')
+    log.info(f'Batch items: {len(items)}')
+    log.info(f'{request.url}')
+    if len(items) > BATCH_MAX_ITEMS:
+        e = ValueError(f'Batch requests are limited to {BATCH_MAX_ITEMS} items, received {len(items)}')
+        log.exception(e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Groups run concurrently over pooled connections
+    groups = group_batch_items(items, log)
+    log.info(f'Running {len(items)} batch items in {len(groups)} groups')
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONNECTIONS)
+    group_results = await asyncio.gather(*[run_batch_group(items, indexes, shared_filters, include_sql, semaphore, log) 
+                                           for indexes, shared_filters in groups])
+
+    results = {}
+    for group_result in group_results:
+        results.update(group_result)
+    log.info('Success')
+    return {'result': [results[index] for index in range(len(items))]}
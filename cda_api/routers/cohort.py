@@ -0,0 +1,88 @@
+from fastapi import Depends, APIRouter, HTTPException, Request
+from cda_api.db import get_async_db_with_timeout
+from cda_api.db.query_builders import create_cohort
+from cda_api.db.cohort import combine_cohorts
+from cda_api.models import QNode, CohortResponseObj, CohortOperation
+from sqlalchemy.ext.asyncio import AsyncSession
+from cda_api import get_logger, get_http_exception, EmptyQueryError
+from typing import Literal
+import uuid
+
+
+router = APIRouter(
+    prefix="/cohort",
+    tags=["cohort"]
+)
+
+
+# Declared before /{endpoint_tablename} so "combine" isn't matched as an endpoint table
+@router.post('/combine')
+async def combine_cohorts_endpoint(request: Request,
+                                   cohort_operation: CohortOperation) -> CohortResponseObj:
+    """Cohort endpoint that combines saved cohorts with a set operation in memory (no database query)
+
+    Args:
+        request (Request): HTTP request object
+        cohort_operation (CohortOperation): {'operation': 'union' | 'intersection' | 'difference', 'cohorts': ['cohort handles']}
+
+    Returns:
+        CohortResponseObj:
+        {
+            'cohort': 'cohort handle of the combined cohort',
+            'endpoint': 'endpoint table name',
+            'size': 'number of rows in the combined cohort'
+        }
+    """
+    qid = str(uuid.uuid4())
+    log = get_logger(qid)
+    log.info(f'cohort/combine endpoint hit: {request.client}')
+    log.info(f'Cohort operation: {cohort_operation.operation} {cohort_operation.cohorts}')
+    try:
+        result = combine_cohorts(cohort_operation.operation, cohort_operation.cohorts, log)
+        log.info('Success')
+    except Exception as e:
+        log.exception(e)
+        raise get_http_exception(e)
+    return result
+
+
+@router.post('/{endpoint_tablename}')
+async def create_cohort_endpoint(request: Request,
+                                 endpoint_tablename: Literal['subject', 'file'],
+                                 qnode: QNode,
+                                 cohort: str | None = None,
+                                 db: AsyncSession = Depends(get_async_db_with_timeout('cohort'))) -> CohortResponseObj:
+    """Cohort endpoint that materializes the rows matching the input query under a cohort handle. The handle can be
+    passed as cohort= to the data, export, and summary endpoints instead of re-evaluating the filters on every request
+
+    Args:
+        request (Request): HTTP request object
+        endpoint_tablename (str): Name of the endpoint table ('subject' or 'file')
+        qnode (QNode): JSON input query
+        cohort (str, optional): Handle of an existing cohort to refine with the input query. Defaults to None.
+        db (AsyncSession, optional): Async database session object. Defaults to Depends(get_async_db_with_timeout('cohort')).
+
+    Returns:
+        CohortResponseObj:
+        {
+            'cohort': 'cohort handle',
+            'endpoint': 'endpoint table name',
+            'size': 'number of rows in the cohort'
+        }
+    """
+    qid = str(uuid.uuid4())
+    log = get_logger(qid)
+    log.info(f'cohort/{endpoint_tablename} endpoint hit: {request.client}')
+    log.info(f'QNode: {qnode.as_string()}')
+    log.info(f'{request.url}')
+    if qnode.is_empty() and (cohort is None):
+        e = EmptyQueryError("Must provide either/both of 'MATCH_ALL' or 'MATCH_SOME' within the request body")
+        log.exception(e)
+        raise HTTPException(status_code=404, detail=str(e))
+    try:
+        result = await db.run_sync(create_cohort, endpoint_tablename=endpoint_tablename, qnode=qnode, log=log, cohort=cohort)
+        log.info('Success')
+    except Exception as e:
+        log.exception(e)
+        raise get_http_exception(e)
+    return result
@@ -1,9 +1,7 @@
-from fastapi import Depends, APIRouter, HTTPException, Request
-from cda_api.db import get_db
+from fastapi import APIRouter, Request
 from cda_api.db.query_builders import columns_query
-from cda_api.models import QNode, ColumnResponseObj
-from sqlalchemy.orm import Session
-from cda_api import get_logger
+from cda_api.models import ColumnResponseObj
+from cda_api import get_logger, get_http_exception
 log = get_logger()
 
 
@@ -13,21 +11,20 @@ router = APIRouter(
 )
 
 @router.get('/')
-def columns_endpoint(request: Request, 
-                     db: Session = Depends(get_db)) -> ColumnResponseObj:
-    """_summary_
+async def columns_endpoint(request: Request) -> ColumnResponseObj:
+    """Columns endpoint that lists the columns of the entity tables. The columns come from the in-memory
+    DatabaseMap, so no database session is used
 
     Args:
-        request (Request): _description_
-        db (Session, optional): _description_. Defaults to Depends(get_db).
+        request (Request): HTTP request object
 
     Returns:
-        ColumnResponseObj: _description_
+        ColumnResponseObj: {'result': [{'table', 'column', 'data_type', 'nullable', 'description'}]}
     """
 
     try:
-        result = columns_query(db)
+        result = columns_query()
     except Exception as e:
         log.exception(e)
-        raise HTTPException(status_code=404, detail=str(e))
-    return result 
\ No newline at end of file
+        raise get_http_exception(e)
+    return result
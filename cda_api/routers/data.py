@@ -1,10 +1,15 @@
 from fastapi import Depends, APIRouter, HTTPException, Request
-from cda_api.db import get_db
-from cda_api.db.query_builders import fetch_rows
+from fastapi.responses import StreamingResponse
+from cda_api.db import get_async_db_with_timeout, set_statement_timeout, async_session
+from cda_api.db.query_builders import fetch_rows, build_export_query, export_rows
 from cda_api.models import QNode, PagedResponseObj
-from cda_api import get_logger, EmptyQueryError
-from sqlalchemy.orm import Session
+from cda_api import get_logger, get_http_exception, EmptyQueryError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Literal
 import uuid
+import json
+import csv
+import io
 
 
 
@@ -15,13 +20,33 @@ router = APIRouter(
 )
 
 
+# Builds the url for the next page of results for either offset or keyset (cursor) pagination
+def get_next_url(request, result, limit, offset, cursor, row_count):
+    if cursor is not None:
+        if result['next_cursor']:
+            return str(request.url.include_query_params(cursor=result['next_cursor']))
+    elif (offset != None) and (limit != None):
+        # Without an exact total row count, a full page means there may be another page
+        if row_count == 'exact':
+            has_next_page = result['total_row_count'] > offset+limit
+        else:
+            has_next_page = len(result['result']) == limit
+        if has_next_page:
+            return str(request.url.include_query_params(offset=offset+limit))
+    return None
+
 
 @router.post('/subject')
-def subject_fetch_rows_endpoint(request: Request, 
-                           qnode: QNode, 
-                           limit: int = 100,
-                           offset: int = 0,
-                           db: Session = Depends(get_db)) -> PagedResponseObj:
+async def subject_fetch_rows_endpoint(request: Request, 
+                                 qnode: QNode, 
+                                 limit: int = 100,
+                                 offset: int = 0,
+                                 cursor: str | None = None,
+                                 row_count: Literal['exact', 'estimate', 'none'] = 'exact',
+                                 include_sql: bool = True,
+                                 cohort: str | None = None,
+                                 explain: bool = False,
+                                 db: AsyncSession = Depends(get_async_db_with_timeout('data'))) -> PagedResponseObj:
     """Subject data endpoint that returns json formatted row data based on input query
 
     Args:
@@ -29,7 +54,14 @@ def subject_fetch_rows_endpoint(request: Request,
         qnode (QNode): JSON input query
         limit (int, optional): Limit for paged results. Defaults to 100.
         offset (int, optional): Offset for paged results. Defaults to 0.
-        db (Session, optional): Database session object. Defaults to Depends(get_db).
+        cursor (str, optional): Keyset pagination cursor from a previous 'next_cursor'. Pass an empty 
+            cursor to start keyset pagination from the first row. Defaults to None (offset pagination).
+        row_count (str, optional): 'exact' total row count (cached for later pages of the same query), 
+            'estimate' from the query planner, or 'none' to skip counting. Defaults to 'exact'.
+        include_sql (bool, optional): Return the generated SQL statement as query_sql. Defaults to True.
+        cohort (str, optional): Handle of a materialized cohort (from /cohort) to restrict the rows to. Defaults to None.
+        explain (bool, optional): Return per-stage timings and the EXPLAIN ANALYZE plans of the generated queries as profile. Defaults to False.
+        db (AsyncSession, optional): Async database session object. Defaults to Depends(get_async_db_with_timeout('data')).
 
     Returns:
         PagedResponseObj: 
@@ -37,7 +69,8 @@ def subject_fetch_rows_endpoint(request: Request,
             'result': [{'column': 'data'}], 
             'query_sql': 'SQL statement used to generate result',
             'total_row_count': 'total rows of data for query generated (not paged)',
-            'next_url': 'URL to acquire next paged result'
+            'next_url': 'URL to acquire next paged result',
+            'next_cursor': 'Cursor to acquire next keyset paged result'
         }
     """
 
@@ -46,35 +79,34 @@ def subject_fetch_rows_endpoint(request: Request,
     log.info(f'data/subject endpoint hit: {request.client}')
     log.info(f'QNode: {qnode.as_string()}') 
     log.info(f'{request.url}')
-    if qnode.is_empty():
+    if qnode.is_empty() and (cohort is None):
         e =  EmptyQueryError("Must provide either/both of 'MATCH_ALL' or 'MATCH_SOME' within the request body")
         log.exception(e)
         raise HTTPException(status_code=404, detail=str(e))
    
     try:
         # Get paged query result
-        result = fetch_rows(db, endpoint_tablename='subject', qnode=qnode, limit=limit, offset=offset, log=log)
-        if (offset != None) and (limit != None):
-            if result['total_row_count'] > offset+limit:
-                next_url = request.url.components.geturl().replace(f'offset={offset}', f'offset={offset+limit}')
-                result['next_url'] = next_url
-        else:
-            result['next_url'] = None
+        result = await db.run_sync(fetch_rows, endpoint_tablename='subject', qnode=qnode, limit=limit, offset=offset, log=log, cursor=cursor, row_count=row_count, include_sql=include_sql, cohort=cohort, explain=explain)
+        result['next_url'] = get_next_url(request, result, limit, offset, cursor, row_count)
         log.info('Success')
     except Exception as e:
-        # TODO - possibly a better exception to throw
         log.exception(e)
-        raise HTTPException(status_code=404, detail=str(e))
+        raise get_http_exception(e)
     
     return result
 
 
 @router.post('/file')
-def file_fetch_rows_endpoint(request: Request, 
-                           qnode: QNode, 
-                           limit: int = 100,
-                           offset: int = 0, 
-                           db: Session = Depends(get_db)) -> PagedResponseObj:
+async def file_fetch_rows_endpoint(request: Request, 
+                                 qnode: QNode, 
+                                 limit: int = 100,
+                                 offset: int = 0,
+                                 cursor: str | None = None,
+                                 row_count: Literal['exact', 'estimate', 'none'] = 'exact',
+                                 include_sql: bool = True,
+                                 cohort: str | None = None,
+                                 explain: bool = False,
+                                 db: AsyncSession = Depends(get_async_db_with_timeout('data'))) -> PagedResponseObj:
     """File data endpoint that returns json formatted row data based on input query
 
     Args:
@@ -82,7 +114,14 @@ def file_fetch_rows_endpoint(request: Request,
         qnode (QNode): JSON input query
         limit (int, optional): Limit for paged results. Defaults to 100.
         offset (int, optional): Offset for paged results. Defaults to 0.
-        db (Session, optional): Database session object. Defaults to Depends(get_db).
+        cursor (str, optional): Keyset pagination cursor from a previous 'next_cursor'. Pass an empty 
+            cursor to start keyset pagination from the first row. Defaults to None (offset pagination).
+        row_count (str, optional): 'exact' total row count (cached for later pages of the same query), 
+            'estimate' from the query planner, or 'none' to skip counting. Defaults to 'exact'.
+        include_sql (bool, optional): Return the generated SQL statement as query_sql. Defaults to True.
+        cohort (str, optional): Handle of a materialized cohort (from /cohort) to restrict the rows to. Defaults to None.
+        explain (bool, optional): Return per-stage timings and the EXPLAIN ANALYZE plans of the generated queries as profile. Defaults to False.
+        db (AsyncSession, optional): Async database session object. Defaults to Depends(get_async_db_with_timeout('data')).
 
     Returns:
         PagedResponseObj: 
@@ -90,7 +129,8 @@ def file_fetch_rows_endpoint(request: Request,
             'result': [{'column': 'data'}], 
             'query_sql': 'SQL statement used to generate result',
             'total_row_count': 'total rows of data for query generated (not paged)',
-            'next_url': 'URL to acquire next paged result'
+            'next_url': 'URL to acquire next paged result',
+            'next_cursor': 'Cursor to acquire next keyset paged result'
         }
     """
     qid = str(uuid.uuid4())
@@ -99,24 +139,106 @@ def file_fetch_rows_endpoint(request: Request,
     log.info(f'data/file endpoint hit: {request.client}')
     log.info(f'QNode: {qnode.as_string()}') 
     log.info(f'{request.url}')
-    if qnode.is_empty():
+    if qnode.is_empty() and (cohort is None):
         e =  EmptyQueryError("Must provide either/both of 'MATCH_ALL' or 'MATCH_SOME' within the request body")
         log.exception(e)
         raise HTTPException(status_code=404, detail=str(e))
 
     try:
         # Get paged query result
-        result = fetch_rows(db, endpoint_tablename='file', qnode=qnode, limit=limit, offset=offset)
-        if (offset != None) and (limit != None):
-            if result['total_row_count'] > offset+limit:
-                next_url = request.url.components.geturl().replace(f'offset={offset}', f'offset={offset+limit}')
-                result['next_url'] = next_url
-        else:
-            result['next_url'] = None
+        result = await db.run_sync(fetch_rows, endpoint_tablename='file', qnode=qnode, limit=limit, offset=offset, log=log, cursor=cursor, row_count=row_count, include_sql=include_sql, cohort=cohort, explain=explain)
+        result['next_url'] = get_next_url(request, result, limit, offset, cursor, row_count)
         log.info('Success')
     except Exception as e:
-        # TODO - possibly a better exception to throw
         log.exception(e)
-        raise HTTPException(status_code=404, detail=str(e))
+        raise get_http_exception(e)
     
     return result
+
+
+
+# Streams rows as newline delimited json
+async def stream_ndjson(rows, db, log):
+    try:
+        async for row in rows:
+            yield json.dumps(row, default=str) + '\n'
+    except Exception as e:
+        log.exception(e)
+        raise e
+    finally:
+        await db.close()
+
+
+# Streams rows as csv using the first row's keys as the header (array values are written as json)
+async def stream_csv(rows, db, log, rows_per_chunk=1000):
+    try:
+        buffer = io.StringIO()
+        writer = None
+        row_number = 0
+        async for row in rows:
+            if writer is None:
+                writer = csv.DictWriter(buffer, fieldnames=list(row.keys()))
+                writer.writeheader()
+            writer.writerow({key: json.dumps(value) if isinstance(value, (list, dict)) else value
+                             for key, value in row.items()})
+            row_number += 1
+            if row_number % rows_per_chunk == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+    except Exception as e:
+        log.exception(e)
+        raise e
+    finally:
+        await db.close()
+
+
+@router.post('/{endpoint_tablename}/export')
+async def export_endpoint(request: Request,
+                          endpoint_tablename: Literal['subject', 'file'],
+                          qnode: QNode,
+                          format: Literal['ndjson', 'csv'] = 'ndjson',
+                          cohort: str | None = None):
+    """Data export endpoint that streams every row of the input query without paging
+
+    Args:
+        request (Request): HTTP request object
+        endpoint_tablename (str): Name of the endpoint table ('subject' or 'file')
+        qnode (QNode): JSON input query
+        format (str, optional): 'ndjson' or 'csv'. Defaults to 'ndjson'.
+        cohort (str, optional): Handle of a materialized cohort (from /cohort) to restrict the rows to. Defaults to None.
+
+    Returns:
+        StreamingResponse: newline delimited json or csv rows
+    """
+    qid = str(uuid.uuid4())
+    log = get_logger(qid)
+    log.info(f'data/{endpoint_tablename}/export endpoint hit: {request.client}')
+    log.info(f'QNode: {qnode.as_string()}') 
+    log.info(f'{request.url}')
+    if qnode.is_empty() and (cohort is None):
+        e =  EmptyQueryError("Must provide either/both of 'MATCH_ALL' or 'MATCH_SOME' within the request body")
+        log.exception(e)
+        raise HTTPException(status_code=404, detail=str(e))
+
+    # The session is closed by the stream once every row is sent rather than by the get_async_db dependency
+    db = async_session()
+    try:
+        await set_statement_timeout(db, 'export')
+        export_query = await db.run_sync(build_export_query, endpoint_tablename=endpoint_tablename, qnode=qnode, log=log, cohort=cohort)
+        rows = export_rows(db, export_query, log=log)
+    except Exception as e:
+        await db.close()
+        log.exception(e)
+        raise get_http_exception(e)
+
+    match format:
+        case 'csv':
+            content = stream_csv(rows, db, log)
+            media_type = 'text/csv'
+        case _:
+            content = stream_ndjson(rows, db, log)
+            media_type = 'application/x-ndjson'
+    headers = {'Content-Disposition': f'attachment; filename="{endpoint_tablename}.{format}"'}
+    return StreamingResponse(content, media_type=media_type, headers=headers)
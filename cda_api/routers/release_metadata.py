@@ -1,9 +1,9 @@
 from fastapi import Depends, APIRouter, HTTPException, Request
 from cda_api.db.metadata import get_release_metadata
-from cda_api.db import get_db
-from cda_api import get_logger
+from cda_api.db import get_async_db_with_timeout
+from cda_api import get_logger, get_http_exception
 from cda_api.models import QNode, ReleaseMetadataObj
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import uuid
 
 
@@ -14,13 +14,13 @@ router = APIRouter(
 
 # TODO - include count(*) for all tables
 @router.get('/')
-def release_metadata_endpoint(request: Request, 
-                              db: Session = Depends(get_db)) -> ReleaseMetadataObj:
+async def release_metadata_endpoint(request: Request, 
+                                    db: AsyncSession = Depends(get_async_db_with_timeout('release_metadata'))) -> ReleaseMetadataObj:
     """_summary_
 
     Args:
         request (Request): _description_
-        db (Session, optional): _description_. Defaults to Depends(get_db).
+        db (AsyncSession, optional): _description_. Defaults to Depends(get_async_db_with_timeout('release_metadata')).
 
     Returns:
         FrequencyResponseObj: _description_
@@ -31,10 +31,9 @@ def release_metadata_endpoint(request: Request,
     log.info(f'{request.url}')
     
     try:
-        result = get_release_metadata(db, log)
+        result = await db.run_sync(get_release_metadata, log)
         log.info('Success')
     except Exception as e:
-        # TODO - possibly a better exception to throw
         log.exception(e)
-        raise HTTPException(status_code=404, detail=str(e))
+        raise get_http_exception(e)
     return result
\ No newline at end of file
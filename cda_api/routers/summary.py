@@ -1,9 +1,9 @@
-from fastapi import Depends, APIRouter, HTTPException, Request
-from cda_api.db import get_db
-from cda_api.db.query_builders import summary_query
+from fastapi import Depends, APIRouter, Request
+from cda_api.db import get_async_db_with_timeout
+from cda_api.db.query_builders import summary_query, parallel_summary_query
 from cda_api.models import QNode, SummaryResponseObj
-from sqlalchemy.orm import Session
-from cda_api import get_logger, EmptyQueryError
+from sqlalchemy.ext.asyncio import AsyncSession
+from cda_api import get_logger, get_http_exception
 import uuid
 
 
@@ -13,15 +13,26 @@ router = APIRouter(
 )
 
 @router.post('/subject')
-def subject_summary_endpoint(request: Request, 
-                             qnode: QNode, 
-                             db: Session = Depends(get_db)) -> SummaryResponseObj:
+async def subject_summary_endpoint(request: Request, 
+                                   qnode: QNode, 
+                                   include_sql: bool = True,
+                                   approximate: bool = False,
+                                   parallel: bool = False,
+                                   cohort: str | None = None,
+                                   explain: bool = False,
+                                   db: AsyncSession = Depends(get_async_db_with_timeout('summary'))) -> SummaryResponseObj:
     """_summary_
 
     Args:
         request (Request): _description_
         qnode (QNode): _description_
-        db (Session, optional): _description_. Defaults to Depends(get_db).
+        include_sql (bool, optional): Return the generated SQL statement as query_sql. Defaults to True.
+        approximate (bool, optional): Estimate the summary from a sample of the table with error bounds. Defaults to False.
+        parallel (bool, optional): Execute the parts of the summary at the same time on separate connections. Defaults to False.
+        cohort (str, optional): Handle of a materialized cohort (from /cohort) to restrict the summary to. Defaults to None.
+        explain (bool, optional): Return per-stage timings and the EXPLAIN ANALYZE plan of the summary query as profile 
+            (runs the summary as a single query). Defaults to False.
+        db (AsyncSession, optional): _description_. Defaults to Depends(get_async_db_with_timeout('summary')).
 
     Returns:
         SummaryResponseObj: _description_
@@ -32,30 +43,39 @@ def subject_summary_endpoint(request: Request,
     log.info(f'summary/subject endpoint hit: {request.client}')
     log.info(f'QNode: {qnode.as_string()}') 
     log.info(f'{request.url}')
-    if qnode.is_empty():
-        e =  EmptyQueryError("Must provide either/both of 'MATCH_ALL' or 'MATCH_SOME' within the request body")
-        log.exception(e)
-        raise HTTPException(status_code=404, detail=str(e))
-    
+    # An empty QNode summarizes the whole release (answered from the precomputed rollups when they exist)
     try:
-        result = summary_query(db, endpoint_tablename='subject', qnode=qnode, log=log)
+        if parallel and not explain:
+            result = await parallel_summary_query(db, endpoint_tablename='subject', qnode=qnode, log=log, include_sql=include_sql, approximate=approximate, cohort=cohort)
+        else:
+            result = await db.run_sync(summary_query, endpoint_tablename='subject', qnode=qnode, log=log, include_sql=include_sql, approximate=approximate, cohort=cohort, explain=explain)
         log.info('Success')
     except Exception as e:
-        # TODO - possibly a better exception to throw
         log.exception(str(e))
-        raise HTTPException(status_code=404, detail=str(e))
+        raise get_http_exception(e)
     return result
 
 @router.post('/file')
-def file_summary_endpoint(request: Request, 
-                             qnode: QNode, 
-                             db: Session = Depends(get_db)) -> SummaryResponseObj:
+async def file_summary_endpoint(request: Request, 
+                                   qnode: QNode, 
+                                   include_sql: bool = True,
+                                   approximate: bool = False,
+                                   parallel: bool = False,
+                                   cohort: str | None = None,
+                                   explain: bool = False,
+                                   db: AsyncSession = Depends(get_async_db_with_timeout('summary'))) -> SummaryResponseObj:
     """_summary_
 
     Args:
         request (Request): _description_
         qnode (QNode): _description_
-        db (Session, optional): _description_. Defaults to Depends(get_db).
+        include_sql (bool, optional): Return the generated SQL statement as query_sql. Defaults to True.
+        approximate (bool, optional): Estimate the summary from a sample of the table with error bounds. Defaults to False.
+        parallel (bool, optional): Execute the parts of the summary at the same time on separate connections. Defaults to False.
+        cohort (str, optional): Handle of a materialized cohort (from /cohort) to restrict the summary to. Defaults to None.
+        explain (bool, optional): Return per-stage timings and the EXPLAIN ANALYZE plan of the summary query as profile 
+            (runs the summary as a single query). Defaults to False.
+        db (AsyncSession, optional): _description_. Defaults to Depends(get_async_db_with_timeout('summary')).
 
     Returns:
         SummaryResponseObj: _description_
@@ -66,16 +86,14 @@ def file_summary_endpoint(request: Request,
     log.info(f'summary/file endpoint hit: {request.client}')
     log.info(f'QNode: {qnode.as_string()}') 
     log.info(f'{request.url}')
-    if qnode.is_empty():
-        e =  EmptyQueryError("Must provide either/both of 'MATCH_ALL' or 'MATCH_SOME' within the request body")
-        log.exception(e)
-        raise HTTPException(status_code=404, detail=str(e))
-    
+    # An empty QNode summarizes the whole release (answered from the precomputed rollups when they exist)
     try:
-        result = summary_query(db, endpoint_tablename='file', qnode=qnode)
+        if parallel and not explain:
+            result = await parallel_summary_query(db, endpoint_tablename='file', qnode=qnode, log=log, include_sql=include_sql, approximate=approximate, cohort=cohort)
+        else:
+            result = await db.run_sync(summary_query, endpoint_tablename='file', qnode=qnode, log=log, include_sql=include_sql, approximate=approximate, cohort=cohort, explain=explain)
         log.info('Success')
     except Exception as e:
-        # TODO - possibly a better exception to throw
         log.exception(str(e))
-        raise HTTPException(status_code=404, detail=str(e))
+        raise get_http_exception(e)
     return result
\ No newline at end of file
@@ -1,9 +1,9 @@
 from fastapi import Depends, APIRouter, HTTPException, Request
-from cda_api.db import get_db
+from cda_api.db import get_async_db_with_timeout
 from cda_api.db.query_builders import unique_value_query
 from cda_api.models import UniqueValueResponseObj
-from sqlalchemy.orm import Session
-from cda_api import get_logger
+from sqlalchemy.ext.asyncio import AsyncSession
+from cda_api import get_logger, get_http_exception
 import uuid
 
 router = APIRouter(
@@ -12,21 +12,27 @@ router = APIRouter(
 )
 
 @router.post('/{columnname}')
-def unique_values_endpoint(request: Request, 
-                            columnname: str, 
-                            system: str = '',
-                            count: bool = False,
-                            totalCount: bool = False,
-                            limit: int = None,
-                            offset: int = None,
-                            db: Session = Depends(get_db)) -> UniqueValueResponseObj:
+async def unique_values_endpoint(request: Request, 
+                                  columnname: str, 
+                                  system: str = '',
+                                  count: bool = False,
+                                  totalCount: bool = False,
+                                  limit: int = None,
+                                  offset: int = None,
+                                  include_sql: bool = True,
+                                  prefix: str | None = None,
+                                  contains: str | None = None,
+                                  db: AsyncSession = Depends(get_async_db_with_timeout('unique_values'))) -> UniqueValueResponseObj:
     """_summary_
 
     Args:
         request (Request): _description_
         column_name (str): _description_
         qnode (QNode): _description_
-        db (Session, optional): _description_. Defaults to Depends(get_db).
+        include_sql (bool, optional): Return the generated SQL statement as query_sql. Defaults to True.
+        prefix (str, optional): Only return values starting with prefix (case insensitive). Defaults to None.
+        contains (str, optional): Only return values containing the string (case insensitive). Defaults to None.
+        db (AsyncSession, optional): _description_. Defaults to Depends(get_async_db_with_timeout('unique_values')).
 
     Returns:
         FrequencyResponseObj: _description_
@@ -38,14 +44,17 @@ def unique_values_endpoint(request: Request,
 
     try:
         # Get paged query result
-        result = unique_value_query(db, 
+        result = await db.run_sync(unique_value_query,
                                 columnname=columnname,
                                 system=system,
                                 countOpt=count,
                                 totalCount=totalCount,
                                 limit=limit,
                                 offset=offset,
-                                log=log)
+                                log=log,
+                                include_sql=include_sql,
+                                prefix=prefix,
+                                contains=contains)
         
         # TODO need to figure out better way to handle limit and offset
         result['next_url'] = None
@@ -58,7 +67,6 @@ def unique_values_endpoint(request: Request,
             result['total_row_count'] = None
 
     except Exception as e:
-        # TODO - possibly a better exception to throw
         log.exception(e)
-        raise HTTPException(status_code=404, detail=str(e))
+        raise get_http_exception(e)
     return result
\ No newline at end of file
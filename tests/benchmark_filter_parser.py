@@ -0,0 +1,120 @@
+"""Microbenchmark of filter string parsing: the precompiled, memoized parse_filter_string against the previous parser
+
+Run from the repository root: python -m tests.benchmark_filter_parser [--filters 500] [--repeat 20]
+"""
+from cda_api.db import filter_builder
+from cda_api import get_logger, ParsingError
+import argparse
+import timeit
+import re
+import ast
+
+
+
+# parse_filter_string before the precompiled, memoized parser (kept here as the benchmark baseline)
+def legacy_parse_filter_string(filter_string, log):
+    # Clean up the filter
+    filter_string = filter_string.strip()
+
+    # Parse out the operator (Note: Order matters, you can't put = before <=)
+    operator_pattern = r"(?:\snot\s|\s)(?:!=|<>|<=|>=|=|<|>|is|in|like|between|not)+(?:\snot\s|\s)"
+    operator_rexp = re.compile(operator_pattern)
+    parsed_operators = [op.strip() for op in operator_rexp.findall(filter_string.lower())]
+    if len(parsed_operators) != 1:
+        raise ParsingError(f'Unable to parse out operator in filter: "{filter_string}"')
+
+    # Get the operator from the list of matches 
+    operator = parsed_operators[0]
+
+    # Verify the matched operator is valid
+    valid_operators = ['!=','<>','<=','>=','=','<','>','is','in','like','between',
+                    'not','is not','not in','not like','not between']
+    if operator not in valid_operators:
+        raise ParsingError(f'Parsed operator: "{operator}" not valid')
+    
+    # Ensure the operator isn't at the beginning or the end of the filter string
+    operator_location = re.search(operator, filter_string.lower())
+    if operator_location.start() == 0:
+        raise ParsingError(f'Missing column in filter before operator "{filter_string}"')
+
+    if operator_location.end() == len(filter_string):
+        raise ParsingError(f'Missing value after operator "{filter_string}"')
+
+    # Set columnname value to the stripped string before the operator
+    columnname = filter_string[:operator_location.start()].strip()
+
+    # Check if the string before the operator wasn't just whitespace
+    if len(columnname) < 1:
+        raise ParsingError(f'Missing column in filter before operator "{filter_string}"')
+
+    # Ensure there is no whitespace in the parsed columnname
+    if re.search(r'\s', columnname):
+        raise ParsingError(f'Invalid column "{columnname}" in filter: "{filter_string}"')
+
+    # Set columnname value to the stripped string after the operator
+    value_string = filter_string[operator_location.end():].strip()
+
+    # Use ast.literal_eval() to safely evaluate the value
+    try:
+        value = ast.literal_eval(value_string)
+    except Exception:
+        # If there is an error, just handle as a string
+        value = value_string
+
+    # Check if value is null
+    if isinstance(value, str):
+        if value.lower() == 'null':
+            value = None
+
+    # Need to ensure lists and the operators "in"/"not in" are only ever used together
+    if isinstance(value, list) and (operator not in ['in', 'not in']):
+        raise ParsingError(f'Operator must be "in" or "not in" when using a list value -> filter: {filter_string}')
+
+    elif (not isinstance(value, list)) and (operator in ['in', 'not in']):
+        raise ParsingError(f'Value: {value_string} must be a list (ex. [1,2,3] or ["a","b","c"]) when using "in" or "not in" operators -> filter: "{filter_string}"')
+    
+    log.debug(f'columnname: {columnname}, operator: {operator}, value: {value}, value type: {type(value)}')
+    
+    return columnname, operator, value
+
+
+# A MATCH_SOME list of id filters plus the other kinds of filters clients send
+def build_filter_strings(filter_count):
+    filter_strings = [f'subject_id = TCGA-{i:06d}' for i in range(filter_count)]
+    filter_strings += ['sex = male', 'sex != "female"', 'year_of_birth >= 1950', 'year_of_death < 2000.5', 
+                       'primary_diagnosis_site like %brain%', 'primary_diagnosis_site not like BR%',
+                       'cause_of_death is null', 'cause_of_death is not NULL', 'subject_data_at_gdc = True',
+                       f'subject_id_alias in {list(range(filter_count))}', "hugo_symbol not in ['TP53', 'KRAS']"]
+    return filter_strings
+
+
+def parse_all(parser, filter_strings, log):
+    return [parser(filter_string, log) for filter_string in filter_strings]
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Benchmark filter string parsing')
+    arg_parser.add_argument('--filters', type=int, default=500, help='Number of id filters in the MATCH_SOME list')
+    arg_parser.add_argument('--repeat', type=int, default=20, help='Number of times the filters are parsed')
+    args = arg_parser.parse_args()
+
+    log = get_logger('Benchmark: benchmark_filter_parser.py')
+    filter_strings = build_filter_strings(args.filters)
+
+    # Both parsers need to agree before timing them
+    legacy_results = parse_all(legacy_parse_filter_string, filter_strings, log)
+    results = parse_all(filter_builder.parse_filter_string, filter_strings, log)
+    if results != legacy_results:
+        mismatches = [(filter_string, legacy_result, result) for filter_string, legacy_result, result 
+                      in zip(filter_strings, legacy_results, results) if legacy_result != result]
+        raise AssertionError(f'Parsers disagree: {mismatches[:5]}')
+
+    legacy_time = timeit.timeit(lambda: parse_all(legacy_parse_filter_string, filter_strings, log), number=args.repeat)
+    filter_builder.parse_filter_components.cache_clear()
+    uncached_time = timeit.timeit(lambda: (filter_builder.parse_filter_components.cache_clear(), 
+                                           parse_all(filter_builder.parse_filter_string, filter_strings, log)), number=args.repeat)
+    cached_time = timeit.timeit(lambda: parse_all(filter_builder.parse_filter_string, filter_strings, log), number=args.repeat)
+    print(f'{len(filter_strings)} filters x {args.repeat} runs')
+    print(f'legacy parser:           {legacy_time:.4f}s')
+    print(f'precompiled (no memo):   {uncached_time:.4f}s ({legacy_time / uncached_time:.1f}x)')
+    print(f'precompiled (memoized):  {cached_time:.4f}s ({legacy_time / cached_time:.1f}x)')
@@ -0,0 +1,62 @@
+from fastapi.testclient import TestClient
+from cda_api.db.cohort import COHORT_CACHE
+from cda_api import app
+
+client = TestClient(app)
+
+
+################################ batch testing ################################
+def test_batch_endpoint():
+    items = [
+        {"endpoint": "summary/subject", "qnode": {"MATCH_ALL": ["subject_id_alias < 20"]}},
+        {"endpoint": "data/subject", "qnode": {"MATCH_ALL": ["subject_id_alias < 20"]}, "limit": 5},
+        {"endpoint": "data/subject", "qnode": {"MATCH_ALL": ["subject_id_alias < 20"]}, "limit": 5, "offset": 5},
+        {"endpoint": "data/file", "qnode": {"MATCH_ALL": ["file_id_alias < 10"]}},
+        {"endpoint": "data/subject", "qnode": {"MATCH_ALL": ["subject_id_alias < 20"]}, "limit": 5},
+    ]
+    response = client.post("/batch", json=items, params={'include_sql': False})
+    assert response.status_code == 200
+    result = response.json()['result']
+    assert [item['endpoint'] for item in result] == [item['endpoint'] for item in items]
+    assert all(item['status_code'] == 200 for item in result)
+    assert result[0]['response']['result'][0]['total_count'] == 19
+    assert result[1]['response']['total_row_count'] == 19
+    assert len(result[1]['response']['result']) == 5
+    assert result[1]['response']['result'] != result[2]['response']['result']
+    assert result[1] == result[4]
+
+    # Results match the individual endpoints
+    data_response = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 10"]})
+    assert result[3]['response']['result'] == data_response.json()['result']
+
+
+def test_batch_endpoint_shared_filters():
+    # Items differing by one filter share a cohort built from the filters they have in common
+    qnodes = [{"MATCH_ALL": ["subject_id_alias < 1000", "sex = male"]},
+              {"MATCH_ALL": [" subject_id_alias  <  1000", "sex = female"], "MATCH_SOME": ["year_of_birth > 1950", "year_of_birth is null"]},
+              {"MATCH_ALL": ["subject_id_alias < 1000"]}]
+    items = [{"endpoint": endpoint, "qnode": qnode, "limit": 5} for endpoint in ['summary/subject', 'data/subject'] for qnode in qnodes]
+    COHORT_CACHE.clear()
+    response = client.post("/batch", json=items)
+    assert response.status_code == 200
+    result = response.json()['result']
+    assert len(COHORT_CACHE) == 1
+    assert all('cohort_ids' in item['response']['query_sql'] for item in result)
+    # Results match the individual endpoints
+    for item, item_result in zip(items, result):
+        individual_response = client.post(f"/{item['endpoint']}", json=item['qnode'], params={'limit': 5})
+        assert item_result['response']['result'] == individual_response.json()['result']
+
+
+def test_batch_endpoint_item_errors():
+    items = [
+        {"endpoint": "data/subject", "qnode": {"MATCH_ALL": ["FAKE_COLUMN = 42"]}},
+        {"endpoint": "data/subject", "qnode": {}},
+        {"endpoint": "summary/subject", "qnode": {"MATCH_ALL": ["subject_id_alias < 0"]}},
+    ]
+    response = client.post("/batch", json=items)
+    assert response.status_code == 200
+    result = response.json()['result']
+    assert [item['status_code'] for item in result] == [404, 404, 200]
+    assert result[0]['detail'] == "Column Not Found: FAKE_COLUMN\n'FAKE_COLUMN'"
+    assert result[2]['response']['result'][0]['total_count'] == 0
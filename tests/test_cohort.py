@@ -0,0 +1,91 @@
+from fastapi.testclient import TestClient
+from cda_api.classes.IdSet import IdSet
+from cda_api.db.cohort import COHORT_CACHE
+from cda_api import app
+
+client = TestClient(app)
+
+
+################################ cohort testing ################################
+def test_cohort_endpoint():
+    qnode_json = {"MATCH_ALL": ["subject_id_alias < 50", "sex = 'male'"]}
+    response = client.post("/cohort/subject", json=qnode_json)
+    assert response.status_code == 200
+    cohort = response.json()['cohort']
+    assert response.json()['size'] == 16
+    # The same filters always get the same handle
+    assert client.post("/cohort/subject", json={"MATCH_ALL": ["sex = 'MALE'", "subject_id_alias < 50"]}).json()['cohort'] == cohort
+
+    # Pages, counts, and summaries of the cohort match the filtered requests
+    data_response = client.post("/data/subject", json={}, params={'cohort': cohort, 'limit': 10})
+    filtered_data_response = client.post("/data/subject", json=qnode_json, params={'limit': 10})
+    assert data_response.status_code == 200
+    assert data_response.json()['total_row_count'] == 16
+    assert data_response.json()['result'] == filtered_data_response.json()['result']
+    summary_response = client.post("/summary/subject", json={}, params={'cohort': cohort})
+    assert summary_response.status_code == 200
+    assert summary_response.json()['result'][0]['total_count'] == 16
+
+    # Cohorts can be refined with more filters
+    refined_response = client.post("/cohort/subject", json={"MATCH_ALL": ["subject_id_alias < 20"]}, params={'cohort': cohort})
+    assert refined_response.json()['size'] == 6
+    assert refined_response.json()['cohort'] != cohort
+
+
+def test_cohort_ids_bound_once():
+    cohort = client.post("/cohort/subject", json={"MATCH_ALL": ["subject_id_alias < 5000"]}).json()['cohort']
+    data_response = client.post("/data/subject", json={}, params={'cohort': cohort, 'limit': 10})
+    assert data_response.json()['total_row_count'] == 4999
+    # The cohort's ids are left out of query_sql and the bound list is kept with the cohort for the next requests
+    assert 'subject.id_alias = ANY (:cohort_ids /* 4999 values */)' in data_response.json()['query_sql']
+    bound_ids = COHORT_CACHE.get(cohort)['bound_ids']
+    assert len(bound_ids) == 4999
+    client.post("/data/subject", json={}, params={'cohort': cohort, 'limit': 10, 'offset': 10})
+    assert COHORT_CACHE.get(cohort)['bound_ids'] is bound_ids
+
+
+def test_cohort_endpoint_empty_qnode():
+    # Cohorts of every row aren't materialized
+    response = client.post("/cohort/subject", json={})
+    assert response.status_code == 404
+    assert response.json()['detail'] == "Must provide either/both of 'MATCH_ALL' or 'MATCH_SOME' within the request body"
+
+
+def test_cohort_not_found():
+    response = client.post("/data/subject", json={}, params={'cohort': 'not_a_cohort'})
+    assert response.status_code == 404
+    assert response.json() == {'detail': 'Cohort not found or expired: not_a_cohort'}
+
+    cohort = client.post("/cohort/file", json={"MATCH_ALL": ["file_id_alias < 10"]}).json()['cohort']
+    response = client.post("/summary/subject", json={}, params={'cohort': cohort})
+    assert response.status_code == 404
+    COHORT_CACHE.clear()
+    response = client.post("/summary/file", json={}, params={'cohort': cohort})
+    assert response.status_code == 404
+
+
+def test_cohort_combine_endpoint():
+    male_cohort = client.post("/cohort/subject", json={"MATCH_ALL": ["subject_id_alias < 50", "sex = 'male'"]}).json()['cohort']
+    early_cohort = client.post("/cohort/subject", json={"MATCH_ALL": ["subject_id_alias < 20"]}).json()['cohort']
+    sizes = {}
+    for operation in ['union', 'intersection', 'difference']:
+        response = client.post("/cohort/combine", json={"operation": operation, "cohorts": [male_cohort, early_cohort]})
+        assert response.status_code == 200
+        sizes[operation] = response.json()['size']
+        combined_cohort = response.json()['cohort']
+    assert sizes == {'union': 29, 'intersection': 6, 'difference': 10}
+
+    # Rows of the combined cohort are fetched with its handle
+    data_response = client.post("/data/subject", json={}, params={'cohort': combined_cohort, 'limit': 100})
+    assert data_response.json()['total_row_count'] == 10
+    assert all(int(row['subject_id'].split('-')[-1]) >= 20 for row in data_response.json()['result'])
+
+
+def test_id_set_operations():
+    first, second = IdSet([5, 1, 3, 3]), IdSet([3, 4, 5])
+    assert list(first) == [1, 3, 5]
+    assert 3 in first and 4 not in first
+    assert list(first.union(second)) == [1, 3, 4, 5]
+    assert list(first.intersection(second)) == [3, 5]
+    assert list(first.difference(second)) == [1]
+    assert first.intersection(second, IdSet([5])) == IdSet([5])
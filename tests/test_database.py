@@ -1,6 +1,13 @@
+import pytest
 from cda_api.db.connection import engine
+from cda_api.db.schema import Base, RELEASE, SCHEMA_SNAPSHOT
+from cda_api.db.snapshot import load_schema_snapshot, save_schema_snapshot
+from cda_api import get_http_exception, ColumnNotFound, TableNotFound
+from cda_api.db import DB_MAP
 from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.automap import automap_base
 
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -11,4 +18,48 @@ def test_engine_connection():
         db_session.execute(text('SELECT 1'))
         db_session.close()
     except:
-        raise Exception #TODO better exception
\ No newline at end of file
+        raise Exception #TODO better exception
+
+def test_statement_timeout_http_exception():
+    db_session = TestingSessionLocal()
+    try:
+        db_session.execute(text('SET LOCAL statement_timeout = 10'))
+        db_session.execute(text('SELECT pg_sleep(1)'))
+        raise AssertionError('Expected statement timeout')
+    except OperationalError as e:
+        assert get_http_exception(e).status_code == 504
+    finally:
+        db_session.close()
+
+def test_schema_snapshot(tmp_path):
+    snapshot_path = str(tmp_path / 'schema_snapshot.pkl')
+    snapshot = {'release': RELEASE, 'metadata': Base.metadata, 'column_metadata': SCHEMA_SNAPSHOT['column_metadata']}
+    save_schema_snapshot(snapshot, snapshot_path)
+
+    loaded_snapshot = load_schema_snapshot(RELEASE, snapshot_path)
+    assert set(loaded_snapshot['metadata'].tables.keys()) == set(Base.metadata.tables.keys())
+    assert loaded_snapshot['column_metadata'] == SCHEMA_SNAPSHOT['column_metadata']
+
+    # Snapshots from another release are ignored
+    assert load_schema_snapshot('another release', snapshot_path) is None
+
+    # Automapping the snapshot metadata without reflection gives the same entity tables
+    SnapshotBase = automap_base(metadata=loaded_snapshot['metadata'])
+    SnapshotBase.prepare()
+    assert set(SnapshotBase.classes.keys()) == set(Base.classes.keys())
+
+def test_database_map_indexes():
+    assert [column_info.uniquename for column_info in DB_MAP.get_table_column_infos('subject')] == [column_info.uniquename for column_info in DB_MAP.column_map.values() if column_info.tablename == 'subject']
+    assert DB_MAP.get_table_column_infos('not_a_table') == []
+    assert DB_MAP.get_column_uniquename('id', 'subject') == 'subject_id'
+    assert DB_MAP.get_column_uniquename('sex', 'subject') == 'sex'
+    with pytest.raises(ColumnNotFound):
+        DB_MAP.get_column_uniquename('not_a_column', 'subject')
+    with pytest.raises(TableNotFound):
+        DB_MAP.get_column_uniquename('id', 'not_a_table')
+
+    # "did you mean" suggestions match the columns ending or starting with the requested name
+    possible_cols = DB_MAP.get_possible_columns('_id')
+    assert possible_cols == [k for k in DB_MAP.column_map.keys() if k.endswith('_id')] + [k for k in DB_MAP.column_map.keys() if k.startswith('_id')]
+    with pytest.raises(ColumnNotFound, match='did you mean'):
+        DB_MAP.get_column_info('subject_i')
@@ -1,6 +1,18 @@
 from fastapi.testclient import TestClient
+import json
+import csv
+import io
+import asyncio
 from cda_api.db.query_builders import fetch_rows
-from cda_api import app, ColumnNotFound
+from cda_api.db.filter_builder import get_qnode_filter_key, get_qnode_filter_template
+from cda_api.models import QNode
+from cda_api.classes import QueryProfiler
+from cda_api.db.index_advisor import build_index_proposal
+from cda_api.db.connection import engine
+from cda_api.routers.data import stream_csv
+from cda_api.db.query_utilities import get_table_row_estimates
+from sqlalchemy import text
+from cda_api import app, ColumnNotFound, get_logger
 
 client = TestClient(app)
 
@@ -54,6 +66,322 @@ def test_data_subject_endpoint_column_not_found():
     assert response.json() == expected_response_json
 
 
+def test_data_subject_endpoint_cursor_pagination():
+    first_page = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": ["subject_id_alias < 30"]},
+        params={'cursor': '', 'limit': 10}
+    )
+    assert first_page.status_code == 200
+    assert len(first_page.json()['result']) == 10
+    assert first_page.json()['next_cursor']
+
+    second_page = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": ["subject_id_alias < 30"]},
+        params={'cursor': first_page.json()['next_cursor'], 'limit': 10}
+    )
+    assert second_page.status_code == 200
+    assert len(second_page.json()['result']) == 10
+    assert all(row not in first_page.json()['result'] for row in second_page.json()['result'])
+
+
+def test_data_subject_endpoint_foreign_columns_paged():
+    qnode_json = {"MATCH_ALL": ["subject_id_alias < 13"], "ADD_COLUMNS": ["primary_diagnosis_site", "hugo_symbol", "file_id"]}
+    pages = [client.post("/data/subject", json=qnode_json, params={'offset': offset, 'limit': 4}) for offset in [0, 4, 8]]
+    assert all(page.status_code == 200 for page in pages)
+    # Foreign column arrays are only aggregated for the id_alias values on the page
+    assert 'page_preselect' in pages[0].json()['query_sql']
+    assert 'IN (SELECT page_preselect.id_alias FROM page_preselect)' in pages[0].json()['query_sql']
+    paged_rows = [row for page in pages for row in page.json()['result']]
+    # The export aggregates the foreign column arrays for every row at once
+    export_response = client.post("/data/subject/export", json=qnode_json)
+    exported_rows = [json.loads(line) for line in export_response.text.splitlines()]
+    assert sorted(paged_rows, key=lambda row: row['subject_id']) == sorted(exported_rows, key=lambda row: row['subject_id'])
+    assert [row['subject_id'] for row in paged_rows] == [f'SUBJ-{i}' for i in range(1, 13)]
+
+
+def test_data_subject_endpoint_explain(monkeypatch):
+    # Every request counts as slow with a 0 second threshold
+    monkeypatch.setattr(QueryProfiler, 'SLOW_QUERY_THRESHOLD', 0)
+    qnode_json = {"MATCH_ALL": ["subject_id_alias < 30", "sex = male"]}
+    response = client.post("/data/subject", json=qnode_json, params={'explain': True, 'limit': 10})
+    assert response.status_code == 200
+    profile = response.json()['profile']
+    assert list(profile['stages']) == ['parse', 'build', 'compile', 'execute', 'count', 'serialize']
+    assert profile['total_time'] >= sum(profile['stages'].values())
+    assert 'Actual Total Time' in profile['plans']['page']['Plan']
+    assert 'Actual Total Time' in profile['plans']['count']['Plan']
+    # The slow query log records the normalized QNode
+    with open('slow_query.log') as slow_query_log:
+        slow_query = json.loads(slow_query_log.readlines()[-1].split(' ', 2)[-1])
+    assert slow_query['qnode'] == json.loads(get_qnode_filter_key('subject', QNode(**qnode_json), get_logger()))
+    assert list(slow_query['stages']) == list(profile['stages'])
+    # The EXPLAIN ANALYZE runs after the total time is recorded
+    assert slow_query['total_time'] == profile['total_time']
+    # Profiles are only returned when explain is requested, and statements are only compiled separately for them
+    response = client.post("/data/subject", json=qnode_json, params={'limit': 10})
+    assert response.json()['profile'] is None
+    with open('slow_query.log') as slow_query_log:
+        slow_query = json.loads(slow_query_log.readlines()[-1].split(' ', 2)[-1])
+    assert list(slow_query['stages']) == ['parse', 'build', 'execute', 'count', 'serialize']
+
+
+def test_data_subject_endpoint_case_insensitive_filters():
+    def total_row_count(filter_string):
+        response = client.post("/data/subject", json={"MATCH_ALL": [filter_string]}, params={'limit': 1})
+        assert response.status_code == 200
+        return response.json()['total_row_count']
+    # 6666 male, 6667 female, and 6667 NULL subjects (NULL values compare as '')
+    assert total_row_count("sex = MALE") == 6666
+    assert total_row_count("sex != male") == 13334
+    assert total_row_count("sex like M%") == 6666
+    assert total_row_count("sex not like m%") == 13334
+    assert total_row_count("sex = ''") == 6667
+    assert total_row_count("sex like %") == 20000
+    # Equality and like filters compare upper(column) so indexes on it can serve them
+    response = client.post("/data/subject", json={"MATCH_ALL": ["sex = male"]}, params={'limit': 1})
+    assert 'upper(subject.sex) = upper(' in response.json()['query_sql']
+    assert 'coalesce' not in response.json()['query_sql']
+
+
+def test_data_subject_endpoint_id_filter_index_lookup():
+    index_proposal = build_index_proposal('subject', ['id'], 'upper')
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text(index_proposal['definition']))
+        connection.execute(text('ANALYZE subject'))
+    try:
+        response = client.post("/data/subject", json={"MATCH_ALL": ["subject_id = subj-5"]}, params={'explain': True})
+        assert [row['subject_id'] for row in response.json()['result']] == ['SUBJ-5']
+        assert index_proposal['name'] in json.dumps(response.json()['profile']['plans']['page'])
+    finally:
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text(f'DROP INDEX IF EXISTS {index_proposal["name"]}'))
+
+
+def test_data_endpoint_foreign_filter_semi_joins():
+    def total_row_count(endpoint_tablename, qnode_json):
+        response = client.post(f"/data/{endpoint_tablename}", json=qnode_json, params={'limit': 1})
+        assert response.status_code == 200
+        return response.json()['total_row_count'], response.json()['query_sql']
+    def expected_row_count(sql):
+        with engine.connect() as connection:
+            return connection.execute(text(sql)).scalar()
+    # Filters on the same foreign table are merged into one semi-join (grouped when every filter has to match)
+    row_count, query_sql = total_row_count('subject', {"MATCH_ALL": ["hugo_symbol = egfr", "hugo_symbol != kras", "primary_diagnosis_site = brain"]})
+    assert query_sql.count('IN (SELECT mutation.subject_alias') == 1
+    assert query_sql.count('IN (SELECT observation.subject_alias') == 1
+    assert 'bool_or' in query_sql
+    assert row_count == 5000
+    assert row_count == expected_row_count("""SELECT count(*) FROM (SELECT subject_alias FROM mutation WHERE upper(hugo_symbol) = 'EGFR'
+                                                                    INTERSECT SELECT subject_alias FROM mutation WHERE coalesce(upper(hugo_symbol), '') != 'KRAS'
+                                                                    INTERSECT SELECT subject_alias FROM observation WHERE upper(primary_diagnosis_site) = 'BRAIN') matches""")
+    row_count, query_sql = total_row_count('subject', {"MATCH_SOME": ["hugo_symbol = tp53", "hugo_symbol = kras", "primary_diagnosis_site = lung"]})
+    assert query_sql.count('IN (SELECT mutation.subject_alias') == 1
+    assert row_count == expected_row_count("""SELECT count(*) FROM subject s 
+                                              WHERE EXISTS (SELECT 1 FROM mutation m WHERE m.subject_alias = s.id_alias AND upper(m.hugo_symbol) IN ('TP53', 'KRAS'))
+                                              OR EXISTS (SELECT 1 FROM observation o WHERE o.subject_alias = s.id_alias AND upper(o.primary_diagnosis_site) = 'LUNG')""")
+    # Foreign tables related through a mapping table are joined to it
+    row_count, query_sql = total_row_count('file', {"MATCH_ALL": ["hugo_symbol = egfr", "primary_diagnosis_site = brain"]})
+    assert 'IN (SELECT file_describes_subject.file_alias' in query_sql
+    assert row_count == expected_row_count("""SELECT count(*) FROM file f 
+                                              WHERE EXISTS (SELECT 1 FROM file_describes_subject fds JOIN mutation m ON m.subject_alias = fds.subject_alias 
+                                                            WHERE fds.file_alias = f.id_alias AND upper(m.hugo_symbol) = 'EGFR')
+                                              AND EXISTS (SELECT 1 FROM file_describes_subject fds JOIN observation o ON o.subject_alias = fds.subject_alias 
+                                                          WHERE fds.file_alias = f.id_alias AND upper(o.primary_diagnosis_site) = 'BRAIN')""")
+
+
+def test_data_subject_endpoint_in_list_array_binding():
+    response = client.post("/data/subject", json={"MATCH_ALL": ['subject_id in ["SUBJ-1", "SUBJ-2", "SUBJ-3"]', "subject_id_alias not in [2]"]})
+    assert response.status_code == 200
+    assert [row['subject_id'] for row in response.json()['result']] == ['SUBJ-1', 'SUBJ-3']
+    # The lists are bound as a single array parameter each
+    assert "subject.id = ANY (ARRAY['SUBJ-1', 'SUBJ-2', 'SUBJ-3'])" in response.json()['query_sql']
+    assert 'subject.id_alias != ALL (ARRAY[2])' in response.json()['query_sql']
+    # Long lists are left out of query_sql, but the estimated row count still explains the query with every value
+    response = client.post("/data/subject", json={"MATCH_ALL": [f'subject_id_alias in {list(range(1, 501))}']}, params={'row_count': 'estimate'})
+    assert response.status_code == 200
+    assert 'subject.id_alias = ANY (:match_all_0 /* 500 values */)' in response.json()['query_sql']
+    assert 0 < response.json()['total_row_count'] <= 1000
+
+
+def test_data_subject_endpoint_in_list_staging():
+    # Lists above the staging threshold (10000) are joined from a temp table
+    subject_ids = [f'SUBJ-{i}' for i in range(1, 100001, 2)]
+    qnode_json = {"MATCH_ALL": [f'subject_id in {json.dumps(subject_ids)}', "subject_id_alias not in [1, 3]"]}
+    for _ in range(2):
+        # The second request reuses the cached query template and stages the values again
+        response = client.post("/data/subject", json=qnode_json, params={'limit': 2})
+        assert response.status_code == 200
+        assert response.json()['total_row_count'] == 9998
+        assert [row['subject_id'] for row in response.json()['result']] == ['SUBJ-5', 'SUBJ-7']
+        assert 'subject.id IN (SELECT staged_match_all_0.value FROM staged_match_all_0)' in response.json()['query_sql']
+    qnode_json = {"MATCH_ALL": [f'subject_id_alias not in {list(range(1, 19999))}']}
+    response = client.post("/data/subject", json=qnode_json)
+    assert [row['subject_id'] for row in response.json()['result']] == ['SUBJ-19999', 'SUBJ-20000']
+    # The temp tables are only visible to the request's connection, so parallel summaries run as a single query
+    response = client.post("/summary/subject", json=qnode_json, params={'parallel': True})
+    assert response.status_code == 200
+    assert response.json()['result'][0]['total_count'] == 2
+
+
+def test_data_subject_endpoint_offset_page_order():
+    # The outer json query orders offset pages by id_alias (a subquery's order isn't guaranteed to be kept)
+    response = client.post("/data/subject", json={"MATCH_ALL": ["sex = female"]}, params={'limit': 20, 'offset': 40})
+    assert response.status_code == 200
+    assert response.json()['query_sql'].endswith('ORDER BY page.cursor_id_alias')
+    subject_ids = [row['subject_id'] for row in response.json()['result']]
+    assert subject_ids == sorted(subject_ids, key=lambda subject_id: int(subject_id.split('-')[1]))
+    assert 'cursor_id_alias' not in response.json()['result'][0]
+
+
+def test_data_subject_endpoint_invalid_cursor():
+    response = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": ["subject_id_alias < 30"]},
+        params={'cursor': 'FAKE_CURSOR'}
+    )
+    expected_response_json = {'detail': 'Invalid cursor: "FAKE_CURSOR"'}
+    assert response.status_code == 404
+    assert response.json() == expected_response_json
+
+
+def test_data_subject_endpoint_row_count_none():
+    response = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": ["subject_id_alias < 30"]},
+        params={'row_count': 'none', 'limit': 10}
+    )
+    assert response.status_code == 200
+    assert response.json()['total_row_count'] is None
+    assert 'offset=10' in response.json()['next_url']
+
+
+def test_data_subject_endpoint_row_count_estimate():
+    response = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": ["subject_id_alias < 30"]},
+        params={'row_count': 'estimate'}
+    )
+    assert response.status_code == 200
+    assert isinstance(response.json()['total_row_count'], int)
+
+
+def test_qnode_filter_key_normalization():
+    log = get_logger()
+    qnode = QNode(MATCH_ALL=["sex = 'male'", "subject_id_alias < 30"])
+    equivalent_qnode = QNode(MATCH_ALL=["subject_id_alias  <  30", "sex = 'MALE'"])
+    different_qnode = QNode(MATCH_SOME=["sex = 'male'", "subject_id_alias < 30"])
+    assert get_qnode_filter_key('subject', qnode, log) == get_qnode_filter_key('subject', equivalent_qnode, log)
+    assert get_qnode_filter_key('subject', qnode, log) != get_qnode_filter_key('subject', different_qnode, log)
+
+
+def test_qnode_filter_template():
+    log = get_logger()
+    filter_shapes, filter_params = get_qnode_filter_template(QNode(MATCH_ALL=["sex = 'male'", "subject_id_alias < 30"]), log)
+    other_filter_shapes, other_filter_params = get_qnode_filter_template(QNode(MATCH_ALL=["sex = 'female'", "subject_id_alias < 10"]), log)
+    assert filter_shapes == other_filter_shapes
+    assert filter_params == {'match_all_0': 'male', 'match_all_1': 30}
+    assert other_filter_params == {'match_all_0': 'female', 'match_all_1': 10}
+
+
+def test_data_subject_endpoint_reuses_filter_template():
+    # The second query reuses the first query's template with its own values
+    response = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": ["subject_id_alias < 30"]},
+    )
+    other_response = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": ["subject_id_alias < 10"]},
+    )
+    assert response.status_code == 200
+    assert other_response.status_code == 200
+    assert response.json()['total_row_count'] == 29
+    assert other_response.json()['total_row_count'] == 9
+    assert 'subject.id_alias < 10' in other_response.json()['query_sql']
+    # query_sql is rendered from the SQL template cached for the query's shape with the request's own values
+    assert response.json()['query_sql'].replace('< 30', '< 10') == other_response.json()['query_sql']
+
+
+def test_data_subject_endpoint_without_sql():
+    response = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": ["subject_id_alias < 30"]},
+        params={'include_sql': False}
+    )
+    assert response.status_code == 200
+    assert response.json()['query_sql'] is None
+    assert response.json()['total_row_count'] == 29
+
+
+def test_data_subject_export_ndjson():
+    response = client.post(
+        "/data/subject/export",
+        json={"MATCH_ALL": ["subject_id_alias < 30"]},
+    )
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    paged_response = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": ["subject_id_alias < 30"]},
+    )
+    assert len(rows) == paged_response.json()['total_row_count']
+
+
+def test_data_subject_export_csv():
+    response = client.post(
+        "/data/subject/export",
+        json={"MATCH_ALL": ["subject_id_alias < 30"]},
+        params={'format': 'csv'}
+    )
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    paged_response = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": ["subject_id_alias < 30"]},
+    )
+    assert len(rows) == paged_response.json()['total_row_count']
+
+
+def test_stream_csv_chunks():
+    class ClosableSession():
+        async def close(self):
+            self.closed = True
+    async def rows():
+        for i in range(5):
+            yield {'id': i, 'values': [i]}
+    async def collect_chunks():
+        return [chunk async for chunk in stream_csv(rows(), db, get_logger(), rows_per_chunk=2)]
+    db = ClosableSession()
+    chunks = asyncio.run(collect_chunks())
+    # Every chunk holds rows_per_chunk rows (the first one also has the header)
+    assert [len(chunk.splitlines()) for chunk in chunks] == [3, 2, 1]
+    assert list(csv.DictReader(io.StringIO(''.join(chunks))))[-1] == {'id': '4', 'values': '[4]'}
+    assert db.closed
+
+
+def test_data_subject_export_in_list_staging():
+    # The export query stages lists above the staging threshold (10000) like the paged query
+    subject_ids = [f'SUBJ-{i}' for i in range(1, 100001, 2)]
+    response = client.post("/data/subject/export", json={"MATCH_ALL": [f'subject_id in {json.dumps(subject_ids)}']})
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 10000
+    assert all(int(row['subject_id'].split('-')[1]) % 2 == 1 for row in rows)
+
+
+def test_data_subject_export_foreign_filters():
+    # Foreign table semi-joins are ordered with the row estimates loaded on startup instead of querying while building
+    assert get_table_row_estimates()['subject'] == 20000
+    qnode_json = {"MATCH_ALL": ["hugo_symbol = egfr", "primary_diagnosis_site = brain"]}
+    response = client.post("/data/subject/export", json=qnode_json)
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    paged_response = client.post("/data/subject", json=qnode_json, params={'limit': 1})
+    assert len(rows) == paged_response.json()['total_row_count'] == 5000
+
+
 ################################ data/file testing ################################
 def test_data_file_endpoint_query_generation():
     response = client.post(
@@ -0,0 +1,41 @@
+from cda_api.db.filter_builder import parse_filter_string
+from cda_api import get_logger, ParsingError
+import pytest
+
+log = get_logger()
+
+
+@pytest.mark.parametrize('filter_string, expected', [
+    ('subject_id = TCGA-000001', ('subject_id', '=', 'TCGA-000001')),
+    ('  sex   !=   "female" ', ('sex', '!=', 'female')),
+    ("sex = 'male'", ('sex', '=', 'male')),
+    ('year_of_birth >= 1950', ('year_of_birth', '>=', 1950)),
+    ('year_of_birth <= -5', ('year_of_birth', '<=', -5)),
+    ('year_of_death < 2000.5', ('year_of_death', '<', 2000.5)),
+    ('subject_id = 007', ('subject_id', '=', '007')),
+    ('primary_diagnosis_site like %brain%', ('primary_diagnosis_site', 'like', '%brain%')),
+    ('primary_diagnosis_site NOT LIKE BR%', ('primary_diagnosis_site', 'not like', 'BR%')),
+    ('cause_of_death is null', ('cause_of_death', 'is', None)),
+    ('cause_of_death is not NULL', ('cause_of_death', 'is not', None)),
+    ('subject_data_at_gdc = True', ('subject_data_at_gdc', '=', True)),
+    ('subject_id_alias in [1, 2, 3]', ('subject_id_alias', 'in', [1, 2, 3])),
+    ("hugo_symbol not in ['TP53', 'KRAS']", ('hugo_symbol', 'not in', ['TP53', 'KRAS'])),
+    # Values can contain operator words
+    ('primary_diagnosis_site = in situ', ('primary_diagnosis_site', '=', 'in situ')),
+])
+def test_parse_filter_string(filter_string, expected):
+    assert parse_filter_string(filter_string, log) == expected
+
+
+@pytest.mark.parametrize('filter_string, error_message', [
+    ('sex male', 'Unable to parse out operator in filter: "sex male"'),
+    ('= male', 'Unable to parse out operator in filter: "= male"'),
+    ('sex =', 'Missing value after operator "sex ="'),
+    ('primary diagnosis = brain', 'Invalid column "primary diagnosis" in filter: "primary diagnosis = brain"'),
+    ('sex = [1, 2]', 'Operator must be "in" or "not in" when using a list value -> filter: sex = [1, 2]'),
+    ('sex in male', 'Value: male must be a list (ex. [1,2,3] or ["a","b","c"]) when using "in" or "not in" operators -> filter: "sex in male"'),
+])
+def test_parse_filter_string_errors(filter_string, error_message):
+    with pytest.raises(ParsingError) as e:
+        parse_filter_string(filter_string, log)
+    assert str(e.value) == error_message
@@ -0,0 +1,79 @@
+from cda_api.db.index_advisor import read_logged_queries, advise_indexes, create_indexes, build_index_proposal, index_exists
+from cda_api.db.connection import session, engine
+from cda_api import get_logger
+from sqlalchemy import text
+import json
+
+
+def write_slow_query_log(path, qnodes):
+    with open(path, 'w') as slow_query_log:
+        for endpoint_tablename, filters in qnodes:
+            qnode = {'endpoint': endpoint_tablename, 'MATCH_ALL': [json.dumps(filter) for filter in filters], 'MATCH_SOME': []}
+            slow_query = {'endpoint': endpoint_tablename, 'qnode': qnode, 'total_time': 10, 'stages': {}}
+            slow_query_log.write(f'2026-01-01 00:00:00,000 {json.dumps(slow_query)}\n')
+
+
+def test_index_advisor_proposals(tmp_path):
+    log = get_logger()
+    slow_query_log_path = tmp_path / 'slow_query.log'
+    write_slow_query_log(slow_query_log_path, [('subject', [['sex', '=', 'MALE'], ['subject_id_alias', '<', 30]]),
+                                               ('subject', [['sex', '!=', 'FEMALE'], ['hugo_symbol', 'like', 'TP%']]),
+                                               ('file', [['hugo_symbol', 'like', 'BRCA%']]),
+                                               ('subject', [['not_a_column', '=', 'X']])])
+    logged_queries = read_logged_queries([slow_query_log_path, tmp_path / 'missing.log'], log)
+    assert len(logged_queries) == 4
+
+    db = session()
+    try:
+        proposals = {proposal['name']: proposal for proposal in advise_indexes(db, logged_queries, log)}
+    finally:
+        db.close()
+    # String equality filters get an index on the same case insensitive expression the filters compare against
+    assert proposals['ix_subject_sex_upper']['queries'] == 1
+    assert proposals['ix_subject_sex_upper']['definition'].endswith("ON subject USING btree ((upper(sex)))")
+    # like filters get trigram indexes, and foreign table filters also get indexes on the mapping columns
+    assert proposals['ix_mutation_hugo_symbol_trgm']['queries'] == 2
+    assert proposals['ix_mutation_hugo_symbol_trgm']['extension'] == 'pg_trgm'
+    assert proposals['ix_mutation_subject_alias']['queries'] == 1
+    assert proposals['ix_file_describes_subject_subject_alias_file_alias']['queries'] == 1
+    # The primary key already serves id_alias filters
+    assert proposals['ix_subject_id_alias']['exists']
+    assert not proposals['ix_subject_sex_upper']['exists']
+
+
+def test_index_advisor_create_indexes(tmp_path):
+    log = get_logger()
+    slow_query_log_path = tmp_path / 'slow_query.log'
+    write_slow_query_log(slow_query_log_path, [('subject', [['sex', '=', 'MALE']])])
+    db = session()
+    try:
+        proposals = advise_indexes(db, read_logged_queries([slow_query_log_path], log), log)
+        assert create_indexes(proposals, log) == ['ix_subject_sex_upper']
+        assert advise_indexes(db, read_logged_queries([slow_query_log_path], log), log)[0]['exists']
+    finally:
+        db.close()
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text('DROP INDEX IF EXISTS ix_subject_sex_upper'))
+
+
+def test_index_advisor_index_exists_matches_whole_columns():
+    existing_indexes = {'subject': {'subject_pkey': 'CREATE UNIQUE INDEX subject_pkey ON public.subject USING btree (id_alias)'},
+                        'mutation': {'ix_mutation_subject_alias_hugo_symbol': 'CREATE INDEX ix_mutation_subject_alias_hugo_symbol '
+                                                                              'ON public.mutation USING btree (subject_alias, hugo_symbol)'}}
+    assert index_exists(build_index_proposal('subject', ['id_alias']), existing_indexes)
+    assert not index_exists(build_index_proposal('subject', ['id']), existing_indexes)
+    assert index_exists(build_index_proposal('mutation', ['subject_alias']), existing_indexes)
+    assert not index_exists(build_index_proposal('mutation', ['subject']), existing_indexes)
+    assert not index_exists(build_index_proposal('mutation', ['hugo_symbol']), existing_indexes)
+
+
+def test_index_advisor_index_exists_matches_expressions():
+    # Equivalent expression indexes count as existing whatever their name
+    existing_indexes = {'subject': {'subject_sex_upper_idx': 'CREATE INDEX subject_sex_upper_idx ON public.subject USING btree (upper((sex)::text))'},
+                        'mutation': {'mutation_hugo_symbol_idx': 'CREATE INDEX mutation_hugo_symbol_idx ON public.mutation '
+                                                                 'USING gin (upper(hugo_symbol) gin_trgm_ops)'}}
+    assert index_exists(build_index_proposal('subject', ['sex'], 'upper'), existing_indexes)
+    assert not index_exists(build_index_proposal('subject', ['sex'], 'trigram'), existing_indexes)
+    assert not index_exists(build_index_proposal('subject', ['sex']), existing_indexes)
+    assert index_exists(build_index_proposal('mutation', ['hugo_symbol'], 'trigram'), existing_indexes)
+    assert not index_exists(build_index_proposal('mutation', ['hugo_symbol'], 'upper'), existing_indexes)
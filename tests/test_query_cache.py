@@ -0,0 +1,44 @@
+from cda_api.classes.QueryCache import QueryCache
+from cda_api.classes.SQLiteCacheBackend import SQLiteCacheBackend
+
+
+def test_query_cache_lru_eviction():
+    cache = QueryCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+
+def test_query_cache_ttl():
+    cache = QueryCache(ttl=-1)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_query_cache_max_bytes():
+    cache = QueryCache(max_bytes=20)
+    cache.set('a', 'x' * 10)
+    cache.set('b', 'y' * 10)
+    assert cache.get('a') is None
+    assert cache.get('b') == 'y' * 10
+    cache.set('c', 'z' * 100)
+    assert cache.get('c') is None
+
+
+def test_query_cache_max_bytes_get_size():
+    cache = QueryCache(max_bytes=20, get_size=len)
+    cache.set('a', [1] * 15)
+    cache.set('b', [2] * 10)
+    assert cache.get('a') is None
+    assert cache.get('b') == [2] * 10
+    assert cache.total_bytes == 10
+
+
+def test_query_cache_sqlite_backend(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / 'query_cache.db'))
+    QueryCache(backend=backend).set('a', {'result': [1, 2, 3]})
+    assert QueryCache(backend=backend).get('a') == {'result': [1, 2, 3]}
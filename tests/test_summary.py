@@ -1,6 +1,12 @@
 from fastapi.testclient import TestClient
-from cda_api.db.query_builders import fetch_rows
-from cda_api import app, ColumnNotFound
+from cda_api.db.query_builders import fetch_rows, summary_query
+from cda_api.db.query_utilities import SUMMARY_CACHE
+from cda_api.db.filter_builder import get_qnode_filter_key
+from cda_api.db.release import get_release_fingerprint
+from cda_api.db.rollup import create_summary_rollup_table, replace_summary_rollups, summary_rollup, summary_rollup_exists, SUMMARY_ROLLUP_EXISTS_CACHE
+from cda_api.db.connection import session
+from cda_api.models import QNode
+from cda_api import app, ColumnNotFound, get_logger
 
 client = TestClient(app)
 
@@ -24,6 +30,146 @@ def test_summary_subject_endpoint_column_not_found():
     assert response.json() == expected_response_json
 
 
+def test_summary_subject_endpoint_equivalent_query():
+    response = client.post(
+        "/summary/subject",
+        json={"MATCH_ALL": ["sex = 'male'", "subject_id_alias < 100"]},
+    )
+    equivalent_response = client.post(
+        "/summary/subject",
+        json={"MATCH_ALL": ["subject_id_alias < 100", "sex = 'MALE'"]},
+    )
+    assert response.status_code == 200
+    assert equivalent_response.status_code == 200
+    assert response.json() == equivalent_response.json()
+
+
+def test_summary_subject_endpoint_include_sql():
+    response = client.post(
+        "/summary/subject",
+        json={"MATCH_ALL": ["subject_id_alias < 50"]},
+        params={'include_sql': False}
+    )
+    assert response.status_code == 200
+    assert response.json()['query_sql'] is None
+    # A summary cached without its SQL is rebuilt when the SQL is requested
+    sql_response = client.post(
+        "/summary/subject",
+        json={"MATCH_ALL": ["subject_id_alias < 50"]},
+    )
+    assert sql_response.status_code == 200
+    assert sql_response.json()['query_sql'].startswith('WITH')
+    assert sql_response.json()['result'] == response.json()['result']
+
+
+def test_summary_subject_endpoint_single_pass_statistics():
+    response = client.post(
+        "/summary/subject",
+        json={"MATCH_ALL": ["subject_id_alias <= 12"]},
+    )
+    assert response.status_code == 200
+    result = response.json()['result'][0]
+    assert result['total_count'] == 12
+    # Every categorical value (including NULL) is counted from the grouping sets
+    sex_counts = {category['sex']: category['count_result'] for category in result['sex_summary']}
+    assert sex_counts == {'male': 4, 'female': 4, None: 4}
+    year_of_birth_summary = result['year_of_birth_summary'][0]
+    assert (year_of_birth_summary['min'], year_of_birth_summary['max']) == (1921, 1932)
+    assert (year_of_birth_summary['lower_quartile'], year_of_birth_summary['median'], year_of_birth_summary['upper_quartile']) == (1923, 1926, 1929)
+    assert result['data_source'] == {'gdc': 6, 'pdc': 4, 'idc': 2}
+
+
+def test_summary_subject_endpoint_empty_qnode():
+    response = client.post(
+        "/summary/subject",
+        json={},
+    )
+    assert response.status_code == 200
+    assert response.json()['result'][0]['total_count'] == 20000
+
+
+def test_summary_subject_endpoint_uses_rollup():
+    log = get_logger()
+    db = session()
+    qnode = QNode(MATCH_ALL=["sex = 'rollup test'"])
+    qnode_key = get_qnode_filter_key('subject', qnode, log)
+    release = get_release_fingerprint(db)
+    rollup_summary = {'result': [{'total_count': -1}], 'query_sql': 'precomputed'}
+    try:
+        create_summary_rollup_table(db.connection())
+        replace_summary_rollups(db, release, {qnode_key: rollup_summary})
+        db.commit()
+        assert summary_query(db, 'subject', qnode, log) == rollup_summary
+        SUMMARY_CACHE.clear()
+        assert summary_query(db, 'subject', qnode, log, use_rollup=False)['result'][0]['total_count'] == 0
+    finally:
+        db.execute(summary_rollup.delete().where(summary_rollup.c.qnode_key == qnode_key))
+        db.commit()
+        SUMMARY_CACHE.clear()
+        db.close()
+
+
+def test_summary_rollup_exists_cached():
+    db = session()
+    try:
+        SUMMARY_ROLLUP_EXISTS_CACHE.clear()
+        table_exists = summary_rollup_exists(db)
+        assert SUMMARY_ROLLUP_EXISTS_CACHE.get('summary_rollup') == table_exists
+        # Later checks don't query the database
+        assert summary_rollup_exists(None) == table_exists
+    finally:
+        SUMMARY_ROLLUP_EXISTS_CACHE.clear()
+        db.close()
+
+
+def test_summary_subject_endpoint_approximate():
+    response = client.post(
+        "/summary/subject",
+        json={"MATCH_ALL": ["subject_id_alias >= 0", "year_of_birth > 0"]},
+        params={'approximate': True}
+    )
+    assert response.status_code == 200
+    result = response.json()['result'][0]
+    assert result['approximate']['sample_percent'] == 10
+    assert 0 < result['approximate']['sample_count'] < 20000
+    # Counts are scaled up from the sample and returned with their error bounds
+    assert abs(result['total_count'] - 20000) < 5000
+    assert all('count_error' in category for category in result['sex_summary'])
+    assert 'mean_error' in result['year_of_birth_summary'][0]
+    exact_response = client.post(
+        "/summary/subject",
+        json={"MATCH_ALL": ["subject_id_alias >= 0", "year_of_birth > 0"]},
+    )
+    assert exact_response.json()['result'][0]['total_count'] == 20000
+    assert 'approximate' not in exact_response.json()['result'][0]
+
+
+def test_summary_subject_endpoint_parallel():
+    qnode_json = {"MATCH_ALL": ["subject_id_alias < 5000", "file_id_alias < 30000"]}
+    response = client.post(
+        "/summary/subject",
+        json=qnode_json,
+    )
+    SUMMARY_CACHE.clear()
+    parallel_response = client.post(
+        "/summary/subject",
+        json=qnode_json,
+        params={'parallel': True}
+    )
+    assert parallel_response.status_code == 200
+    result = response.json()['result'][0]
+    parallel_result = parallel_response.json()['result'][0]
+    # Same keys in the same order (categorical summaries are unordered)
+    assert list(parallel_result) == list(result)
+    for key, value in result.items():
+        if isinstance(value, list) and (len(value) > 1):
+            assert sorted(map(str, parallel_result[key])) == sorted(map(str, value))
+        else:
+            assert parallel_result[key] == value
+    # One statement per component
+    assert parallel_response.json()['query_sql'].count('; ') > 1
+
+
 ################################ summary/file testing ################################
 def test_summary_file_endpoint_query_generation():
     response = client.post(
@@ -41,4 +187,17 @@ def test_summary_file_endpoint_column_not_found():
     )
     expected_response_json = {'detail': "Column Not Found: FAKE_COLUMN\n'FAKE_COLUMN'"}
     assert response.status_code == 404
-    assert response.json() == expected_response_json
\ No newline at end of file
+    assert response.json() == expected_response_json
+
+
+def test_summary_subject_endpoint_explain():
+    qnode_json = {"MATCH_ALL": ["subject_id_alias < 5000"]}
+    response = client.post("/summary/subject", json=qnode_json)
+    # Explain skips the cached summary so the query runs and gets profiled
+    explain_response = client.post("/summary/subject", json=qnode_json, params={'explain': True, 'parallel': True})
+    assert explain_response.status_code == 200
+    assert explain_response.json()['result'] == response.json()['result']
+    profile = explain_response.json()['profile']
+    assert list(profile['stages']) == ['parse', 'build', 'compile', 'execute', 'serialize']
+    assert 'Actual Total Time' in profile['plans']['summary']['Plan']
+    assert response.json()['profile'] is None
@@ -0,0 +1,67 @@
+from fastapi.testclient import TestClient
+from cda_api.classes.UniqueValueIndex import UniqueValueIndex
+from cda_api.db.query_utilities import UNIQUE_VALUES_CACHE
+from cda_api.db import query_builders
+from cda_api import app
+
+client = TestClient(app)
+
+
+def test_unique_value_index_search():
+    rows = [{'site': 'Brain', 'value_count': 3}, {'site': 'Breast', 'value_count': 2}, {'site': 'Lung', 'value_count': 1}, {'site': None, 'value_count': 4}]
+    value_index = UniqueValueIndex('site', rows)
+    assert value_index.search() == rows
+    assert value_index.search(prefix='BR') == rows[:2]
+    assert value_index.search(contains='n') == [rows[0], rows[2]]
+    assert value_index.search(prefix='b', contains='st') == [rows[1]]
+    assert value_index.search(prefix='x') == []
+
+
+################################ unique_values testing ################################
+def test_unique_values_endpoint_prefix():
+    response = client.post(
+        "/unique_values/primary_diagnosis_site",
+        params={'count': True, 'prefix': 'br', 'totalCount': True}
+    )
+    assert response.status_code == 200
+    assert response.json()['result'] == [{'primary_diagnosis_site': 'Brain', 'value_count': 7500},
+                                         {'primary_diagnosis_site': 'Breast', 'value_count': 7500}]
+    assert response.json()['total_row_count'] == 2
+
+
+def test_unique_values_endpoint_contains():
+    response = client.post(
+        "/unique_values/sex",
+        params={'contains': 'MAL', 'system': 'GDC'}
+    )
+    assert response.status_code == 200
+    assert response.json()['result'] == [{'sex': 'female'}, {'sex': 'male'}]
+
+
+def test_unique_values_endpoint_uncached_column(monkeypatch):
+    # Columns with too many unique values are searched in the database instead
+    monkeypatch.setattr(query_builders, 'UNIQUE_VALUES_CACHE_MAX_VALUES', 2)
+    UNIQUE_VALUES_CACHE.clear()
+    try:
+        response = client.post(
+            "/unique_values/primary_diagnosis_site",
+            params={'count': True, 'prefix': 'br', 'totalCount': True}
+        )
+    finally:
+        UNIQUE_VALUES_CACHE.clear()
+    assert response.status_code == 200
+    assert response.json()['result'] == [{'primary_diagnosis_site': 'Brain', 'value_count': 7500},
+                                         {'primary_diagnosis_site': 'Breast', 'value_count': 7500}]
+    assert response.json()['total_row_count'] == 2
+
+
+def test_unique_values_cache_max_bytes(monkeypatch):
+    # Indexes larger than UNIQUE_VALUES_CACHE_MAX_BYTES are searched but never cached
+    monkeypatch.setattr(UNIQUE_VALUES_CACHE, 'max_bytes', 10)
+    UNIQUE_VALUES_CACHE.clear()
+    try:
+        response = client.post("/unique_values/sex", params={'system': 'GDC'})
+        assert response.status_code == 200
+        assert len(UNIQUE_VALUES_CACHE) == 0
+    finally:
+        UNIQUE_VALUES_CACHE.clear()